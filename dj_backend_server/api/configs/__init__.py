@@ -1 +1 @@
-from .base import PINECONE_NAMESPACE, PINECONE_TEXT_KEY, VECTOR_STORE_INDEX_NAME
\ No newline at end of file
+from .base import PINECONE_NAMESPACE, PINECONE_TEXT_KEY, VECTOR_STORE_INDEX_NAME, CHAT_SERVICE_MODE, CHAT_SERVICE_URL
\ No newline at end of file
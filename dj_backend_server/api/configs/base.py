@@ -4,8 +4,14 @@ VECTOR_STORE_INDEX_NAME = os.environ.get('VECTOR_STORE_INDEX_NAME', 'dummy')
 PINECONE_NAMESPACE = 'bot-test'
 PINECONE_TEXT_KEY = 'text'
 
+# local: api/chat/send/ answers in-process, remote: it calls CHAT_SERVICE_URL (split deployments)
+CHAT_SERVICE_MODE = os.environ.get('CHAT_SERVICE_MODE', 'local')
+CHAT_SERVICE_URL = os.environ.get('CHAT_SERVICE_URL', 'http://localhost:8000/api/chat/')
+
 __all__ = [
   'VECTOR_STORE_INDEX_NAME',
   'PINECONE_NAMESPACE',
   'PINECONE_TEXT_KEY',
+  'CHAT_SERVICE_MODE',
+  'CHAT_SERVICE_URL',
 ]
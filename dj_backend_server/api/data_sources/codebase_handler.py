@@ -1,30 +1,66 @@
 # views.py
-from django.http import JsonResponse
+import hashlib
 from django.views.decorators.csrf import csrf_exempt
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from api.utils import get_embeddings
-from langchain.document_loaders import GitLoader
+from api.utils.chunk_ledger import ChunkLedger, get_ingested_file_hashes
+from api.utils.codebase_ingestion import CodebaseLoader, RepositoryFile, checkout_repository, list_repository_files
+from api.utils.ingestion_shards import IngestionPlan, SHARD_FILES, group_by_directory
 from api.utils import init_vector_store
 from api.interfaces import StoreOptions
+from web.models.jobs import JobStage
+from web.services.ingestion_jobs import report_stage
 
-# https://python.langchain.com/docs/integrations/document_loaders/git
 @csrf_exempt
 def codebase_handler(repo_path: str, namespace: str):
-    try:
-        folder_path = f"website_data_sources/{namespace}"
-        loader = GitLoader(repo_path=folder_path, clone_url=repo_path, branch="master")
+    folder_path = f"website_data_sources/{namespace}"
+    data_source_id = hashlib.sha1(repo_path.encode()).hexdigest()
 
-        raw_docs = loader.load()
+    # Shallow clone of the default branch, a later ingestion only fetches its new tip
+    report_stage(JobStage.FETCH)
+    checkout_repository(clone_url=repo_path, repo_path=folder_path)
+    files = list_repository_files(folder_path)
 
-        print('Loaded documents')
+    # Files whose git blob id did not change since the last ingestion keep their vectors without being read
+    ingested = get_ingested_file_hashes(namespace, data_source_id)
+    changed = [file for file in files if ingested.get(file.path) != file.blob_id]
+    unchanged = [file.path for file in files if ingested.get(file.path) == file.blob_id]
+    print(f'{len(files)} files to index, {len(changed)} changed')
 
-        text_splitter = RecursiveCharacterTextSplitter(separators=["\n"], chunk_size=1000, chunk_overlap=200,length_function=len)
-        docs = text_splitter.split_documents(raw_docs)
+    # Files are read and split on a process pool, with language aware separators, and embedded as a stream
+    report_stage(JobStage.PARSE)
+    docs = CodebaseLoader(folder_path).iter_documents(changed)
 
-        embeddings = get_embeddings()
+    embeddings = get_embeddings()
 
-        init_vector_store(docs, embeddings, options=StoreOptions(namespace))
+    stats = init_vector_store(docs, embeddings, options=StoreOptions(namespace), data_source_id=data_source_id, unchanged_sources=unchanged)
 
-        print('Indexed documents. all done!')
-    except Exception as e:
-        print(e)
\ No newline at end of file
+    print('Indexed documents. all done!')
+    return stats
+
+
+def plan_codebase_shards(repo_path: str, namespace: str, run_id: str) -> IngestionPlan:
+    """Checks the repository out and splits its changed files into shards of directory subtrees.
+
+    Unchanged files are kept for the run right away, the shards only load the changed ones.
+    Every worker reads the checkout from the shared website_data_sources volume.
+    """
+    folder_path = f"website_data_sources/{namespace}"
+    data_source_id = hashlib.sha1(repo_path.encode()).hexdigest()
+
+    report_stage(JobStage.FETCH)
+    checkout_repository(clone_url=repo_path, repo_path=folder_path)
+    files = list_repository_files(folder_path)
+
+    ingested = get_ingested_file_hashes(namespace, data_source_id)
+    changed = [file for file in files if ingested.get(file.path) != file.blob_id]
+    ChunkLedger(namespace, data_source_id, run_id=run_id).keep_sources(file.path for file in files if ingested.get(file.path) == file.blob_id)
+
+    shards = [
+        {'files': [[file.path, file.blob_id, file.size] for file in batch]}
+        for batch in group_by_directory(changed, SHARD_FILES, path=lambda file: file.path)
+    ]
+    return IngestionPlan(data_source_id=data_source_id, shards=shards)
+
+
+def load_codebase_shard(namespace: str, shard: dict):
+    return CodebaseLoader(f"website_data_sources/{namespace}").iter_documents([RepositoryFile(*file) for file in shard['files']])
@@ -3,32 +3,72 @@ import json
 from django.views.decorators.csrf import csrf_exempt
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from api.utils import get_embeddings
-from langchain.document_loaders.directory import DirectoryLoader
+from api.utils.document_stream import split_documents
+from api.utils.ingestion_shards import IngestionPlan, SHARD_PAGES, batched
+from api.utils.pdf_extraction import PageRange, PdfExtractor
 from api.utils import init_vector_store
-from langchain.document_loaders import PyPDFium2Loader
+from pathlib import Path
 import os
+from web.models.pdf_data_sources import PdfDataSource
 from web.utils.delete_foler import delete_folder
 from api.interfaces import StoreOptions
+from web.models.jobs import JobStage
+from web.services.ingestion_jobs import report_stage
 @csrf_exempt
 def pdf_handler(shared_folder: str, namespace: str):
-    try:
-        directory_path = os.path.join("website_data_sources", shared_folder)
+    # Errors propagate, the ingestion job retries and finally records them
+    report_stage(JobStage.FETCH)
+    directory_path = os.path.join("website_data_sources", shared_folder)
 
-        directory_loader = DirectoryLoader(path=directory_path, glob="**/*.pdf", loader_cls=PyPDFium2Loader, use_multithreading=True)
+    # Pages are extracted on a process pool and streamed in order, each chunk keeps its page number
+    paths = sorted(str(path) for path in Path(directory_path).glob("**/*.pdf"))
+    report_stage(JobStage.PARSE)
+    raw_docs = PdfExtractor(on_progress=progress_reporter(shared_folder)).iter_documents(paths)
 
-        raw_docs = directory_loader.load_and_split()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200,length_function=len)
+    docs = split_documents(raw_docs, text_splitter)
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200,length_function=len)
-        docs = text_splitter.split_documents(raw_docs)
+    embeddings = get_embeddings()
 
-        embeddings = get_embeddings()
+    stats = init_vector_store(docs, embeddings, StoreOptions(namespace), data_source_id=shared_folder)
 
-        init_vector_store(docs, embeddings, StoreOptions(namespace))
-        
-        delete_folder(folder_path=directory_path)
-        print('All is done, folder deleted')
+    delete_folder(folder_path=directory_path)
+    print('All is done, folder deleted')
+    return stats
 
-    except Exception as e:
-        import traceback
-        print(e)
-        traceback.print_exc()
+
+def plan_pdf_shards(shared_folder: str) -> IngestionPlan:
+    """Splits the upload into shards of about INGESTION_SHARD_PAGES pages, a large PDF spans several."""
+    directory_path = os.path.join("website_data_sources", shared_folder)
+    paths = sorted(str(path) for path in Path(directory_path).glob("**/*.pdf"))
+    ranges = PdfExtractor().plan(paths)
+    shards = [
+        {'ranges': [[task.path, task.start, task.stop, task.total_pages] for task in batch]}
+        for batch in batched(ranges, SHARD_PAGES, weight=lambda task: task.stop - task.start)
+    ]
+    return IngestionPlan(data_source_id=shared_folder, shards=shards)
+
+
+def load_pdf_shard(shard: dict, on_progress=None):
+    ranges = [PageRange(*task) for task in shard['ranges']]
+    raw_docs = PdfExtractor(on_progress=on_progress).iter_page_ranges(ranges)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200,length_function=len)
+    return split_documents(raw_docs, text_splitter)
+
+
+def finish_pdf_ingestion(shared_folder: str) -> None:
+    delete_folder(folder_path=os.path.join("website_data_sources", shared_folder))
+
+
+
+def progress_reporter(shared_folder: str):
+    """Stores the extraction progress on the PdfDataSource, whenever it moved by a percent."""
+    last_progress = [-1.0]
+
+    def on_progress(pages_done: int, total_pages: int):
+        progress = round(min(pages_done / total_pages * 100, 100), 2) if total_pages else 100.0
+        if progress - last_progress[0] >= 1 or progress == 100:
+            last_progress[0] = progress
+            PdfDataSource.objects.filter(folder_name=shared_folder).update(ingest_progress=progress)
+
+    return on_progress
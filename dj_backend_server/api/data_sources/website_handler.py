@@ -1,39 +1,43 @@
 import os
 from django.http import JsonResponse
 
-from langchain.document_loaders.directory import DirectoryLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.document_loaders import TextLoader
 from api.utils import init_vector_store
 from api.utils.get_embeddings import get_embeddings
+from api.utils.document_stream import iter_directory_documents, iter_file_documents, list_directory_files, split_documents
+from api.utils.ingestion_shards import IngestionPlan, SHARD_FILES, batched
 from api.interfaces import StoreOptions
 # from  import delete_folder
-from web.models.website_data_sources import WebsiteDataSource
-from web.enums.website_data_source_status_enum import WebsiteDataSourceStatusType
+from web.models.jobs import JobStage
+from web.services.ingestion_jobs import report_stage
 def website_handler(shared_folder, namespace):
-    website_data_source = WebsiteDataSource.objects.get(id=shared_folder)
-    try:
-        directory_path = os.path.join("website_data_sources", shared_folder)
-        directory_loader = DirectoryLoader(directory_path, glob="**/*.txt", loader_cls=TextLoader, use_multithreading=True)
+    # The ingestion job sets the crawling status once it succeeded or ran out of retries
+    report_stage(JobStage.PARSE)
+    directory_path = os.path.join("website_data_sources", shared_folder)
+    raw_docs = iter_directory_documents(directory_path, glob="**/*.txt", loader_cls=TextLoader)
 
-        raw_docs = directory_loader.load()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    # Pages are loaded, split and embedded as a stream, never all at once
+    docs = split_documents(raw_docs, text_splitter)
 
-        docs = text_splitter.split_documents(raw_docs)
+    embeddings = get_embeddings()
 
-        print("docs -->", docs);
-        embeddings = get_embeddings()
+    stats = init_vector_store(docs, embeddings, StoreOptions(namespace=namespace), data_source_id=shared_folder)
 
-        init_vector_store(docs, embeddings, StoreOptions(namespace=namespace))
+    # delete_folder(folder_path=directory_path)
+    print('All is done, folder deleted...')
+    return stats
 
-        website_data_source.crawling_status = WebsiteDataSourceStatusType.COMPLETED.value
-        website_data_source.save()
-        # delete_folder(folder_path=directory_path)
-        print('All is done, folder deleted...')
-    except Exception as e:
-        website_data_source.crawling_status = WebsiteDataSourceStatusType.FAILED.value
-        website_data_source.save()
-        import traceback
-        print(e)
-        traceback.print_exc()
+
+def plan_website_shards(shared_folder):
+    """Splits the crawled pages into shards of INGESTION_SHARD_FILES pages."""
+    paths = list_directory_files(os.path.join("website_data_sources", shared_folder), glob="**/*.txt")
+    return IngestionPlan(data_source_id=shared_folder, shards=[{'paths': batch} for batch in batched(paths, SHARD_FILES)])
+
+
+def load_website_shard(shard):
+    raw_docs = iter_file_documents(shard['paths'], loader_cls=TextLoader)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    return split_documents(raw_docs, text_splitter)
@@ -3,3 +3,4 @@ from enum import Enum
 class StoreType(Enum):
   PINECONE = 'PINECONE'
   QDRANT = 'QDRANT'
+  LOCAL = 'LOCAL'
@@ -0,0 +1 @@
+from . import chat_service
\ No newline at end of file
@@ -0,0 +1,312 @@
+import hashlib
+import os
+from typing import AsyncIterator, Iterator, Optional
+
+from django.utils import timezone
+from dotenv import load_dotenv
+from langchain import QAWithSourcesChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+
+from api.interfaces import StoreOptions
+from api.utils.conversation_context import build_chat_context, abuild_chat_context
+from api.utils.get_embeddings import get_embeddings
+from api.utils.llm_usage import get_llm_metrics_handler
+from api.utils.make_chain import get_chain
+from api.utils.metrics import timed_stage
+from api.utils.question_rewriter import rewrite_question, arewrite_question
+from api.utils.semantic_cache import semantic_answer_cache, is_semantic_cache_enabled
+from api.utils.single_flight import flight_key, is_single_flight_enabled, single_flight
+from api.utils.streaming import stream_chain, astream_chain
+from web.models.chatbot import Chatbot
+from web.services.chat_history_sink import ChatHistoryRecord, chat_history_sink
+from web.services.chat_history_service import get_chat_history_for_retrieval_chain, aget_chat_history_for_retrieval_chain, update_cached_chat_history, aupdate_cached_chat_history
+
+load_dotenv()
+
+# In-process chat pipeline shared by api/chat/ and api/chat/send/, the widget endpoint
+# no longer needs a loopback HTTP call (and a second worker) to answer a message.
+
+
+def sanitize_question(question: str) -> str:
+    return question.strip().replace('\n', ' ')
+
+
+def answer_question(bot: Chatbot, question: str, session_id: str, namespace: str, mode: str, initial_prompt: str) -> str:
+    """Answers the question for the bot and stores both messages in the session history."""
+    asked_at = timezone.now()
+    sanitized_question = sanitize_question(question)
+    store_options = StoreOptions(namespace=namespace)
+    chat_history = get_chat_history(session_id)
+
+    cache_lookup = lookup_cached_answer(store_options, mode, initial_prompt, sanitized_question, chat_history)
+    if cache_lookup.answer is not None:
+        response_text = cache_lookup.answer
+    else:
+        response_text = coalesce(
+            get_flight_key(store_options, mode, initial_prompt, sanitized_question, chat_history),
+            lambda: get_completion_response(store_options=store_options, mode=mode, initial_prompt=initial_prompt, sanitized_question=sanitized_question, chat_history=chat_history),
+        )
+        cache_lookup.store(response_text)
+
+    save_chat_history(bot=bot, sanitized_question=sanitized_question, response_text=response_text, session_id=session_id, asked_at=asked_at)
+    return response_text
+
+
+def stream_answer(bot: Chatbot, question: str, session_id: str, namespace: str, mode: str, initial_prompt: str) -> Iterator[str]:
+    """Yields the answer token by token, the history is stored once the stream is exhausted."""
+    asked_at = timezone.now()
+    sanitized_question = sanitize_question(question)
+    store_options = StoreOptions(namespace=namespace)
+    chat_history = get_chat_history(session_id)
+
+    cache_lookup = lookup_cached_answer(store_options, mode, initial_prompt, sanitized_question, chat_history)
+    if cache_lookup.answer is not None:
+        yield cache_lookup.answer
+        response_text = cache_lookup.answer
+    else:
+        tokens = []
+        flight = begin_flight(get_flight_key(store_options, mode, initial_prompt, sanitized_question, chat_history))
+        # A duplicate of a question being answered right now gets the whole answer in one piece
+        shared_text = flight.wait() if flight and not flight.is_leader else None
+        if shared_text is not None:
+            tokens.append(shared_text)
+            yield shared_text
+        else:
+            try:
+                for token in get_completion_stream(store_options=store_options, mode=mode, initial_prompt=initial_prompt, sanitized_question=sanitized_question, chat_history=chat_history):
+                    tokens.append(token)
+                    yield token
+            except BaseException as e:
+                if flight and flight.is_leader:
+                    flight.fail(e)
+                raise
+            if flight and flight.is_leader:
+                flight.complete(''.join(tokens))
+        response_text = ''.join(tokens)
+        cache_lookup.store(response_text)
+
+    save_chat_history(bot=bot, sanitized_question=sanitized_question, response_text=response_text, session_id=session_id, asked_at=asked_at)
+
+
+async def aanswer_question(bot: Chatbot, question: str, session_id: str, namespace: str, mode: str, initial_prompt: str) -> str:
+    """Async variant of answer_question."""
+    asked_at = timezone.now()
+    sanitized_question = sanitize_question(question)
+    store_options = StoreOptions(namespace=namespace)
+    chat_history = await aget_chat_history(session_id)
+
+    cache_lookup = await alookup_cached_answer(store_options, mode, initial_prompt, sanitized_question, chat_history)
+    if cache_lookup.answer is not None:
+        response_text = cache_lookup.answer
+    else:
+        response_text = await acoalesce(
+            get_flight_key(store_options, mode, initial_prompt, sanitized_question, chat_history),
+            lambda: aget_completion_response(store_options=store_options, mode=mode, initial_prompt=initial_prompt, sanitized_question=sanitized_question, chat_history=chat_history),
+        )
+        cache_lookup.store(response_text)
+
+    await asave_chat_history(bot=bot, sanitized_question=sanitized_question, response_text=response_text, session_id=session_id, asked_at=asked_at)
+    return response_text
+
+
+async def astream_answer(bot: Chatbot, question: str, session_id: str, namespace: str, mode: str, initial_prompt: str) -> AsyncIterator[str]:
+    """Async variant of stream_answer."""
+    asked_at = timezone.now()
+    sanitized_question = sanitize_question(question)
+    store_options = StoreOptions(namespace=namespace)
+    chat_history = await aget_chat_history(session_id)
+
+    cache_lookup = await alookup_cached_answer(store_options, mode, initial_prompt, sanitized_question, chat_history)
+    if cache_lookup.answer is not None:
+        yield cache_lookup.answer
+        response_text = cache_lookup.answer
+    else:
+        tokens = []
+        flight = await abegin_flight(get_flight_key(store_options, mode, initial_prompt, sanitized_question, chat_history))
+        shared_text = await flight.await_result() if flight and not flight.is_leader else None
+        if shared_text is not None:
+            tokens.append(shared_text)
+            yield shared_text
+        else:
+            try:
+                async for token in aget_completion_stream(store_options=store_options, mode=mode, initial_prompt=initial_prompt, sanitized_question=sanitized_question, chat_history=chat_history):
+                    tokens.append(token)
+                    yield token
+            except BaseException as e:
+                if flight and flight.is_leader:
+                    await flight.afail(e)
+                raise
+            if flight and flight.is_leader:
+                await flight.acomplete(''.join(tokens))
+        response_text = ''.join(tokens)
+        cache_lookup.store(response_text)
+
+    await asave_chat_history(bot=bot, sanitized_question=sanitized_question, response_text=response_text, session_id=session_id, asked_at=asked_at)
+
+
+class CacheLookup:
+    """Result of a semantic cache lookup, a miss can store the freshly computed answer."""
+
+    def __init__(self, store_options: StoreOptions = None, prompt_key: str = None, question: str = None, vector=None, answer: Optional[str] = None):
+        self.store_options = store_options
+        self.prompt_key = prompt_key
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+
+    def store(self, answer: str) -> None:
+        if self.vector is not None and answer:
+            semantic_answer_cache.store(self.store_options.namespace, self.prompt_key, self.question, self.vector, answer)
+
+
+def lookup_cached_answer(store_options, mode, initial_prompt, sanitized_question, chat_history) -> CacheLookup:
+    # Follow-up questions depend on the conversation, only standalone first turns are cached
+    if not is_semantic_cache_enabled() or chat_history:
+        return CacheLookup()
+
+    with timed_stage('embedding'):
+        vector = get_embeddings().embed_query(sanitized_question)
+    return _lookup(store_options, mode, initial_prompt, sanitized_question, vector)
+
+
+async def alookup_cached_answer(store_options, mode, initial_prompt, sanitized_question, chat_history) -> CacheLookup:
+    if not is_semantic_cache_enabled() or chat_history:
+        return CacheLookup()
+
+    with timed_stage('embedding'):
+        vector = await get_embeddings().aembed_query(sanitized_question)
+    prompt_key = _get_prompt_key(mode, initial_prompt)
+    with timed_stage('cache_lookup'):
+        answer = await semantic_answer_cache.alookup(store_options.namespace, prompt_key, sanitized_question, vector)
+    return CacheLookup(store_options, prompt_key, sanitized_question, vector, answer)
+
+
+def _lookup(store_options, mode, initial_prompt, sanitized_question, vector) -> CacheLookup:
+    prompt_key = _get_prompt_key(mode, initial_prompt)
+    with timed_stage('cache_lookup'):
+        answer = semantic_answer_cache.lookup(store_options.namespace, prompt_key, sanitized_question, vector)
+    return CacheLookup(store_options, prompt_key, sanitized_question, vector, answer)
+
+
+def _get_prompt_key(mode, initial_prompt) -> str:
+    return hashlib.sha1(f"{mode}:{initial_prompt or ''}".encode('utf-8')).hexdigest()
+
+
+def get_flight_key(store_options, mode, initial_prompt, sanitized_question, chat_history) -> str:
+    """Identical questions with the same bot, prompt and conversation so far share one completion."""
+    prompt_key = _get_prompt_key(mode, initial_prompt)
+    normalized_question = ' '.join(sanitized_question.lower().split())
+    history_key = hashlib.sha1(_get_chat_history(chat_history).encode('utf-8')).hexdigest()
+    return flight_key(store_options.namespace, prompt_key, normalized_question, history_key)
+
+
+def begin_flight(key: str):
+    return single_flight.begin(key) if is_single_flight_enabled() else None
+
+
+async def abegin_flight(key: str):
+    return await single_flight.abegin(key) if is_single_flight_enabled() else None
+
+
+def coalesce(key: str, compute) -> str:
+    # Concurrent duplicates (a burst of users asking the same thing) wait for one completion
+    if not is_single_flight_enabled():
+        return compute()
+    return single_flight.do(key, compute)
+
+
+async def acoalesce(key: str, compute) -> str:
+    if not is_single_flight_enabled():
+        return await compute()
+    return await single_flight.ado(key, compute)
+
+
+def uses_chat_history() -> bool:
+    return os.getenv("CHAIN_TYPE", "conversation_retrieval") == 'conversation_retrieval'
+
+
+def get_chat_history(session_id):
+    if not uses_chat_history():
+        return []
+    # The window of recent turns is trimmed to the token budget, older turns come in as a summary
+    with timed_stage('history_fetch'):
+        return build_chat_context(session_id, get_chat_history_for_retrieval_chain(session_id, limit=40))
+
+
+async def aget_chat_history(session_id):
+    if not uses_chat_history():
+        return []
+    with timed_stage('history_fetch'):
+        return await abuild_chat_context(session_id, await aget_chat_history_for_retrieval_chain(session_id, limit=40))
+
+
+def build_chat_history_record(bot, sanitized_question, response_text, session_id, asked_at=None) -> ChatHistoryRecord:
+    asked_at = asked_at or timezone.now()
+    latency_ms = int((timezone.now() - asked_at).total_seconds() * 1000)
+    return ChatHistoryRecord(chatbot_id=bot.id, session_id=session_id, question=sanitized_question, answer=response_text, latency_ms=latency_ms, asked_at=asked_at)
+
+
+def save_chat_history(bot, sanitized_question, response_text, session_id, asked_at=None):
+    # The insert itself happens behind the response, see chat_history_sink
+    record = build_chat_history_record(bot, sanitized_question, response_text, session_id, asked_at)
+    with timed_stage('history_write'):
+        chat_history_sink.record(record)
+        update_cached_chat_history(session_id, record.to_entries())
+
+
+async def asave_chat_history(bot, sanitized_question, response_text, session_id, asked_at=None):
+    record = build_chat_history_record(bot, sanitized_question, response_text, session_id, asked_at)
+    with timed_stage('history_write'):
+        await chat_history_sink.arecord(record)
+        await aupdate_cached_chat_history(session_id, record.to_entries())
+
+
+def get_chain_inputs(chain_type, mode, sanitized_question, chat_history, callbacks=None) -> dict:
+    if chain_type == 'retrieval_qa':
+        return {"question": sanitized_question}
+    # The question is made standalone up front (when needed at all), the chain then skips its condense step
+    return {"question": rewrite_question(sanitized_question, chat_history, mode, callbacks=callbacks), "chat_history": []}
+
+
+async def aget_chain_inputs(chain_type, mode, sanitized_question, chat_history, callbacks=None) -> dict:
+    if chain_type == 'retrieval_qa':
+        return {"question": sanitized_question}
+    return {"question": await arewrite_question(sanitized_question, chat_history, mode, callbacks=callbacks), "chat_history": []}
+
+
+def get_completion_stream(store_options, mode, initial_prompt, sanitized_question, chat_history):
+    chain_type = os.getenv("CHAIN_TYPE", "conversation_retrieval")
+    chain = get_chain(chain_type, store_options, mode, initial_prompt, streaming=True)
+    # Token usage and the retrieval and LLM timings are recorded per bot, the namespace is the bot id
+    callbacks = [get_llm_metrics_handler(store_options.namespace)]
+    return stream_chain(chain, get_chain_inputs(chain_type, mode, sanitized_question, chat_history, callbacks), callbacks=callbacks)
+
+
+def get_completion_response(store_options, mode, initial_prompt, sanitized_question, chat_history):
+    chain_type = os.getenv("CHAIN_TYPE", "conversation_retrieval")
+    chain: QAWithSourcesChain = get_chain(chain_type, store_options, mode, initial_prompt)
+    callbacks = [get_llm_metrics_handler(store_options.namespace)]
+    inputs = get_chain_inputs(chain_type, mode, sanitized_question, chat_history, callbacks)
+    with timed_stage('answer'):
+        response = chain(inputs, callbacks=callbacks, return_only_outputs=True)
+    return response['answer']
+
+
+async def aget_completion_stream(store_options, mode, initial_prompt, sanitized_question, chat_history):
+    chain_type = os.getenv("CHAIN_TYPE", "conversation_retrieval")
+    chain = get_chain(chain_type, store_options, mode, initial_prompt, streaming=True)
+    callbacks = [get_llm_metrics_handler(store_options.namespace)]
+    inputs = await aget_chain_inputs(chain_type, mode, sanitized_question, chat_history, callbacks)
+
+    async for token in astream_chain(chain, inputs, callbacks=callbacks):
+        yield token
+
+
+async def aget_completion_response(store_options, mode, initial_prompt, sanitized_question, chat_history):
+    chain_type = os.getenv("CHAIN_TYPE", "conversation_retrieval")
+    chain = get_chain(chain_type, store_options, mode, initial_prompt)
+    callbacks = [get_llm_metrics_handler(store_options.namespace)]
+    inputs = await aget_chain_inputs(chain_type, mode, sanitized_question, chat_history, callbacks)
+    with timed_stage('answer'):
+        response = await chain.acall(inputs, callbacks=callbacks, return_only_outputs=True)
+    return response['answer']
@@ -3,7 +3,59 @@ from api.data_sources.codebase_handler import codebase_handler
 from api.data_sources.website_handler import website_handler
 from api.data_sources.pdf_handler import pdf_handler
 from web.workers.crawler import start_recursive_crawler
+from api.utils.conversation_context import summarize_session
+from web.services.chat_history_sink import ChatHistoryRecord, write_chat_history_records
+from web.services.ingestion_jobs import (
+    MAX_RETRIES,
+    complete_sharded_job,
+    format_error,
+    get_retry_delay,
+    record_job_failure,
+    requeue_stale_jobs,
+    retry_job,
+    run_ingestion_job,
+    run_ingestion_shard,
+)
+
+# Acknowledged once done, a job of a worker that died is delivered again. The job row,
+# not celery, counts the attempts and decides on retries.
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=None)
+def ingestion_job_task(self, job_id):
+    try:
+        return run_ingestion_job(job_id)
+    except Exception as e:
+        countdown = record_job_failure(job_id, e)
+        if countdown is None:
+            raise
+        raise self.retry(exc=e, countdown=countdown)
+
+
+# A shard out of retries reports its error instead of raising, a failed header task would
+# keep celery from calling the chord's callback and the job would hang until the sweep.
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=MAX_RETRIES)
+def ingestion_shard_task(self, job_id, run_id, data_source_id, shard):
+    try:
+        return run_ingestion_shard(job_id, run_id, data_source_id, shard)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            return {'error': format_error(e)}
+        raise self.retry(exc=e, countdown=get_retry_delay(self.request.retries))
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def ingestion_shards_done_task(results, job_id, run_id, data_source_id):
+    try:
+        return complete_sharded_job(job_id, run_id, data_source_id, results)
+    except Exception as e:
+        return retry_job(job_id, format_error(e))
+
 
+@shared_task
+def requeue_stale_ingestion_jobs_task():
+    return requeue_stale_jobs()
+
+
+# Kept for messages queued before the ingestion jobs, new ingestions go through ingestion_job_task
 @shared_task
 def pdf_handler_task(shared_folder, namespace):
     return pdf_handler(shared_folder=shared_folder, namespace=namespace)
@@ -21,3 +73,18 @@ def codebase_handler_task(repo_path, namespace):
 @shared_task
 def start_recursive_crawler_task(sender, data_source_id, chatbot_id):
     return start_recursive_crawler(data_source_id, chatbot_id)
+
+
+# Records carry their row ids, a retried batch inserts nothing twice
+@shared_task(bind=True, max_retries=5)
+def save_chat_history_task(self, records):
+    try:
+        return write_chat_history_records([ChatHistoryRecord.from_dict(record) for record in records])
+    except Exception as e:
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+
+
+
+@shared_task
+def summarize_chat_session_task(session_id):
+    return summarize_session(session_id)
\ No newline at end of file
@@ -1,3 +1,586 @@
-from django.test import TestCase
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings import FakeEmbeddings
+
+from api.utils.admission import AdmissionRejected, InFlightLimiter, RateLimiter, release_when_done
+from api.utils.chunk_ledger import ChunkLedger
+from api.utils.codebase_ingestion import CodebaseLoader, RepositoryFile
+from api.utils.embedding_pipeline import EmbeddingBatch, VectorStoreWriter
+from api.utils.hybrid_retriever import exact_terms
+from api.utils.local_vector_store import LocalVectorStore, LocalVectorStoreWriter, _read_manifest
+from api.utils.pdf_extraction import PdfExtractor
+from api.utils.single_flight import FOLLOWER, LEADER, REMOTE, SingleFlight, _lock_key, _result_key
+from api.views.views_metrics import metrics
+from web.models.ingested_chunks import IngestedChunk
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api-tests'}}
+
+
+def run_in_daemon_process(fn):
+    """Runs fn in a daemonic child, like a task of a Celery prefork worker, returns ('ok', result) or ('error', repr)."""
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+
+    def target():
+        try:
+            results.put(('ok', fn()))
+        except BaseException as e:
+            results.put(('error', repr(e)))
+
+    process = context.Process(target=target, daemon=True)
+    process.start()
+    try:
+        return results.get(timeout=60)
+    finally:
+        process.join(5)
+
+
+def write_pdf(path, pages):
+    """Writes a minimal PDF with one line of text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(pages))
+
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = SingleFlight(wait_timeout=2, result_ttl=10, poll_interval=0.01)
+
+    def test_concurrent_callers_share_one_computation(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(2)
+            return 'answer'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(self.group.do('key', compute)))
+        leader.start()
+        started.wait(2)
+        followers = [threading.Thread(target=lambda: results.append(self.group.do('key', compute))) for _ in range(5)]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(2)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['answer'] * 6)
+        self.assertEqual(cache.get(_result_key('key')), 'answer')
+        self.assertIsNone(cache.get(_lock_key('key')))
+
+    def test_leader_failure_reaches_the_followers(self):
+        leader = self.group.begin('key')
+        follower = self.group.begin('key')
+        self.assertEqual((leader.role, follower.role), (LEADER, FOLLOWER))
+
+        leader.fail(ValueError('boom'))
+
+        with self.assertRaises(ValueError):
+            follower.wait()
+        # Nothing was published and the lock is free for the next caller
+        self.assertIsNone(cache.get(_result_key('key')))
+        self.assertEqual(self.group.begin('key').role, LEADER)
+
+    def test_cancelled_leader_lets_the_followers_compute(self):
+        async def scenario():
+            leader_started = asyncio.Event()
+
+            async def slow():
+                leader_started.set()
+                await asyncio.sleep(10)
+                return 'never'
+
+            async def fast():
+                return 'own'
+
+            leader = asyncio.create_task(self.group.ado('key', slow))
+            await leader_started.wait()
+            follower = asyncio.create_task(self.group.ado('key', fast))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+        self.assertEqual(asyncio.run(scenario()), 'own')
+        self.assertIsNone(cache.get(_lock_key('key')))
+
+    def test_remote_leader_result_is_shared(self):
+        cache.add(_lock_key('key'), 'other-process')
+        flight = self.group.begin('key')
+        self.assertEqual(flight.role, REMOTE)
+
+        threading.Timer(0.05, lambda: cache.set(_result_key('key'), 'remote answer')).start()
+        self.assertEqual(flight.wait(), 'remote answer')
+
+    def test_remote_leader_timeout_returns_none(self):
+        group = SingleFlight(wait_timeout=0.1, result_ttl=10, poll_interval=0.01)
+        cache.add(_lock_key('key'), 'other-process')
+
+        started_at = time.monotonic()
+        self.assertEqual(group.do('key', lambda: 'computed here'), 'computed here')
+        self.assertLess(time.monotonic() - started_at, 1)
+
+    def test_remote_leader_timeout_async(self):
+        group = SingleFlight(wait_timeout=0.1, result_ttl=10, poll_interval=0.01)
+        cache.add(_lock_key('key'), 'other-process')
+
+        async def compute():
+            return 'computed here'
+
+        self.assertEqual(asyncio.run(group.ado('key', compute)), 'computed here')
+
+    def test_async_callers_share_one_computation(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'answer'
+
+        async def scenario():
+            return await asyncio.gather(*(self.group.ado('key', compute) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(scenario()), ['answer'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get(_result_key('key')), 'answer')
+        self.assertIsNone(cache.get(_lock_key('key')))
+
+    def test_published_result_is_used_without_waiting(self):
+        cache.add(_lock_key('key'), 'other-process')
+        cache.set(_result_key('key'), 'done already')
+
+        flight = self.group.begin('key')
+        self.assertEqual(flight.role, FOLLOWER)
+        self.assertEqual(flight.wait(), 'done already')
+
+
+class ExactTermsTests(SimpleTestCase):
+    def test_identifiers_are_exact_terms(self):
+        self.assertEqual(exact_terms('why does max_retries fail in fetchData'), ['max_retries', 'fetchData'])
+        self.assertEqual(exact_terms('error E1234 from os.path.join'), ['E1234', 'os.path.join'])
+
+    def test_backticked_terms_are_kept_as_they_are(self):
+        self.assertEqual(exact_terms('what does `run` do'), ['run'])
+
+    def test_versions_and_abbreviations_are_not_exact_terms(self):
+        self.assertEqual(exact_terms('what changed in 3.5, e.g. the v2 api?'), [])
+        self.assertEqual(exact_terms('the v2.0 release, i.e. `3.14`'), [])
+
+
+class InFlightLimiterTests(SimpleTestCase):
+    def test_waiter_gets_the_released_slot(self):
+        limiter = InFlightLimiter(max_in_flight=1, max_queue=1, queue_timeout=2)
+        slot = limiter.acquire()
+        threading.Timer(0.05, slot.release).start()
+
+        limiter.acquire().release()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_queue_timeout_rejects_and_leaves_the_queue(self):
+        limiter = InFlightLimiter(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+        slot = limiter.acquire()
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            limiter.acquire()
+        self.assertEqual((raised.exception.status, raised.exception.reason), (503, 'queue_timeout'))
+
+        slot.release()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_full_queue_rejects_right_away(self):
+        limiter = InFlightLimiter(max_in_flight=1, max_queue=0, queue_timeout=2)
+        limiter.acquire()
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            limiter.acquire()
+        self.assertEqual(raised.exception.reason, 'queue_full')
+
+    def test_slot_handed_over_as_the_wait_times_out_is_kept(self):
+        limiter = InFlightLimiter(max_in_flight=1, max_queue=1, queue_timeout=2)
+        slot = limiter.acquire()
+        waiter = threading.Event()
+        with limiter._lock:
+            limiter._enqueue(waiter)
+
+        # The wait timed out, but the release handed the slot over before the waiter gave up
+        slot.release()
+        handed_over = limiter._after_wait(waiter, False, time.perf_counter())
+        self.assertEqual(limiter.in_flight, 1)
+
+        handed_over.release()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        limiter = InFlightLimiter(max_in_flight=1, max_queue=1, queue_timeout=2)
+
+        async def scenario():
+            slot = await limiter.aacquire()
+            waiter = asyncio.create_task(limiter.aacquire())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(len(limiter._waiters), 0)
+            slot.release()
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_slot_handed_to_a_cancelled_waiter_is_released(self):
+        limiter = InFlightLimiter(max_in_flight=1, max_queue=1, queue_timeout=2)
+
+        async def scenario():
+            slot = await limiter.aacquire()
+            waiter = asyncio.create_task(limiter.aacquire())
+            await asyncio.sleep(0.01)
+            # Handed over and cancelled before the waiter runs again
+            slot.release()
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_slot_is_released_once(self):
+        limiter = InFlightLimiter(max_in_flight=2, max_queue=1, queue_timeout=2)
+        slot = limiter.acquire()
+        limiter.acquire()
+
+        slot.release()
+        slot.release()
+        self.assertEqual(limiter.in_flight, 1)
+
+
+class ReleaseWhenDoneTests(SimpleTestCase):
+    def setUp(self):
+        self.limiter = InFlightLimiter(max_in_flight=1, max_queue=1, queue_timeout=2)
+
+    def test_plain_response_releases_right_away(self):
+        release_when_done(HttpResponse('ok'), self.limiter.acquire())
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_stream_releases_once_sent(self):
+        response = release_when_done(StreamingHttpResponse(iter(['a', 'b'])), self.limiter.acquire())
+        self.assertEqual(self.limiter.in_flight, 1)
+
+        self.assertEqual(b''.join(response), b'ab')
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_stream_releases_when_closed_early(self):
+        response = release_when_done(StreamingHttpResponse(iter(['a', 'b'])), self.limiter.acquire())
+        next(iter(response))
+
+        response.close()
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_stream_releases_when_it_fails(self):
+        def failing():
+            yield 'a'
+            raise ValueError('boom')
+
+        response = release_when_done(StreamingHttpResponse(failing()), self.limiter.acquire())
+        with self.assertRaises(ValueError):
+            b''.join(response)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_async_stream_releases_once_sent(self):
+        async def stream():
+            yield 'a'
+            yield 'b'
+
+        async def consume(response):
+            return b''.join([part async for part in response])
+
+        response = release_when_done(StreamingHttpResponse(stream()), self.limiter.acquire())
+        self.assertEqual(asyncio.run(consume(response)), b'ab')
+        self.assertEqual(self.limiter.in_flight, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RateLimiterTests(SimpleTestCase):
+    def test_burst_then_wait(self):
+        limiter = RateLimiter()
+        buckets = [('bot', 1, 2)]
+
+        self.assertEqual(limiter.acquire(buckets), 0)
+        self.assertEqual(limiter.acquire(buckets), 0)
+        self.assertGreater(limiter.acquire(buckets), 0)
+
+    def test_empty_bucket_takes_no_token_from_the_others(self):
+        limiter = RateLimiter()
+        limiter.acquire([('session', 1, 1)])
+
+        self.assertGreater(limiter.acquire([('bot', 1, 1), ('session', 1, 1)]), 0)
+        self.assertEqual(limiter.acquire([('bot', 1, 1)]), 0)
+
+    def test_disabled_bucket_is_ignored(self):
+        self.assertEqual(RateLimiter().acquire([('bot', 0, 0)]), 0)
+
+
+class MetricsViewTests(SimpleTestCase):
+    def get(self, **headers):
+        return metrics(RequestFactory().get('/api/metrics/', **headers))
+
+    def test_closed_without_a_token(self):
+        with mock.patch.dict(os.environ, {'METRICS_TOKEN': ''}):
+            self.assertEqual(self.get().status_code, 403)
+
+    def test_requires_the_token(self):
+        with mock.patch.dict(os.environ, {'METRICS_TOKEN': 'secret'}):
+            self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_samples_of_every_process_are_exported(self):
+        # Multiprocess mode is picked when prometheus_client is imported, hence the fresh interpreter
+        script = (
+            "import multiprocessing\n"
+            "import django\n"
+            "django.setup()\n"
+            "from api.utils.metrics import LLM_TOKENS, render_metrics\n"
+            "record = lambda: LLM_TOKENS.labels(bot='bot', model='model', type='prompt').inc(5)\n"
+            "worker = multiprocessing.get_context('fork').Process(target=record)\n"
+            "worker.start()\n"
+            "worker.join()\n"
+            "record()\n"
+            "print(render_metrics().decode())\n"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=60)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('openchat_llm_tokens_total{bot="bot",model="model",type="prompt"} 10.0', result.stdout)
+
+
+class PdfExtractorTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pages = [f'page {number}' for number in range(6)]
+        self.path = os.path.join(directory.name, 'upload.pdf')
+        write_pdf(self.path, self.pages)
+
+    def extract(self):
+        extractor = PdfExtractor(processes=2, pages_per_task=2)
+        return [(doc.metadata['page'], doc.page_content) for doc in extractor.iter_page_ranges(extractor.plan([self.path]))]
+
+    def test_pages_come_back_in_order(self):
+        self.assertEqual(self.extract(), list(enumerate(self.pages)))
+
+    def test_extracts_in_a_daemon_process(self):
+        # Celery's prefork workers can't start a process pool, the pages are extracted in process
+        self.assertEqual(run_in_daemon_process(self.extract), ('ok', list(enumerate(self.pages))))
+
+
+class CodebaseLoaderTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.repo_path = directory.name
+        self.files = []
+        for number in range(40):
+            path = f'module_{number}.py'
+            with open(os.path.join(self.repo_path, path), 'w') as f:
+                f.write(f'def function_{number}():\n    return {number}\n')
+            self.files.append(RepositoryFile(path=path, blob_id=f'blob{number}', size=0))
+
+    def load(self):
+        loader = CodebaseLoader(self.repo_path, processes=2, files_per_task=16)
+        return [doc.metadata['source'] for doc in loader.iter_documents(self.files)]
+
+    def test_files_come_back_in_order(self):
+        self.assertEqual(self.load(), [file.path for file in self.files])
+
+    def test_loads_in_a_daemon_process(self):
+        self.assertEqual(run_in_daemon_process(self.load), ('ok', [file.path for file in self.files]))
+
+
+class LocalVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.store = LocalVectorStore('bot', FakeEmbeddings(size=3), root=self.root)
+
+    def write(self, vectors, writer=None, commit=True):
+        """Upserts {id: vector}, the text of each chunk is its id."""
+        writer = writer or LocalVectorStoreWriter('bot', self.root, index_type='flat')
+        ids = list(vectors)
+        writer.upsert(EmbeddingBatch(texts=ids, metadatas=[{'id': vector_id} for vector_id in ids], ids=ids), list(vectors.values()))
+        if commit:
+            writer.commit()
+        return writer
+
+    def delete(self, ids):
+        writer = LocalVectorStoreWriter('bot', self.root)
+        writer.delete(ids)
+        writer.commit()
+
+    def search(self, vector, k=10, store=None):
+        return [doc.page_content for doc, _ in (store or self.store).similarity_search_with_score_by_vector(vector, k)]
+
+    def files(self):
+        return sorted(os.listdir(os.path.join(self.root, 'bot')))
+
+    def test_upsert_delete_and_re_add(self):
+        self.write({'a': [1, 0, 0], 'b': [0, 1, 0], 'c': [0, 0, 1]})
+        self.assertEqual(self.search([1, 0, 0], k=1), ['a'])
+
+        self.delete(['a'])
+        self.assertEqual(self.search([1, 0, 0]), ['b', 'c'])
+
+        # Re-adding an id supersedes its earlier row, even one that was not deleted
+        self.write({'a': [0.1, 1, 0], 'b': [1, 0, 0]})
+        self.assertEqual(self.search([0, 1, 0], k=1), ['a'])
+        self.assertEqual(self.search([1, 0, 0]), ['b', 'a', 'c'])
+
+    def test_compaction_keeps_open_snapshots_readable(self):
+        self.write({f'doc{number}': [1, number, 0] for number in range(10)})
+        self.assertEqual(len(self.search([1, 0, 0])), 10)
+        reader = LocalVectorStore('bot', FakeEmbeddings(size=3), root=self.root)
+        self.assertEqual(len(self.search([1, 0, 0], store=reader)), 10)
+
+        # More than COMPACT_RATIO of the rows are dead after this commit
+        self.delete([f'doc{number}' for number in range(7)])
+
+        self.assertIn('vectors.1.f32', self.files())
+        self.assertNotIn('vectors.0.f32', self.files())
+        # The reader's memory map of the removed epoch still reads until it reloads
+        self.assertEqual(np.asarray(reader._snapshot.vectors).shape, (10, 3))
+        self.assertEqual(sorted(self.search([1, 0, 0], store=reader)), ['doc7', 'doc8', 'doc9'])
+
+    def test_writer_after_a_crash_drops_the_uncommitted_rows(self):
+        self.write({'a': [1, 0, 0]})
+        crashed = self.write({'lost': [0, 1, 0]}, commit=False)
+        # The process dies: its files and lock are closed without a commit
+        for f in (crashed._vectors, crashed._log, crashed._lock_file):
+            f.close()
+
+        self.write({'b': [0, 0, 1]})
+
+        self.assertEqual(sorted(self.search([1, 1, 1])), ['a', 'b'])
+        manifest = _read_manifest(os.path.join(self.root, 'bot'))
+        self.assertEqual(manifest['rows'], 2)
+        self.assertEqual(os.path.getsize(os.path.join(self.root, 'bot', 'vectors.0.f32')), 2 * 3 * 4)
+
+    def test_ivf_matches_the_flat_scan(self):
+        rng = np.random.default_rng(42)
+        centers = rng.normal(size=(20, 16))
+        ids = [f'doc{number}' for number in range(2000)]
+        vectors = centers[np.arange(2000) % 20] + rng.normal(scale=0.05, size=(2000, 16))
+        queries = centers + rng.normal(scale=0.05, size=(20, 16))
+
+        self.write(dict(zip(ids, vectors.tolist())), writer=LocalVectorStoreWriter('bot', self.root, index_type='ivf'))
+        self.assertIsNotNone(self.store._get_snapshot().ivf)
+
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        for query in queries:
+            flat = np.argsort(-(normalized @ (query / np.linalg.norm(query))), kind='stable')[:10]
+            self.assertEqual(self.search(query.tolist()), [ids[row] for row in flat])
+
+
+class RecordingWriter(VectorStoreWriter):
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+
+class ChunkLedgerTests(TestCase):
+    def setUp(self):
+        self.sources = {'a.md': ['a1', 'a2'], 'b.md': ['b1']}
+        self.assertEqual(self.ingest(self.docs(self.sources))[:2], (['a1', 'a2', 'b1'], []))
+
+    def docs(self, sources):
+        return [Document(page_content=text, metadata={'source': source}) for source, texts in sources.items() for text in texts]
+
+    def ingest(self, docs, unchanged_sources=()):
+        """One ingestion run: returns the chunks it embedded, the vector ids it deleted and its stats."""
+        ledger = ChunkLedger('bot', 'source-1')
+        ledger.keep_sources(unchanged_sources)
+        embedded = list(ledger.filter_changed(docs))
+        ledger.record(EmbeddingBatch(
+            texts=[doc.page_content for doc in embedded],
+            metadatas=[doc.metadata for doc in embedded],
+            ids=[ledger.vector_id(doc) for doc in embedded],
+        ))
+        writer = RecordingWriter()
+        stats = ledger.finalize(writer)
+        return [doc.page_content for doc in embedded], writer.deleted, stats
+
+    def vector_ids(self, source):
+        return set(IngestedChunk.objects.filter(source=source).values_list('vector_id', flat=True))
+
+    def test_unchanged_run_embeds_and_deletes_nothing(self):
+        embedded, deleted, stats = self.ingest(self.docs(self.sources))
+
+        self.assertEqual((embedded, deleted), ([], []))
+        self.assertEqual((stats.unchanged, stats.added, stats.deleted, stats.total), (3, 0, 0, 3))
+
+    def test_changed_chunk_is_replaced(self):
+        old_ids = self.vector_ids('a.md')
+
+        embedded, deleted, stats = self.ingest(self.docs({'a.md': ['a1', 'a2 edited'], 'b.md': ['b1']}))
+
+        self.assertEqual(embedded, ['a2 edited'])
+        self.assertEqual(len(deleted), 1)
+        self.assertEqual(old_ids - self.vector_ids('a.md'), set(deleted))
+        self.assertEqual(stats.total, 3)
+
+    def test_removed_source_is_deleted(self):
+        removed_ids = self.vector_ids('b.md')
+
+        embedded, deleted, stats = self.ingest(self.docs({'a.md': ['a1', 'a2']}))
+
+        self.assertEqual(embedded, [])
+        self.assertEqual(set(deleted), removed_ids)
+        self.assertEqual(self.vector_ids('b.md'), set())
+
+    def test_kept_sources_survive_without_being_loaded(self):
+        embedded, deleted, stats = self.ingest(self.docs({'a.md': ['a1', 'a2']}), unchanged_sources=['b.md'])
+
+        self.assertEqual((embedded, deleted), ([], []))
+        self.assertEqual(len(self.vector_ids('b.md')), 1)
+        self.assertEqual((stats.unchanged, stats.total), (3, 3))
@@ -1,13 +1,20 @@
+import os
 from django.urls import path
-from .views import views_message, views_auth, views_ingest, views_chat
+from .views import views_message, views_auth, views_ingest, views_chat, views_metrics
+
+# Serve the chat endpoints with the async views when running under ASGI
+ASYNC_CHAT_VIEWS = os.environ.get('ASYNC_CHAT_VIEWS', 'false').lower() == 'true'
 
 urlpatterns = [
     path('send_search_request/', views_message.send_search_request, name='send_search_request'),
     path('chat/init/', views_message.init_chat, name='init_chat'),
-    path('chat/send/', views_message.send_chat, name='send_chat'),
+    path('chat/send/', views_message.send_chat_async if ASYNC_CHAT_VIEWS else views_message.send_chat, name='send_chat'),
     # website/codebase/pdf ingestion endpoint
     path('ingest/', views_ingest.ingest, name='ingest'),
-    path('chat/', views_chat.chat, name='chat'),
+    path('ingest/<int:job_id>/', views_ingest.ingest_status, name='ingest.status'),
+    path('chat/', views_chat.chat_async if ASYNC_CHAT_VIEWS else views_chat.chat, name='chat'),
+    # Prometheus metrics of this process
+    path('metrics/', views_metrics.metrics, name='metrics'),
     # Dummy auth endpoints to prevent template engine errors
     path('signin/', views_auth.signin, name='signin'),
     path('signup/', views_auth.signup, name='signup'),
@@ -0,0 +1,337 @@
+import asyncio
+import collections
+import logging
+import math
+import os
+import threading
+import time
+from typing import Deque, List, Optional, Sequence, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import JsonResponse
+from dotenv import load_dotenv
+
+from api.utils.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_SECONDS, ADMISSION_REJECTED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Requests per second and burst size of the buckets, a rate of 0 turns a bucket off
+BOT_RATE = float(os.environ.get('ADMISSION_BOT_RATE', 5))
+BOT_BURST = float(os.environ.get('ADMISSION_BOT_BURST', 20))
+SESSION_RATE = float(os.environ.get('ADMISSION_SESSION_RATE', 0.5))
+SESSION_BURST = float(os.environ.get('ADMISSION_SESSION_BURST', 5))
+
+# Per process: chat requests answered at once, how many more may wait for a slot and for how long
+MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 16))
+MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 32))
+QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5))
+BUSY_RETRY_AFTER = int(os.environ.get('ADMISSION_BUSY_RETRY_AFTER', 2))
+
+# Takes a token from every bucket, or from none of them when one is empty. Uses the server's
+# clock so that the web processes agree on the refill. Returns the seconds until a token is
+# available in the emptiest bucket, 0 when the request is allowed.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    available = math.min(burst, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local available = tokens[i]
+    if wait == 0 then
+        available = available - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(available), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(wait)
+"""
+
+
+class AdmissionRejected(Exception):
+    """Raised when a chat request is turned away, `status` is 429 (rate limited) or 503 (overloaded)."""
+
+    def __init__(self, status: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RateLimiter:
+    """Token buckets in Redis, shared by every web process.
+
+    With another cache backend (local development) the buckets live in the process. When
+    Redis cannot be reached requests are let through rather than failing the chat.
+    """
+
+    def __init__(self, local_size: int = 10000):
+        self.local_size = local_size
+        self._script = None
+        self._local: "collections.OrderedDict[str, Tuple[float, float]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, buckets: Sequence[Tuple[str, float, float]]) -> float:
+        """Takes a token from each (key, rate, burst) bucket, returns the seconds to wait if one is empty."""
+        buckets = [(f"admission:bucket:{key}", rate, burst) for key, rate, burst in buckets if rate > 0]
+        if not buckets:
+            return 0.0
+
+        # `cache` is a proxy, the backend itself tells whether Redis is behind it
+        if not isinstance(caches['default'], RedisCache):
+            return self._acquire_local(buckets)
+        try:
+            return float(self._get_script()(keys=[key for key, _, _ in buckets], args=[value for _, rate, burst in buckets for value in (rate, burst)]))
+        except Exception as e:
+            logger.warning("Could not check the rate limits: %s", e)
+            return 0.0
+
+    def _get_script(self):
+        if self._script is None:
+            # The cache backend has no scripting API, the raw client has. All keys of a
+            # request hash to the same server, the cache only shards on several LOCATIONs.
+            self._script = cache._cache.get_client(write=True).register_script(TOKEN_BUCKET_SCRIPT)
+        return self._script
+
+    def _acquire_local(self, buckets: List[Tuple[str, float, float]]) -> float:
+        now = time.monotonic()
+        with self._lock:
+            states = []
+            for key, rate, burst in buckets:
+                available, ts = self._local.get(key, (burst, now))
+                states.append(min(burst, available + (now - ts) * rate))
+            wait = max([(1 - available) / rate for available, (_, rate, _) in zip(states, buckets) if available < 1], default=0.0)
+            for available, (key, _, _) in zip(states, buckets):
+                self._local[key] = (available - 1 if wait == 0 else available, now)
+                self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+        return wait
+
+
+class Slot:
+    """A place among the requests being answered, released once the response is done."""
+
+    def __init__(self, limiter: Optional["InFlightLimiter"]):
+        self.limiter = limiter
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        if self.limiter is not None:
+            self.limiter._release()
+
+
+class InFlightLimiter:
+    """Caps the chat requests a process answers at once, with a bounded FIFO queue of waiters.
+
+    Works for threads and for coroutines alike: a released slot is handed to the longest
+    waiting request, either by setting its event or by resolving its future on its loop.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: Deque[object] = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Slot:
+        started_at = time.perf_counter()
+        with self._lock:
+            if self._try_acquire():
+                return Slot(self)
+            self._check_queue()
+            waiter = threading.Event()
+            self._enqueue(waiter)
+
+        granted = waiter.wait(self.queue_timeout)
+        return self._after_wait(waiter, granted, started_at)
+
+    async def aacquire(self) -> Slot:
+        started_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire():
+                return Slot(self)
+            self._check_queue()
+            waiter = (loop, loop.create_future())
+            self._enqueue(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), self.queue_timeout)
+            granted = True
+        except asyncio.TimeoutError:
+            granted = False
+        except asyncio.CancelledError:
+            # The client went away, a slot handed over in the meantime goes on to the next waiter
+            if not self._dequeue(waiter):
+                self._release()
+            raise
+        return self._after_wait(waiter, granted, started_at)
+
+    def _try_acquire(self) -> bool:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            ADMISSION_IN_FLIGHT.inc()
+            return True
+        return False
+
+    def _check_queue(self) -> None:
+        if len(self._waiters) >= self.max_queue:
+            ADMISSION_REJECTED.labels(reason='queue_full').inc()
+            raise AdmissionRejected(503, BUSY_RETRY_AFTER, 'queue_full')
+
+    def _enqueue(self, waiter) -> None:
+        self._waiters.append(waiter)
+        ADMISSION_QUEUE_DEPTH.inc()
+
+    def _dequeue(self, waiter) -> bool:
+        """Takes a waiter that gave up out of the queue, False if it was handed a slot already."""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return False
+            ADMISSION_QUEUE_DEPTH.dec()
+            return True
+
+    def _after_wait(self, waiter, granted: bool, started_at: float) -> Slot:
+        if not granted and self._dequeue(waiter):
+            ADMISSION_REJECTED.labels(reason='queue_timeout').inc()
+            raise AdmissionRejected(503, BUSY_RETRY_AFTER, 'queue_timeout')
+        ADMISSION_QUEUE_SECONDS.observe(time.perf_counter() - started_at)
+        return Slot(self)
+
+    def _release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self.in_flight -= 1
+                ADMISSION_IN_FLIGHT.dec()
+                return
+            # The slot goes straight to the next waiter, in_flight stays as it is
+            waiter = self._waiters.popleft()
+            ADMISSION_QUEUE_DEPTH.dec()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+def is_admission_enabled() -> bool:
+    return os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+
+
+rate_limiter = RateLimiter()
+in_flight_limiter = InFlightLimiter(max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT)
+
+
+def _check_rates(bot_id: str, session_id: Optional[str]) -> None:
+    buckets = [(f"bot:{bot_id}", BOT_RATE, BOT_BURST)]
+    if session_id:
+        buckets.append((f"session:{bot_id}:{session_id}", SESSION_RATE, SESSION_BURST))
+    wait = rate_limiter.acquire(buckets)
+    if wait > 0:
+        ADMISSION_REJECTED.labels(reason='rate_limited').inc()
+        raise AdmissionRejected(429, max(1, math.ceil(wait)), 'rate_limited')
+
+
+def admit(bot_id: str, session_id: Optional[str]) -> Slot:
+    """Admits a chat request of the bot and session or raises AdmissionRejected.
+
+    The returned slot must be released when the response is done, see `release_when_done`.
+    """
+    if not is_admission_enabled():
+        return Slot(None)
+    _check_rates(bot_id, session_id)
+    return in_flight_limiter.acquire()
+
+
+async def aadmit(bot_id: str, session_id: Optional[str]) -> Slot:
+    if not is_admission_enabled():
+        return Slot(None)
+    await sync_to_async(_check_rates, thread_sensitive=False)(bot_id, session_id)
+    return await in_flight_limiter.aacquire()
+
+
+class _ClosingIterator:
+    """Calls `on_close` when the stream ends, fails or is closed, whichever comes first."""
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __iter__(self):
+        try:
+            yield from self.iterable
+        finally:
+            self.on_close()
+
+    def close(self):
+        self.on_close()
+
+
+class _AsyncClosingIterator(_ClosingIterator):
+    def __iter__(self):
+        raise TypeError("An async stream can't be iterated synchronously")
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def _aiter(self):
+        # Django 4.2 does not close the response when the client disconnects mid-stream
+        try:
+            async for part in self.iterable:
+                yield part
+        finally:
+            self.on_close()
+
+
+def release_when_done(response, slot: Slot):
+    """Releases the slot once the response is sent: right away, or when a stream ends.
+
+    Django closes a streaming response after the last chunk or when the client goes away,
+    even if the stream was never started.
+    """
+    if not response.streaming:
+        slot.release()
+        return response
+
+    content = response.streaming_content
+    iterator_class = _AsyncClosingIterator if response.is_async else _ClosingIterator
+    response.streaming_content = iterator_class(content, slot.release)
+    return response
+
+
+def rejected_response(rejection: AdmissionRejected, data: dict) -> JsonResponse:
+    response = JsonResponse(data, status=rejection.status)
+    response['Retry-After'] = str(rejection.retry_after)
+    return response
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from langchain.docstore.document import Document
+
+from api.utils.embedding_pipeline import EmbeddingBatch, VectorStoreWriter
+from web.models.ingested_chunks import IngestedChunk
+
+logger = logging.getLogger(__name__)
+
+# Number of chunks looked up in the ledger per query
+LOOKUP_WINDOW = 500
+DELETE_BATCH_SIZE = 1000
+
+
+@dataclass
+class LedgerStats:
+    unchanged: int = 0
+    added: int = 0
+    deleted: int = 0
+    # Chunks of the data source after the run, set by finalize
+    total: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.deleted)
+
+
+class ChunkLedger:
+    """Tracks the chunks of one data source in a namespace by content hash.
+
+    A run only lets through chunks the ledger has not seen for the data source, unchanged
+    chunks keep their vectors and are stamped with the run id. `finalize` then removes the
+    vectors of every chunk the run did not see, i.e. chunks that changed or disappeared.
+    Vector ids are derived from the hashes, so retrying a failed run overwrites vectors
+    instead of duplicating them. Shards of one ingestion share a `run_id` and only the
+    last step finalizes.
+    """
+
+    def __init__(self, namespace: str, data_source_id: str, run_id: Optional[str] = None):
+        self.namespace = namespace
+        self.data_source_id = str(data_source_id)
+        self.run_id = run_id or str(uuid.uuid4())
+        self.stats = LedgerStats()
+        self._pending: Dict[str, IngestedChunk] = {}
+
+    def vector_id(self, doc: Document) -> str:
+        source_hash, chunk_hash = self._hashes(doc)
+        return self._vector_id(source_hash, chunk_hash)
+
+    def keep_sources(self, sources: Iterable[str]) -> None:
+        """Marks every chunk of the sources as seen by this run, for files known to be unchanged without loading them."""
+        source_hashes = [_source_hash(source) for source in sources]
+        for start in range(0, len(source_hashes), LOOKUP_WINDOW):
+            self.stats.unchanged += IngestedChunk.objects.filter(
+                namespace=self.namespace,
+                data_source_id=self.data_source_id,
+                source_hash__in=source_hashes[start:start + LOOKUP_WINDOW],
+            ).update(ingest_run=self.run_id)
+
+    def filter_changed(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """Yields the chunks that need to be embedded, marks the others as seen by this run."""
+        window: List[Document] = []
+        for doc in docs:
+            window.append(doc)
+            if len(window) >= LOOKUP_WINDOW:
+                yield from self._filter_window(window)
+                window = []
+        if window:
+            yield from self._filter_window(window)
+
+    def record(self, batch: EmbeddingBatch) -> None:
+        """Stores the ledger rows of a batch once its vectors are in the vector store."""
+        rows = [self._pending.pop(vector_id) for vector_id in batch.ids if vector_id in self._pending]
+        IngestedChunk.objects.bulk_create(rows, ignore_conflicts=True)
+        self.stats.added += len(rows)
+
+    def finalize(self, writer: VectorStoreWriter) -> LedgerStats:
+        """Deletes the vectors and ledger rows of the chunks this run did not see."""
+        self.stats.total = IngestedChunk.objects.filter(namespace=self.namespace, data_source_id=self.data_source_id, ingest_run=self.run_id).count()
+        stale = IngestedChunk.objects.filter(namespace=self.namespace, data_source_id=self.data_source_id).exclude(ingest_run=self.run_id)
+        stale_ids = list(stale.values_list('id', 'vector_id'))
+
+        for start in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+            rows = stale_ids[start:start + DELETE_BATCH_SIZE]
+            writer.delete([vector_id for _, vector_id in rows])
+            IngestedChunk.objects.filter(id__in=[row_id for row_id, _ in rows]).delete()
+
+        self.stats.deleted = len(stale_ids)
+        logger.info("Ingested %s for %s: %s unchanged, %s added, %s deleted", self.data_source_id, self.namespace, self.stats.unchanged, self.stats.added, self.stats.deleted)
+        return self.stats
+
+    def _filter_window(self, window: List[Document]) -> Iterator[Document]:
+        hashes = [self._hashes(doc) for doc in window]
+        existing = IngestedChunk.objects.filter(
+            namespace=self.namespace,
+            data_source_id=self.data_source_id,
+            source_hash__in={source_hash for source_hash, _ in hashes},
+            chunk_hash__in={chunk_hash for _, chunk_hash in hashes},
+        ).values_list('id', 'source_hash', 'chunk_hash')
+        known = {(source_hash, chunk_hash): row_id for row_id, source_hash, chunk_hash in existing}
+
+        # Seen rows grouped by the hash of their file, a changed file's unchanged chunks take the new one
+        seen_ids: Dict[str, Set[int]] = {}
+        for doc, (source_hash, chunk_hash) in zip(window, hashes):
+            row_id = known.get((source_hash, chunk_hash))
+            if row_id is not None:
+                file_ids = seen_ids.setdefault(doc.metadata.get('file_hash', ''), set())
+                if row_id not in file_ids:
+                    file_ids.add(row_id)
+                    self.stats.unchanged += 1
+                continue
+
+            vector_id = self._vector_id(source_hash, chunk_hash)
+            # The same chunk twice in a source is embedded once
+            if vector_id in self._pending:
+                continue
+            self._pending[vector_id] = IngestedChunk(
+                namespace=self.namespace,
+                data_source_id=self.data_source_id,
+                source=str(doc.metadata.get('source', '')),
+                source_hash=source_hash,
+                file_hash=doc.metadata.get('file_hash', ''),
+                chunk_hash=chunk_hash,
+                vector_id=vector_id,
+                ingest_run=self.run_id,
+            )
+            yield doc
+
+        for file_hash, row_ids in seen_ids.items():
+            update = {'ingest_run': self.run_id}
+            if file_hash:
+                update['file_hash'] = file_hash
+            IngestedChunk.objects.filter(id__in=row_ids).update(**update)
+
+    def _hashes(self, doc: Document):
+        return _source_hash(str(doc.metadata.get('source', ''))), hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+
+    def _vector_id(self, source_hash: str, chunk_hash: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.namespace}/{self.data_source_id}/{source_hash}/{chunk_hash}"))
+
+
+def get_ingested_file_hashes(namespace: str, data_source_id: str) -> Dict[str, str]:
+    """Returns the file hash of every source of the data source, for sources whose chunks all agree on it."""
+    hashes: Dict[str, Optional[str]] = {}
+    rows = IngestedChunk.objects.filter(namespace=namespace, data_source_id=str(data_source_id)).values_list('source', 'file_hash').distinct()
+    for source, file_hash in rows.iterator():
+        hashes[source] = file_hash if hashes.get(source, file_hash) == file_hash else None
+    return {source: file_hash for source, file_hash in hashes.items() if file_hash}
+
+
+def _source_hash(source: str) -> str:
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
@@ -0,0 +1,57 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ClientRegistry:
+    """Process-wide LRU registry of expensive clients (embeddings, LLMs, vector stores, chains).
+
+    Entries can be tagged with a namespace so that everything built for a bot can be
+    dropped at once, e.g. when its prompt changes.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._namespaces = {}
+        # Re-entrant because factories build their own dependencies through the registry
+        self._lock = threading.RLock()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any], namespace: Optional[str] = None) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            value = factory()
+            self._entries[key] = value
+            if namespace is not None:
+                self._namespaces[key] = namespace
+
+            while len(self._entries) > self.max_size:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._namespaces.pop(evicted_key, None)
+
+            return value
+
+    def invalidate_namespace(self, namespace: str) -> None:
+        with self._lock:
+            for key in [key for key, ns in self._namespaces.items() if ns == namespace]:
+                self._entries.pop(key, None)
+                self._namespaces.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._namespaces.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+client_registry = ClientRegistry(max_size=int(os.environ.get('CLIENT_REGISTRY_MAX_SIZE', 256)))
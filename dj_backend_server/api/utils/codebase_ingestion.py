@@ -0,0 +1,231 @@
+import logging
+import os
+import subprocess
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from langchain.docstore.document import Document
+from langchain.text_splitter import Language, RecursiveCharacterTextSplitter, TextSplitter
+
+from api.utils.process_pool import iter_ordered
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+GIT_TIMEOUT = int(os.environ.get('CODEBASE_GIT_TIMEOUT', 600))
+
+# Extensions indexed by default, mapped to the language used to split them (None splits on blank lines)
+FILE_LANGUAGES: Dict[str, Optional[Language]] = {
+    '.py': Language.PYTHON,
+    '.js': Language.JS, '.jsx': Language.JS, '.mjs': Language.JS, '.cjs': Language.JS, '.ts': Language.JS, '.tsx': Language.JS,
+    '.go': Language.GO,
+    '.java': Language.JAVA, '.kt': Language.JAVA, '.cs': Language.JAVA,
+    '.c': Language.CPP, '.h': Language.CPP, '.cc': Language.CPP, '.cpp': Language.CPP, '.hpp': Language.CPP,
+    '.php': Language.PHP,
+    '.proto': Language.PROTO,
+    '.rb': Language.RUBY,
+    '.rs': Language.RUST,
+    '.scala': Language.SCALA,
+    '.swift': Language.SWIFT,
+    '.sol': Language.SOL,
+    '.md': Language.MARKDOWN, '.mdx': Language.MARKDOWN,
+    '.rst': Language.RST,
+    '.tex': Language.LATEX,
+    '.html': Language.HTML, '.htm': Language.HTML, '.vue': Language.HTML, '.svelte': Language.HTML,
+    '.txt': None, '.css': None, '.scss': None, '.sql': None, '.sh': None, '.yaml': None, '.yml': None,
+    '.toml': None, '.ini': None, '.cfg': None, '.json': None, '.graphql': None,
+}
+# Directories holding third party or build output, whatever the repository's .gitignore says
+EXCLUDED_DIRECTORIES = {
+    'node_modules', 'bower_components', 'vendor', 'vendors', 'third_party', 'third-party', 'dist', 'build',
+    'target', 'out', '.venv', 'venv', 'site-packages', '__pycache__', 'Pods', '.next', '.nuxt', 'coverage',
+}
+EXCLUDED_FILE_NAMES = {
+    'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'npm-shrinkwrap.json', 'poetry.lock', 'Pipfile.lock',
+    'Cargo.lock', 'composer.lock', 'Gemfile.lock', 'go.sum', 'mix.lock', 'packages.lock.json',
+}
+EXCLUDED_SUFFIXES = ('.min.js', '.min.css', '.bundle.js', '.map', '.pb.go', '_pb2.py', '.generated.ts', '.g.dart')
+# Minified or generated sources have very long lines
+MAX_AVERAGE_LINE_LENGTH = 400
+
+
+@dataclass
+class RepositoryFile:
+    path: str
+    blob_id: str
+    size: int
+
+
+def checkout_repository(clone_url: str, repo_path: str) -> None:
+    """Shallow clones the default branch of the repository, or fast-forwards an existing checkout to its tip."""
+    if os.path.isdir(os.path.join(repo_path, '.git')):
+        _git(repo_path, 'remote', 'set-url', 'origin', clone_url)
+        _git(repo_path, 'fetch', '--depth', '1', '--no-tags', 'origin', 'HEAD')
+        _git(repo_path, 'reset', '--hard', 'FETCH_HEAD')
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(repo_path)), exist_ok=True)
+        _git(None, 'clone', '--depth', '1', '--single-branch', '--no-tags', clone_url, repo_path)
+
+
+def list_repository_files(repo_path: str, max_file_size: Optional[int] = None, extensions: Optional[Sequence[str]] = None) -> List[RepositoryFile]:
+    """Lists the indexable files of the checkout with their git blob ids, without reading them.
+
+    Skips files matched by the repository's .gitignore (even when committed), files marked
+    linguist-generated or linguist-vendored in .gitattributes, vendored directories,
+    lockfiles, extensions that are not source or documentation, and files above the size limit.
+    """
+    max_file_size = max_file_size or int(os.environ.get('CODEBASE_MAX_FILE_SIZE', 262144))
+    extensions = set(extensions or get_codebase_extensions())
+
+    files = []
+    for entry in _git(repo_path, 'ls-tree', '-r', '-l', '-z', 'HEAD').split('\0'):
+        if not entry:
+            continue
+        info, path = entry.split('\t', 1)
+        mode, object_type, blob_id, size = info.split()
+        # Submodules and symlinks have no content of their own
+        if object_type != 'blob' or mode == '120000':
+            continue
+        if int(size) > max_file_size or not _is_indexable_path(path, extensions):
+            continue
+        files.append(RepositoryFile(path=path, blob_id=blob_id, size=int(size)))
+
+    excluded = _ignored_paths(repo_path) | _generated_paths(repo_path, [file.path for file in files])
+    return [file for file in files if file.path not in excluded]
+
+
+def get_codebase_extensions() -> List[str]:
+    configured = os.environ.get('CODEBASE_EXTENSIONS')
+    if configured:
+        return [extension.strip().lower() for extension in configured.split(',') if extension.strip()]
+    return list(FILE_LANGUAGES)
+
+
+def load_file_chunks(repo_path: str, files: List[Tuple[str, str]]) -> List[Tuple[str, dict]]:
+    """Reads and splits files, returns (text, metadata) pairs. Runs in the pool processes.
+
+    Read errors propagate: a skipped file would lose its stored chunks once the ledger drops
+    what the run did not see, the ingestion job retries instead.
+    """
+    chunks = []
+    for path, blob_id in files:
+        with open(os.path.join(repo_path, path), 'rb') as f:
+            content = f.read()
+
+        text = _decode_text(content)
+        if text is None or not text.strip():
+            continue
+
+        extension = _extension(path)
+        language = FILE_LANGUAGES.get(extension)
+        metadata = {
+            'source': path,
+            'file_path': path,
+            'file_name': os.path.basename(path),
+            'file_type': extension,
+            'language': language.value if language else '',
+            'file_hash': blob_id,
+        }
+        chunks.extend((chunk, metadata) for chunk in _get_splitter(language).split_text(text))
+    return chunks
+
+
+class CodebaseLoader:
+    """Reads and splits repository files on a process pool and yields the chunks, in file order.
+
+    Splitting is CPU bound, so files are handed to the processes `files_per_task` at a time.
+    If the pool cannot be started (or dies) the remaining files are loaded in this process.
+    """
+
+    def __init__(self, repo_path: str, processes: Optional[int] = None, files_per_task: Optional[int] = None):
+        self.repo_path = repo_path
+        self.processes = processes or int(os.environ.get('CODEBASE_INGEST_PROCESSES', 0)) or os.cpu_count() or 1
+        self.files_per_task = files_per_task or int(os.environ.get('CODEBASE_FILES_PER_TASK', 16))
+
+    def iter_documents(self, files: List[RepositoryFile]) -> Iterator[Document]:
+        tasks = [
+            [(file.path, file.blob_id) for file in files[start:start + self.files_per_task]]
+            for start in range(0, len(files), self.files_per_task)
+        ]
+
+        done = 0
+        if self.processes > 1 and len(tasks) > 1:
+            try:
+                for task, future in iter_ordered(load_file_chunks, tasks, lambda task: (self.repo_path, task), self.processes):
+                    yield from _to_documents(future.result())
+                    done += 1
+            except (BrokenProcessPool, OSError) as e:
+                logger.warning("Codebase loading pool failed (%s), loading the remaining files in process", e)
+
+        for task in tasks[done:]:
+            yield from _to_documents(load_file_chunks(self.repo_path, task))
+
+
+def _to_documents(chunks: List[Tuple[str, dict]]) -> Iterator[Document]:
+    for text, metadata in chunks:
+        yield Document(page_content=text, metadata=dict(metadata))
+
+
+@lru_cache(maxsize=None)
+def _get_splitter(language: Optional[Language]) -> TextSplitter:
+    if language is None:
+        return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len)
+    return RecursiveCharacterTextSplitter.from_language(language, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len)
+
+
+def _decode_text(content: bytes) -> Optional[str]:
+    # Binary files have NUL bytes early on, git uses the same heuristic
+    if b'\0' in content[:8000]:
+        return None
+    try:
+        text = content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    lines = text.count('\n') + 1
+    if len(text) / lines > MAX_AVERAGE_LINE_LENGTH:
+        return None
+    return text
+
+
+def _extension(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+def _is_indexable_path(path: str, extensions: set) -> bool:
+    parts = path.split('/')
+    name = parts[-1]
+    if any(part in EXCLUDED_DIRECTORIES for part in parts[:-1]):
+        return False
+    if name in EXCLUDED_FILE_NAMES or name.lower().endswith(EXCLUDED_SUFFIXES):
+        return False
+    return _extension(name) in extensions
+
+
+def _ignored_paths(repo_path: str) -> set:
+    output = _git(repo_path, 'ls-files', '-z', '--cached', '--ignored', '--exclude-standard')
+    return set(path for path in output.split('\0') if path)
+
+
+def _generated_paths(repo_path: str, paths: List[str]) -> set:
+    if not paths:
+        return set()
+    output = _git(repo_path, 'check-attr', '-z', '--stdin', 'linguist-generated', 'linguist-vendored', stdin='\0'.join(paths) + '\0')
+    fields = output.split('\0')
+    # NUL separated (path, attribute, value) triples
+    return {fields[i] for i in range(0, len(fields) - 2, 3) if fields[i + 2] in ('set', 'true')}
+
+
+def _git(repo_path: Optional[str], *args: str, stdin: Optional[str] = None) -> str:
+    command = ['git'] + (['-C', repo_path] if repo_path else []) + list(args)
+    # A private repository without credentials fails instead of waiting for a password
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    result = subprocess.run(command, input=stdin, capture_output=True, text=True, timeout=GIT_TIMEOUT, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {result.stderr.strip()}")
+    return result.stdout
@@ -0,0 +1,208 @@
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from dotenv import load_dotenv
+from langchain import LLMChain
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import SystemMessage
+
+from api.utils.get_openai_llm import get_llm
+from api.utils.metrics import record_cache_lookup
+from api.utils.token_counter import get_model_token_counter
+from web.models.chat_histories import ChatHistory, is_user_message
+from web.models.chat_session_summaries import ChatSessionSummary
+from web.services.chat_history_service import HISTORY_CACHE_TTL
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tokens of chat history handed to the chain, the summary of older turns included
+HISTORY_TOKEN_BUDGET = int(os.environ.get('CHAT_HISTORY_TOKEN_BUDGET', 1500))
+SUMMARY_ENABLED = os.environ.get('CHAT_SUMMARY_ENABLED', 'true').lower() == 'true'
+# Messages read when a summary is updated, the oldest turns of a very long session are not folded in
+SUMMARY_SOURCE_MESSAGES = 200
+SUMMARY_PENDING_TTL = 300
+TOKEN_COUNT_CACHE_SIZE = 4096
+# "Human: " / "Assistant: " prefixes and line breaks the chain adds per turn
+TURN_OVERHEAD_TOKENS = 6
+
+Turn = Tuple[str, str]
+
+
+@dataclass
+class CachedSummary:
+    summary: str
+    last_turn_hash: str
+
+
+def build_chat_context(session_id: str, chat_history: List[Turn]) -> list:
+    """Fits the chat history of a session into HISTORY_TOKEN_BUDGET tokens.
+
+    The newest turns are kept as they are, older ones are represented by the rolling summary
+    of the session. Turns that fall out of the budget before the summary covers them are left
+    out of this request and folded into the summary by a celery task, off the request path.
+    """
+    if not chat_history:
+        return chat_history
+
+    summary = get_session_summary(session_id) if SUMMARY_ENABLED else None
+    context, dropped = _fit(chat_history, summary)
+    if dropped and SUMMARY_ENABLED:
+        schedule_summary(session_id)
+    return context
+
+
+async def abuild_chat_context(session_id: str, chat_history: List[Turn]) -> list:
+    """Async variant of build_chat_context."""
+    if not chat_history:
+        return chat_history
+
+    summary = await aget_session_summary(session_id) if SUMMARY_ENABLED else None
+    context, dropped = _fit(chat_history, summary)
+    if dropped and SUMMARY_ENABLED:
+        await sync_to_async(schedule_summary)(session_id)
+    return context
+
+
+def count_tokens(text: str) -> int:
+    # Counts are cached per message, the same history is counted again on every turn
+    return get_model_token_counter(_completion_model_name(), TOKEN_COUNT_CACHE_SIZE)(text)
+
+
+def select_recent_turns(turns: List[Turn], budget: int) -> Tuple[List[Turn], int]:
+    """Returns the newest turns that fit in `budget` tokens and the number of older turns left out."""
+    used = 0
+    kept = 0
+    for question, answer in reversed(turns):
+        used += count_tokens(question) + count_tokens(answer) + TURN_OVERHEAD_TOKENS
+        if used > budget:
+            break
+        kept += 1
+    dropped = len(turns) - kept
+    return turns[dropped:], dropped
+
+
+def get_session_summary(session_id: str) -> Optional[CachedSummary]:
+    cached = cache.get(_summary_key(session_id))
+    record_cache_lookup('chat_summary', hits=int(cached is not None), misses=int(cached is None))
+    if cached is None:
+        cached = _to_cached(ChatSessionSummary.objects.filter(session_id=session_id).first())
+        cache.set(_summary_key(session_id), cached, HISTORY_CACHE_TTL)
+    return cached or None
+
+
+async def aget_session_summary(session_id: str) -> Optional[CachedSummary]:
+    cached = await cache.aget(_summary_key(session_id))
+    record_cache_lookup('chat_summary', hits=int(cached is not None), misses=int(cached is None))
+    if cached is None:
+        cached = _to_cached(await ChatSessionSummary.objects.filter(session_id=session_id).afirst())
+        await cache.aset(_summary_key(session_id), cached, HISTORY_CACHE_TTL)
+    return cached or None
+
+
+def schedule_summary(session_id: str) -> None:
+    # One pending summary update per session
+    if not cache.add(_pending_key(session_id), True, SUMMARY_PENDING_TTL):
+        return
+    try:
+        from api.tasks import summarize_chat_session_task
+        summarize_chat_session_task.delay(session_id)
+    except Exception as e:
+        cache.delete(_pending_key(session_id))
+        logger.warning("Could not schedule the summary of session %s: %s", session_id, e)
+
+
+def summarize_session(session_id: str) -> None:
+    """Folds the turns of the session that no longer fit in the budget into its summary."""
+    try:
+        summary = ChatSessionSummary.objects.filter(session_id=session_id).first()
+        query = ChatHistory.objects.filter(session_id=session_id)
+        if summary:
+            query = query.filter(created_at__gt=summary.summarized_until)
+        rows = list(query.order_by('-created_at').values_list('chatbot_id', 'from_user', 'message', 'created_at')[:SUMMARY_SOURCE_MESSAGES])
+
+        turns = _pair_rows(reversed(rows))
+        budget = HISTORY_TOKEN_BUDGET - (count_tokens(summary.summary) if summary else 0)
+        _, dropped = select_recent_turns([(question, answer) for question, answer, _, _ in turns], budget)
+        if not dropped:
+            return
+
+        folded = turns[:dropped]
+        new_lines = "\n".join(f"Human: {question}\nAI: {answer}" for question, answer, _, _ in folded)
+        text = LLMChain(llm=get_llm(), prompt=SUMMARY_PROMPT).predict(summary=summary.summary if summary else "", new_lines=new_lines).strip()
+
+        question, answer, answered_at, chatbot_id = folded[-1]
+        ChatSessionSummary.objects.update_or_create(session_id=session_id, defaults={
+            'chatbot_id': chatbot_id,
+            'summary': text,
+            'last_turn_hash': turn_hash((question, answer)),
+            'summarized_until': answered_at,
+        })
+        cache.set(_summary_key(session_id), CachedSummary(text, turn_hash((question, answer))), HISTORY_CACHE_TTL)
+        logger.info("Folded %s turns of session %s into its summary", dropped, session_id)
+    finally:
+        cache.delete(_pending_key(session_id))
+
+
+def turn_hash(turn: Turn) -> str:
+    question, answer = turn
+    return hashlib.sha1(f"{question}\x00{answer}".encode('utf-8')).hexdigest()
+
+
+def _fit(chat_history: List[Turn], summary: Optional[CachedSummary]) -> Tuple[list, int]:
+    budget = HISTORY_TOKEN_BUDGET
+    if summary:
+        chat_history = _turns_after(chat_history, summary.last_turn_hash)
+        budget -= count_tokens(summary.summary)
+
+    recent, dropped = select_recent_turns(chat_history, budget)
+    if summary:
+        return [SystemMessage(content=f"Summary of the earlier conversation: {summary.summary}")] + recent, dropped
+    return recent, dropped
+
+
+def _turns_after(turns: List[Turn], last_turn_hash: str) -> List[Turn]:
+    # Turns up to the newest summarized one are covered by the summary. When that turn is no
+    # longer in the cached window, the whole window is newer than the summary.
+    for index in range(len(turns) - 1, -1, -1):
+        if turn_hash(turns[index]) == last_turn_hash:
+            return turns[index + 1:]
+    return turns
+
+
+def _pair_rows(rows: Iterable[tuple]) -> list:
+    turns = []
+    question = None
+    for chatbot_id, from_user, message, created_at in rows:
+        if is_user_message(from_user):
+            question = message
+        elif question is not None:
+            turns.append((question, message, created_at, chatbot_id))
+            question = None
+    return turns
+
+
+def _to_cached(summary: Optional[ChatSessionSummary]):
+    # False marks a session without summary, None is a cache miss
+    return CachedSummary(summary.summary, summary.last_turn_hash) if summary else False
+
+
+def _completion_model_name() -> str:
+    if os.environ.get('OPENAI_API_TYPE') == 'azure':
+        return os.environ.get('AZURE_OPENAI_COMPLETION_MODEL', 'text-davinci-003')
+    # Model of the OpenAI completion client, see get_openai_llm
+    return 'text-davinci-003'
+
+
+def _summary_key(session_id: str) -> str:
+    return f"chat_summary:{session_id}"
+
+
+def _pending_key(session_id: str) -> str:
+    return f"chat_summary_pending:{session_id}"
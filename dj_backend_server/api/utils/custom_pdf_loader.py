@@ -33,10 +33,8 @@ class CustomPDFLoader(BufferLoader):
 
     def parse_pdf(self, raw):
         pdf_loader = PyPDFLoader(io.BytesIO(raw))
-        text = ""
         num_pages = pdf_loader.num_pages()
-        for page_num in range(num_pages):
-            text += pdf_loader.extract_text(page_num)
+        text = "".join(pdf_loader.extract_text(page_num) for page_num in range(num_pages))
         return {'text': text, 'numpages': num_pages}
 
 
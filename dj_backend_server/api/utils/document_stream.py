@@ -0,0 +1,38 @@
+from pathlib import Path
+from typing import Iterable, Iterator, List, Type
+
+from langchain.docstore.document import Document
+from langchain.document_loaders.base import BaseLoader
+from langchain.text_splitter import TextSplitter
+
+# Generators feeding the ingestion pipeline one document at a time. Together with the bounded
+# number of pending embedding batches this keeps a worker's memory flat, however large the source.
+
+
+def iter_loader_documents(loader: BaseLoader) -> Iterator[Document]:
+    try:
+        yield from loader.lazy_load()
+    except NotImplementedError:
+        yield from loader.load()
+
+
+def iter_directory_documents(directory_path: str, glob: str, loader_cls: Type[BaseLoader]) -> Iterator[Document]:
+    """Lazy counterpart of DirectoryLoader: loads the matching files one by one."""
+    return iter_file_documents(list_directory_files(directory_path, glob), loader_cls)
+
+
+def list_directory_files(directory_path: str, glob: str) -> List[str]:
+    return [str(file_path) for file_path in sorted(Path(directory_path).glob(glob)) if file_path.is_file()]
+
+
+def iter_file_documents(file_paths: Iterable[str], loader_cls: Type[BaseLoader]) -> Iterator[Document]:
+    # Load errors propagate, as DirectoryLoader's do: a skipped file would lose its stored chunks
+    # once the ledger drops what the run did not see, and the job retries instead
+    for file_path in file_paths:
+        yield from iter_loader_documents(loader_cls(str(file_path)))
+
+
+def split_documents(docs: Iterable[Document], text_splitter: TextSplitter) -> Iterator[Document]:
+    """Splits documents as they are loaded instead of splitting the whole source at once."""
+    for doc in docs:
+        yield from text_splitter.split_documents([doc])
@@ -0,0 +1,254 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from dotenv import load_dotenv
+from langchain.embeddings.base import Embeddings
+
+from api.utils.metrics import record_cache_lookup
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Vectors are stored as raw float32 bytes, a quarter of the size of the pickled list of floats
+VECTOR_DTYPE = np.float32
+
+
+class EmbeddingCacheStore:
+    """Content-addressed vector storage, keys are hashes of the model and the text."""
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        raise NotImplementedError
+
+    def set_many(self, vectors: Dict[str, bytes]) -> None:
+        raise NotImplementedError
+
+
+class RedisEmbeddingStore(EmbeddingCacheStore):
+    """Stores vectors in the shared Django cache, entries expire after `ttl` seconds.
+
+    The size bound is the Redis `maxmemory` policy, with `allkeys-lru` the least used
+    vectors are evicted first.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        return cache.get_many(keys)
+
+    def set_many(self, vectors: Dict[str, bytes]) -> None:
+        cache.set_many(vectors, self.ttl)
+
+
+class SqliteEmbeddingStore(EmbeddingCacheStore):
+    """Stores vectors in a local SQLite file, the least recently used ones are evicted past `max_entries`."""
+
+    # Access times are refreshed at most this often per key, reads would otherwise all be writes
+    TOUCH_INTERVAL = 3600
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes_since_eviction = 0
+        self._lock = threading.Lock()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, used_at INTEGER NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)')
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found = {}
+        connection = self._connection()
+        for start in range(0, len(keys), 500):
+            window = list(keys[start:start + 500])
+            placeholders = ','.join('?' * len(window))
+            rows = connection.execute(f'SELECT key, vector, used_at FROM embeddings WHERE key IN ({placeholders})', window).fetchall()
+            now = int(time.time())
+            stale = [key for key, _, used_at in rows if now - used_at > self.TOUCH_INTERVAL]
+            if stale:
+                with connection:
+                    connection.executemany('UPDATE embeddings SET used_at = ? WHERE key = ?', [(now, key) for key in stale])
+            found.update((key, vector) for key, vector, _ in rows)
+        return found
+
+    def set_many(self, vectors: Dict[str, bytes]) -> None:
+        now = int(time.time())
+        with self._connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO embeddings (key, vector, used_at) VALUES (?, ?, ?)', [(key, vector, now) for key, vector in vectors.items()])
+
+        with self._lock:
+            self._writes_since_eviction += len(vectors)
+            evict = self._writes_since_eviction >= max(1, self.max_entries // 100)
+            if evict:
+                self._writes_since_eviction = 0
+        if evict:
+            self._evict()
+
+    def _evict(self) -> None:
+        with self._connection() as connection:
+            count = connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            if count > self.max_entries:
+                connection.execute('DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used_at LIMIT ?)', (count - self.max_entries,))
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, the embedding pipeline reads and writes from its workers
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings provider with a content-addressed cache of the vectors it returns.
+
+    Lookups go to a small in-process LRU first, then to the persistent store; only texts
+    missing from both are sent to the provider, duplicates within a call once.
+    """
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingCacheStore, local_size: int):
+        self.embeddings = embeddings
+        self.store = store
+        self.local_size = local_size
+        self.model_key = _model_key(embeddings)
+        self._local: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Settings the embedding pipeline reads from the provider (model, chunk_size, max_retries)
+        if name == 'embeddings':
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def copy(self, update: dict) -> "CachedEmbeddings":
+        return CachedEmbeddings(self.embeddings.copy(update=update), self.store, self.local_size)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+        missing = self._missing(texts, keys, found)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(found, dict(zip(missing.keys(), vectors)))
+        return [_to_list(found[key]) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = self._lookup([key])
+        if key not in found:
+            self._store(found, {key: self.embeddings.embed_query(text)})
+        return _to_list(found[key])
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = await sync_to_async(self._lookup, thread_sensitive=False)(keys)
+        missing = self._missing(texts, keys, found)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await sync_to_async(self._store, thread_sensitive=False)(found, dict(zip(missing.keys(), vectors)))
+        return [_to_list(found[key]) for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = self._lookup_local([key])
+        if key in found:
+            record_cache_lookup('embedding', hits=1)
+        else:
+            found = await sync_to_async(self._lookup, thread_sensitive=False)([key])
+        if key not in found:
+            vector = await self.embeddings.aembed_query(text)
+            await sync_to_async(self._store, thread_sensitive=False)(found, {key: vector})
+        return _to_list(found[key])
+
+    def _key(self, text: str) -> str:
+        return 'embedding:' + hashlib.sha256(f"{self.model_key}\x00{text}".encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, bytes]:
+        found = self._lookup_local(keys)
+        remote = [key for key in dict.fromkeys(keys) if key not in found]
+        if remote:
+            try:
+                stored = self.store.get_many(remote)
+            except Exception as e:
+                # The provider is still there, a cache outage only costs the API calls
+                logger.warning("Could not read the embedding cache: %s", e)
+                stored = {}
+            self._remember(stored)
+            found.update(stored)
+        unique = len(set(keys))
+        record_cache_lookup('embedding', hits=len(found), misses=unique - len(found))
+        return found
+
+    def _lookup_local(self, keys: List[str]) -> Dict[str, bytes]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._local.get(key)
+                if vector is not None:
+                    self._local.move_to_end(key)
+                    found[key] = vector
+        return found
+
+    def _missing(self, texts: List[str], keys: List[str], found: Dict[str, bytes]) -> Dict[str, str]:
+        return {key: text for key, text in zip(keys, texts) if key not in found}
+
+    def _store(self, found: Dict[str, bytes], vectors: Dict[str, List[float]]) -> None:
+        encoded = {key: np.asarray(vector, dtype=VECTOR_DTYPE).tobytes() for key, vector in vectors.items()}
+        found.update(encoded)
+        self._remember(encoded)
+        try:
+            self.store.set_many(encoded)
+        except Exception as e:
+            logger.warning("Could not write the embedding cache: %s", e)
+
+    def _remember(self, vectors: Dict[str, bytes]) -> None:
+        with self._lock:
+            for key, vector in vectors.items():
+                self._local[key] = vector
+                self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+
+def _model_key(embeddings: Embeddings) -> str:
+    # Vectors of different models (or Azure deployments) must never be mixed up
+    model = getattr(embeddings, 'deployment', None) or getattr(embeddings, 'model', None)
+    return f"{embeddings.__class__.__name__}:{model}"
+
+
+def _to_list(vector: bytes) -> List[float]:
+    return np.frombuffer(vector, dtype=VECTOR_DTYPE).tolist()
+
+
+def get_embedding_cache_store() -> Optional[EmbeddingCacheStore]:
+    backend = os.environ.get('EMBEDDING_CACHE', 'redis')
+    if backend == 'redis':
+        return RedisEmbeddingStore(ttl=int(os.environ.get('EMBEDDING_CACHE_TTL', 604800)))
+    elif backend == 'sqlite':
+        return SqliteEmbeddingStore(
+            path=os.environ.get('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite3'),
+            max_entries=int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 500000)),
+        )
+    elif backend == 'none':
+        return None
+    raise ValueError(f"Invalid EMBEDDING_CACHE: {backend}. Valid values are: redis, sqlite, none")
+
+
+def with_embedding_cache(embeddings: Embeddings) -> Embeddings:
+    store = get_embedding_cache_store()
+    if store is None:
+        return embeddings
+    return CachedEmbeddings(embeddings, store, local_size=int(os.environ.get('EMBEDDING_CACHE_LOCAL_SIZE', 10000)))
@@ -0,0 +1,300 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional
+from uuid import uuid4
+
+import openai
+from dotenv import load_dotenv
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.qdrant import Qdrant
+from qdrant_client.http import models as rest
+
+from api.configs import PINECONE_TEXT_KEY
+from api.enums import StoreType
+from api.utils.token_counter import get_model_token_counter
+from api.utils.vector_store_clients import get_qdrant_client, get_pinecone_index
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying, anything else (bad key, invalid input) fails the ingestion right away
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+)
+PINECONE_UPSERT_BATCH_SIZE = 100
+PINECONE_DELETE_BATCH_SIZE = 1000
+
+
+@dataclass
+class EmbeddingBatch:
+    texts: List[str] = field(default_factory=list)
+    metadatas: List[dict] = field(default_factory=list)
+    ids: List[str] = field(default_factory=list)
+    tokens: int = 0
+
+
+class TokenBudget:
+    """Tokens-per-minute budget shared by the embedding workers.
+
+    A rate limited response pauses every worker, not just the one that hit it, so the
+    pipeline backs off as a whole instead of hammering the API with the other batches.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self._available = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        if self.tokens_per_minute <= 0:
+            self._wait_for_pause()
+            return
+
+        # A single batch larger than the whole budget is let through once the bucket is full
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            self._wait_for_pause()
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.tokens_per_minute, self._available + (now - self._updated_at) * self.tokens_per_minute / 60)
+                self._updated_at = now
+                if self._available >= tokens:
+                    self._available -= tokens
+                    return
+                wait_for = (tokens - self._available) * 60 / self.tokens_per_minute
+            time.sleep(wait_for)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_for_pause(self) -> None:
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+class VectorStoreWriter:
+    """Writes embedded batches straight to the vector store, one request per batch."""
+
+    def upsert(self, batch: EmbeddingBatch, vectors: List[List[float]]) -> None:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def commit(self) -> None:
+        """Called once the ingestion is done, for stores that publish writes in one step."""
+
+
+class QdrantWriter(VectorStoreWriter):
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.client = get_qdrant_client()
+        self._collection_ready = False
+        self._lock = threading.Lock()
+
+    def upsert(self, batch: EmbeddingBatch, vectors: List[List[float]]) -> None:
+        self._ensure_collection(len(vectors[0]))
+        points = [
+            rest.PointStruct(
+                id=vector_id,
+                vector=vector,
+                payload={Qdrant.CONTENT_KEY: text, Qdrant.METADATA_KEY: metadata},
+            )
+            for vector_id, text, metadata, vector in zip(batch.ids, batch.texts, batch.metadatas, vectors)
+        ]
+        self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def delete(self, ids: List[str]) -> None:
+        self.client.delete(collection_name=self.collection_name, points_selector=rest.PointIdsList(points=ids))
+
+    def _ensure_collection(self, vector_size: int) -> None:
+        with self._lock:
+            if self._collection_ready:
+                return
+            try:
+                collection = self.client.get_collection(collection_name=self.collection_name)
+            except Exception:
+                # Missing collection (the clients raise different errors for it), create it on the first batch
+                collection = None
+
+            if collection is None:
+                self.client.create_collection(
+                    collection_name=self.collection_name,
+                    vectors_config=rest.VectorParams(size=vector_size, distance=rest.Distance.COSINE),
+                )
+            elif collection.config.params.vectors.size != vector_size:
+                raise ValueError(f"Qdrant collection {self.collection_name} stores {collection.config.params.vectors.size}-dimensional vectors, the embeddings are {vector_size}-dimensional")
+            self._collection_ready = True
+
+
+class PineconeWriter(VectorStoreWriter):
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self.index = get_pinecone_index()
+
+    def upsert(self, batch: EmbeddingBatch, vectors: List[List[float]]) -> None:
+        records = [
+            (vector_id, vector, {**metadata, PINECONE_TEXT_KEY: text})
+            for vector_id, text, metadata, vector in zip(batch.ids, batch.texts, batch.metadatas, vectors)
+        ]
+        for start in range(0, len(records), PINECONE_UPSERT_BATCH_SIZE):
+            self.index.upsert(vectors=records[start:start + PINECONE_UPSERT_BATCH_SIZE], namespace=self.namespace)
+
+    def delete(self, ids: List[str]) -> None:
+        for start in range(0, len(ids), PINECONE_DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[start:start + PINECONE_DELETE_BATCH_SIZE], namespace=self.namespace)
+
+
+def get_vector_store_writer(store_type: StoreType, namespace: str) -> VectorStoreWriter:
+    if store_type == StoreType.PINECONE:
+        return PineconeWriter(namespace)
+    elif store_type == StoreType.QDRANT:
+        return QdrantWriter(namespace)
+    elif store_type == StoreType.LOCAL:
+        from api.utils.local_vector_store import LocalVectorStoreWriter
+        return LocalVectorStoreWriter(namespace)
+
+    valid_stores = ", ".join(StoreType._member_names_)
+    raise ValueError(f"Invalid STORE environment variable value: {store_type}. Valid values are: {valid_stores}")
+
+
+def iter_batches(docs: Iterable[Document], max_texts: int, max_tokens: int, count_tokens, vector_id: Callable[[Document], str]) -> Iterator[EmbeddingBatch]:
+    """Groups documents into batches of at most `max_texts` texts and `max_tokens` tokens."""
+    batch = EmbeddingBatch()
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if batch.texts and (len(batch.texts) >= max_texts or batch.tokens + tokens > max_tokens):
+            yield batch
+            batch = EmbeddingBatch()
+        batch.texts.append(doc.page_content)
+        batch.metadatas.append(doc.metadata)
+        batch.ids.append(vector_id(doc))
+        batch.tokens += tokens
+    if batch.texts:
+        yield batch
+
+
+def get_token_counter(embeddings: Embeddings):
+    return get_model_token_counter(getattr(embeddings, 'model', 'text-embedding-ada-002'))
+
+
+class EmbeddingPipeline:
+    """Embeds documents in batches on a small thread pool and upserts each batch as soon as it is embedded.
+
+    At most `concurrency * 2` batches are pending at any time, so documents are pulled from the
+    input lazily and a slow or rate limited API holds back the producer instead of piling up
+    embedded vectors in memory.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        writer: VectorStoreWriter,
+        batch_size: Optional[int] = None,
+        batch_tokens: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        vector_id: Optional[Callable[[Document], str]] = None,
+        on_upserted: Optional[Callable[[EmbeddingBatch], None]] = None,
+    ):
+        self.vector_id = vector_id or (lambda doc: str(uuid4()))
+        self.on_upserted = on_upserted
+        self.embeddings = self._without_client_retries(embeddings)
+        self.writer = writer
+        self.batch_size = batch_size or getattr(embeddings, 'chunk_size', None) or int(os.environ.get('EMBEDDING_BATCH_SIZE', 100))
+        self.batch_tokens = batch_tokens or int(os.environ.get('EMBEDDING_BATCH_TOKENS', 20000))
+        self.concurrency = concurrency or int(os.environ.get('EMBEDDING_CONCURRENCY', 4))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('EMBEDDING_MAX_RETRIES', 6))
+        self.budget = TokenBudget(tokens_per_minute if tokens_per_minute is not None else int(os.environ.get('EMBEDDING_TOKENS_PER_MINUTE', 1000000)))
+
+    def run(self, docs: Iterable[Document]) -> int:
+        """Embeds and stores all documents, returns the number of stored chunks."""
+        count_tokens = get_token_counter(self.embeddings)
+        batches = iter_batches(docs, self.batch_size, self.batch_tokens, count_tokens, self.vector_id)
+        stored = 0
+        started_at = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='embedding') as pool:
+            pending = set()
+            try:
+                for batch in batches:
+                    if len(pending) >= self.concurrency * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        stored += sum(self._complete(future.result()) for future in done)
+                    pending.add(pool.submit(self._process, batch))
+
+                for future in pending:
+                    stored += self._complete(future.result())
+            except Exception:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        logger.info("Embedded and stored %s chunks in %.1fs", stored, time.monotonic() - started_at)
+        return stored
+
+    def _process(self, batch: EmbeddingBatch) -> EmbeddingBatch:
+        vectors = self._embed_with_backoff(batch)
+        self.writer.upsert(batch, vectors)
+        return batch
+
+    def _complete(self, batch: EmbeddingBatch) -> int:
+        # Runs on the calling thread, callbacks may use the Django ORM
+        if self.on_upserted:
+            self.on_upserted(batch)
+        return len(batch.texts)
+
+    def _embed_with_backoff(self, batch: EmbeddingBatch) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.budget.acquire(batch.tokens)
+            try:
+                return self.embeddings.embed_documents(batch.texts)
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = _retry_after(e) or min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                logger.warning("Embedding batch failed (%s), retrying in %.1fs (attempt %s/%s)", e.__class__.__name__, delay, attempt, self.max_retries)
+                self.budget.pause(delay)
+
+    @staticmethod
+    def _without_client_retries(embeddings: Embeddings) -> Embeddings:
+        # OpenAIEmbeddings retries rate limits on its own, per request and with a fixed
+        # wait. The pipeline handles retries itself so the backoff applies to all workers.
+        if hasattr(embeddings, 'max_retries'):
+            return embeddings.copy(update={'max_retries': 1})
+        return embeddings
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after') or headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def embed_and_upsert(docs: Iterable[Document], embeddings: Embeddings, store_type: StoreType, namespace: str, **kwargs) -> int:
+    writer = get_vector_store_writer(store_type, namespace)
+    stored = EmbeddingPipeline(embeddings, writer, **kwargs).run(docs)
+    writer.commit()
+    return stored
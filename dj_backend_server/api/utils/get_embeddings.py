@@ -3,6 +3,8 @@ from api.enums import EmbeddingProvider
 import os
 from dotenv import load_dotenv
 from langchain.embeddings.base import Embeddings
+from api.utils.client_registry import client_registry
+from api.utils.embedding_cache import with_embedding_cache
 
 load_dotenv()
 
@@ -26,7 +28,7 @@ def get_azure_embedding():
         openai_api_key=openai_api_key,
         deployment=deployment,
         client=client,
-        chunk_size=8,
+        chunk_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", 8)),
         openai_api_base=openai_api_base,
         openai_api_version=openai_api_version
     )
@@ -35,7 +37,7 @@ def get_openai_embedding():
     """Gets embeddings using the OpenAI embedding provider."""
     openai_api_key = os.environ.get("OPENAI_API_KEY")
 
-    return OpenAIEmbeddings(openai_api_key=openai_api_key, chunk_size=1)
+    return OpenAIEmbeddings(openai_api_key=openai_api_key, chunk_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", 100)))
 
 def choose_embedding_provider():
     """Chooses and returns the appropriate embedding provider instance."""
@@ -56,5 +58,12 @@ def choose_embedding_provider():
 
 # Main function to get embeddings
 def get_embeddings() -> Embeddings:
-    """Gets embeddings using the chosen embedding provider."""
-    return choose_embedding_provider()
\ No newline at end of file
+    """Gets embeddings using the chosen embedding provider, shared by the whole process.
+
+    The provider is wrapped with the embedding cache (see EMBEDDING_CACHE), so text that was
+    embedded before, by ingestion or by a question, is not sent to the API again.
+    """
+    return client_registry.get_or_create(
+        ('embeddings', get_embedding_provider()),
+        lambda: with_embedding_cache(choose_embedding_provider())
+    )
\ No newline at end of file
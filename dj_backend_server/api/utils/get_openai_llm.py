@@ -1,11 +1,12 @@
 from langchain.llms import AzureOpenAI, OpenAI
 import os
 from dotenv import load_dotenv
+from api.utils.client_registry import client_registry
 
 load_dotenv()
 
 # Azure OpenAI Language Model client
-def get_azure_openai_llm():
+def get_azure_openai_llm(streaming: bool = False):
     """Returns AzureOpenAI instance configured from environment variables"""
     
     openai_api_type = os.environ['OPENAI_API_TYPE']
@@ -22,24 +23,30 @@ def get_azure_openai_llm():
         openai_api_type=openai_api_type,
         openai_api_version=openai_api_version,
         temperature=0,
-        batch_size=8
+        batch_size=8,
+        streaming=streaming
     )
 
 # OpenAI Language Model client  
-def get_openai_llm():
+def get_openai_llm(streaming: bool = False):
     """Returns OpenAI instance configured from environment variables"""
     
     openai_api_key = os.environ['OPENAI_API_KEY']
     
     return OpenAI(
         temperature=0,
-        openai_api_key=openai_api_key
+        openai_api_key=openai_api_key,
+        streaming=streaming
     )
         
-# recommend not caching initially, and optimizing only if you observe a clear performance benefit from caching the clients. 
-# The simplest thing that works is often best to start.
-def get_llm():
-    """Returns LLM client instance based on OPENAI_API_TYPE"""
+# Clients are cached in the process-wide registry, building them per request was
+# paying for a fresh HTTP/TLS setup on every chat message.
+def get_llm(streaming: bool = False):
+    """Returns LLM client instance based on OPENAI_API_TYPE.
+
+    When `streaming` is set the client emits tokens through `on_llm_new_token`
+    callbacks as they are generated.
+    """
     
     clients = {
         'azure': get_azure_openai_llm,
@@ -50,4 +57,7 @@ def get_llm():
     if api_type not in clients:
         raise ValueError(f"Invalid OPENAI_API_TYPE: {api_type}")
     
-    return clients[api_type]()
\ No newline at end of file
+    return client_registry.get_or_create(
+        ('llm', api_type, streaming),
+        lambda: clients[api_type](streaming=streaming)
+    )
\ No newline at end of file
@@ -0,0 +1,27 @@
+import asyncio
+import os
+import weakref
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One pooled client per event loop, an httpx.AsyncClient cannot be shared across loops
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Returns the pooled async HTTP client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(200.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=int(os.environ.get('HTTP_CLIENT_MAX_CONNECTIONS', 100)),
+                max_keepalive_connections=int(os.environ.get('HTTP_CLIENT_MAX_KEEPALIVE', 20)),
+            ),
+        )
+        _clients[loop] = client
+    return client
@@ -0,0 +1,118 @@
+import logging
+import os
+import re
+from typing import List, Tuple
+
+from asgiref.sync import sync_to_async
+from dotenv import load_dotenv
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.schema.retriever import BaseRetriever
+from langchain.vectorstores.base import VectorStore
+
+from api.interfaces import StoreOptions
+from api.utils.get_vector_store import get_vector_store
+from api.utils.lexical_index import is_lexical_index_enabled, lexical_index_registry, tokenize
+from api.utils.metrics import timed_stage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Error codes, identifiers and API names: snake_case, dotted.names, camelCase, letters mixed with digits
+_EXACT_TERM = re.compile(r"`([^`]+)`|\b(\w+(?:_\w+)+|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)+|[a-z]+[A-Z]\w*|[A-Za-z]+\d\w*|\d+[A-Za-z]\w*)\b")
+_LETTER = re.compile(r"[A-Za-z]")
+# Shorter terms ("e.g", "v2") are as likely prose as identifiers and must not skip the vector search
+EXACT_TERM_MIN_LENGTH = 4
+
+
+def exact_terms(query: str) -> List[str]:
+    """Identifier-like terms of the query, backticked terms are exempt from the length floor."""
+    terms = []
+    for quoted, term in _EXACT_TERM.findall(query):
+        quoted = quoted.strip()
+        if quoted and _LETTER.search(quoted):
+            terms.append(quoted)
+        elif term and len(term) >= EXACT_TERM_MIN_LENGTH and _LETTER.search(term):
+            terms.append(term)
+    return terms
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int) -> List[Document]:
+    """Merges ranked lists, a document scores 1 / (rrf_k + rank) in every list it appears in."""
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses BM25 results from the namespace's lexical index with the vector store results.
+
+    Queries naming exact terms (error codes, function names) that the best lexical match
+    contains are answered from the lexical index alone, without embedding the query.
+    """
+
+    vector_store: VectorStore
+    namespace: str
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        lexical = self._lexical_search(query)
+        if self._matches_exact_terms(query, lexical):
+            return [doc for doc, _ in lexical[:self.k]]
+
+        with timed_stage('vector_search'):
+            vector = self.vector_store.similarity_search(query, k=self.fetch_k)
+        return reciprocal_rank_fusion([vector, [doc for doc, _ in lexical]], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        lexical = await sync_to_async(self._lexical_search)(query)
+        if self._matches_exact_terms(query, lexical):
+            return [doc for doc, _ in lexical[:self.k]]
+
+        with timed_stage('vector_search'):
+            vector = await self.vector_store.asimilarity_search(query, k=self.fetch_k)
+        return reciprocal_rank_fusion([vector, [doc for doc, _ in lexical]], self.k, self.rrf_k)
+
+    def _lexical_search(self, query: str) -> List[Tuple[Document, float]]:
+        try:
+            with timed_stage('lexical_search'):
+                return lexical_index_registry.search(self.namespace, query, self.fetch_k)
+        except Exception as e:
+            # The vector results alone are still a valid answer
+            logger.warning("Lexical search failed for %s: %s", self.namespace, e)
+            return []
+
+    def _matches_exact_terms(self, query: str, lexical: List[Tuple[Document, float]]) -> bool:
+        terms = exact_terms(query)
+        if not terms or not lexical:
+            return False
+        best_match_tokens = set(tokenize(lexical[0][0].page_content))
+        return all(set(tokenize(term)) <= best_match_tokens for term in terms)
+
+
+def get_retriever(options: StoreOptions) -> BaseRetriever:
+    """Returns the retriever of a namespace, hybrid unless RETRIEVAL_MODE is `vector`."""
+    vector_store = get_vector_store(options)
+    k = int(os.environ.get('RETRIEVAL_K', 4))
+    if os.environ.get('RETRIEVAL_MODE', 'hybrid') != 'hybrid' or not is_lexical_index_enabled():
+        return vector_store.as_retriever(search_kwargs={'k': k})
+
+    return HybridRetriever(
+        vector_store=vector_store,
+        namespace=options.namespace,
+        k=k,
+        fetch_k=int(os.environ.get('RETRIEVAL_FETCH_K', 20)),
+        rrf_k=int(os.environ.get('RETRIEVAL_RRF_K', 60)),
+    )
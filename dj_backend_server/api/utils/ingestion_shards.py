@@ -0,0 +1,59 @@
+import os
+from dataclasses import dataclass, field
+from typing import Callable, List, Sequence, TypeVar
+
+from dotenv import load_dotenv
+
+from api.enums import StoreType
+
+load_dotenv()
+
+T = TypeVar('T')
+
+# A source is split into shards of about this many PDF pages or files, each ingested by any worker
+SHARD_PAGES = int(os.environ.get('INGESTION_SHARD_PAGES', 200))
+SHARD_FILES = int(os.environ.get('INGESTION_SHARD_FILES', 200))
+
+
+@dataclass
+class IngestionPlan:
+    """How one data source is ingested as shards.
+
+    `data_source_id` is the chunk ledger's id of the source. Shards are JSON-serializable
+    descriptions of disjoint sets of sources (files, page ranges) for the celery tasks.
+    """
+    data_source_id: str
+    shards: List[dict] = field(default_factory=list)
+
+
+def is_sharding_enabled() -> bool:
+    # The LOCAL store writes to the ingesting worker's own disk, shards on other hosts would build diverging copies
+    if os.environ.get('STORE') == StoreType.LOCAL.value:
+        return False
+    return os.environ.get('INGESTION_SHARDING_ENABLED', 'true').lower() == 'true'
+
+
+def batched(items: Sequence[T], size: int, weight: Callable[[T], int] = lambda item: 1) -> List[List[T]]:
+    """Cuts the items, in order, into batches of about `size` weight each."""
+    batches: List[List[T]] = []
+    batch: List[T] = []
+    batch_weight = 0
+    for item in items:
+        if batch and batch_weight + weight(item) > size:
+            batches.append(batch)
+            batch, batch_weight = [], 0
+        batch.append(item)
+        batch_weight += weight(item)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def group_by_directory(items: Sequence[T], size: int, path: Callable[[T], str] = lambda item: item) -> List[List[T]]:
+    """Batches repository files so that a directory subtree lands in as few shards as possible.
+
+    Files are ordered by their directory's components, so every subtree is contiguous and
+    only a directory larger than `size` is split across shards.
+    """
+    ordered = sorted(items, key=lambda item: (path(item).split('/')[:-1], path(item)))
+    return batched(ordered, size)
@@ -1,46 +1,107 @@
+from typing import Callable, Iterable, List, Optional
 from langchain.docstore.document import Document
-from langchain.vectorstores.qdrant import Qdrant
 from api.enums import StoreType
 from langchain.embeddings.openai import OpenAIEmbeddings
 from api.interfaces import StoreOptions
-from api.configs import PINECONE_TEXT_KEY, VECTOR_STORE_INDEX_NAME
-import pinecone
-from langchain.vectorstores.pinecone import Pinecone
+from api.utils.chunk_ledger import ChunkLedger, LedgerStats
+from api.utils.embedding_pipeline import EmbeddingPipeline, get_vector_store_writer
+from api.utils.lexical_index import LexicalIndexer, LexicalIndexingWriter, is_lexical_index_enabled, lexical_index_registry
+from api.utils.semantic_cache import semantic_answer_cache
+from api.utils.vector_store_clients import initialize_pinecone
 from dotenv import load_dotenv
+from web.models.jobs import JobStage
+from web.services.ingestion_jobs import ensure_job_owned, report_stage
 import os
-import threading
-init_lock = threading.Lock()
 
 # Load environment variables from .env file
 load_dotenv()
 
-initialized = False
-def initialize_pinecone():
-    global initialized
-    # Only initialize Pinecone if the store type is Pinecone and the initialization lock is not acquired
-    with init_lock:
-        if not initialized:
-            # Initialize Pinecone
-            pinecone.init(
-                api_key=os.getenv("PINECONE_API_KEY"),  # find at app.pinecone.io
-                environment=os.getenv("PINECONE_ENV"),  # next to api key in console
-            )
-            initialized = True
-
-def init_vector_store(docs: list[Document], embeddings: OpenAIEmbeddings, options: StoreOptions) -> None:
+def init_vector_store(docs: Iterable[Document], embeddings: OpenAIEmbeddings, options: StoreOptions, data_source_id: Optional[str] = None, unchanged_sources: Iterable[str] = ()) -> Optional[LedgerStats]:
+    """Embeds and stores the documents in the namespace.
+
+    With a data_source_id the ingestion is incremental: only chunks that are new for that
+    data source are embedded, and chunks that are no longer part of it are deleted. The chunks
+    of `unchanged_sources` are kept as they are, without the caller loading those sources.
+    Returns the ledger's counts of an incremental ingestion.
+    """
+    writer, on_upserted = _get_writer(options)
+    stats = None
+
+    report_stage(JobStage.EMBED)
+    try:
+        if data_source_id is None:
+            # Embeds the documents in batches and upserts every batch as soon as it is embedded
+            EmbeddingPipeline(embeddings, writer, on_upserted=_call_all(on_upserted)).run(docs)
+        else:
+            ledger = ChunkLedger(options.namespace, data_source_id)
+            ledger.keep_sources(unchanged_sources)
+            on_upserted.insert(0, ledger.record)
+            EmbeddingPipeline(embeddings, writer, vector_id=ledger.vector_id, on_upserted=_call_all(on_upserted)).run(ledger.filter_changed(docs))
+            # Batches were upserted as they were embedded, what is left is dropping the stale chunks
+            report_stage(JobStage.UPSERT)
+            ensure_job_owned()
+            stats = ledger.finalize(writer)
+            if not stats.changed:
+                return stats
+    finally:
+        # Also after a failure, the ledger already recorded the batches that were stored
+        writer.commit()
+
+    _invalidate_namespace(options.namespace)
+    return stats
+
+
+def ingest_shard(docs: Iterable[Document], embeddings: OpenAIEmbeddings, options: StoreOptions, data_source_id: str, run_id: str) -> LedgerStats:
+    """Embeds the new chunks of one shard of a data source, leaving the stale chunks to `finalize_ingestion`.
+
+    Shards of a data source must not share sources, every shard and the final step use the same run_id.
+    """
+    writer, on_upserted = _get_writer(options)
+    ledger = ChunkLedger(options.namespace, data_source_id, run_id=run_id)
+    on_upserted.insert(0, ledger.record)
+    try:
+        EmbeddingPipeline(embeddings, writer, vector_id=ledger.vector_id, on_upserted=_call_all(on_upserted)).run(ledger.filter_changed(docs))
+    finally:
+        writer.commit()
+    return ledger.stats
+
+
+def finalize_ingestion(options: StoreOptions, data_source_id: str, run_id: str, changed: bool) -> LedgerStats:
+    """Deletes the chunks none of the shards of the run saw, `changed` when a shard added chunks."""
+    writer, _ = _get_writer(options)
+    ledger = ChunkLedger(options.namespace, data_source_id, run_id=run_id)
+    try:
+        stats = ledger.finalize(writer)
+    finally:
+        writer.commit()
+
+    if changed or stats.changed:
+        _invalidate_namespace(options.namespace)
+    return stats
+
+
+def _get_writer(options: StoreOptions):
     store_type = StoreType[os.environ['STORE']]
+    writer = get_vector_store_writer(store_type, options.namespace)
+    on_upserted = []
+
+    # Chunks are also kept in the lexical index of the namespace, for hybrid retrieval
+    if is_lexical_index_enabled():
+        indexer = LexicalIndexer(options.namespace)
+        writer = LexicalIndexingWriter(writer, indexer)
+        on_upserted.append(indexer.record)
+    return writer, on_upserted
+
 
-    if store_type == StoreType.PINECONE:
-        initialize_pinecone()
+def _invalidate_namespace(namespace: str) -> None:
+    # Answers cached before this ingestion may no longer match the namespace content
+    semantic_answer_cache.invalidate(namespace)
+    lexical_index_registry.invalidate(namespace)
 
-        # Use the Pinecone vector store
-        # docs, embeddings, VECTOR_STORE_INDEX_NAME, options.namespace, PINECONE_TEXT_KEY
-        Pinecone.from_documents(documents=docs, embedding=embeddings, index_name=VECTOR_STORE_INDEX_NAME, namespace=options.namespace)
 
-    elif store_type == StoreType.QDRANT:
-        print("called qdrant.from_documents")
-        Qdrant.from_documents(docs, embeddings, collection_name=options.namespace, url=os.environ['QDRANT_URL'])
+def _call_all(callbacks: List[Callable]) -> Optional[Callable]:
+    def on_upserted(batch):
+        for callback in callbacks:
+            callback(batch)
 
-    else:
-        valid_stores = ", ".join(StoreType._member_names())
-        raise ValueError(f"Invalid STORE environment variable value: {os.environ['STORE']}. Valid values are: {valid_stores}")
\ No newline at end of file
+    return on_upserted if callbacks else None
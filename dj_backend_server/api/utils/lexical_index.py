@@ -0,0 +1,221 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.core.cache import cache
+from dotenv import load_dotenv
+from langchain.docstore.document import Document
+
+from api.utils.embedding_pipeline import EmbeddingBatch, VectorStoreWriter
+from web.models.lexical_chunks import LexicalChunk
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Namespaces whose index is kept in memory by a process
+INDEX_CACHE_SIZE = int(os.environ.get('LEXICAL_INDEX_CACHE_SIZE', 32))
+INDEX_LOAD_BATCH_SIZE = 2000
+
+_TOKEN = re.compile(r"[a-z0-9_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, identifiers like `max_retries` are also indexed by their parts."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        if '_' in token.strip('_'):
+            tokens.extend(part for part in token.split('_') if part)
+    return tokens
+
+
+def is_lexical_index_enabled() -> bool:
+    return os.environ.get('LEXICAL_INDEX_ENABLED', 'true').lower() == 'true'
+
+
+class LexicalIndexer:
+    """Stores the chunks of an ingestion run for the lexical index of the namespace.
+
+    Rows are written from the embedding pipeline's `on_upserted` callback, i.e. on the
+    ingesting thread and only for chunks whose vectors were stored.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+
+    def record(self, batch: EmbeddingBatch) -> None:
+        rows = []
+        for vector_id, text, metadata in zip(batch.ids, batch.texts, batch.metadatas):
+            terms = Counter(tokenize(text))
+            rows.append(LexicalChunk(
+                namespace=self.namespace,
+                vector_id=vector_id,
+                content=text,
+                metadata=metadata,
+                terms=dict(terms),
+                length=sum(terms.values()),
+            ))
+        LexicalChunk.objects.bulk_create(rows, ignore_conflicts=True)
+
+    def delete(self, vector_ids: List[str]) -> None:
+        LexicalChunk.objects.filter(namespace=self.namespace, vector_id__in=vector_ids).delete()
+
+
+class LexicalIndexingWriter(VectorStoreWriter):
+    """Vector store writer that also removes deleted chunks from the lexical index."""
+
+    def __init__(self, writer: VectorStoreWriter, indexer: LexicalIndexer):
+        self.writer = writer
+        self.indexer = indexer
+
+    def upsert(self, batch: EmbeddingBatch, vectors: List[List[float]]) -> None:
+        # Runs on the embedding threads, the rows are added through LexicalIndexer.record
+        self.writer.upsert(batch, vectors)
+
+    def delete(self, ids: List[str]) -> None:
+        self.writer.delete(ids)
+        self.indexer.delete(ids)
+
+    def commit(self) -> None:
+        self.writer.commit()
+
+
+class BM25Index:
+    """In-memory inverted index of a namespace, postings are numpy arrays per term."""
+
+    def __init__(self, row_ids: List[int], lengths: np.ndarray, postings: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        self.row_ids = row_ids
+        self.postings = postings
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+        self._length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length) if average_length else lengths
+        self._idf = {term: math.log(1 + (len(row_ids) - len(docs) + 0.5) / (len(docs) + 0.5)) for term, (docs, _) in postings.items()}
+
+    @classmethod
+    def load(cls, namespace: str) -> "BM25Index":
+        row_ids, lengths = [], []
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        rows = LexicalChunk.objects.filter(namespace=namespace).order_by('id').values_list('id', 'terms', 'length')
+        for row_id, terms, length in rows.iterator(chunk_size=INDEX_LOAD_BATCH_SIZE):
+            doc = len(row_ids)
+            row_ids.append(row_id)
+            lengths.append(length)
+            for term, frequency in terms.items():
+                docs, frequencies = postings.setdefault(term, ([], []))
+                docs.append(doc)
+                frequencies.append(frequency)
+
+        return cls(
+            row_ids,
+            np.asarray(lengths, dtype=np.float32),
+            {term: (np.asarray(docs, dtype=np.int32), np.asarray(frequencies, dtype=np.float32)) for term, (docs, frequencies) in postings.items()},
+        )
+
+    def __len__(self) -> int:
+        return len(self.row_ids)
+
+    def search(self, terms: List[str], k: int) -> List[Tuple[int, float]]:
+        """Returns up to k (row id, score) pairs, best first."""
+        scores = np.zeros(len(self.row_ids), dtype=np.float32)
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            docs, frequencies = self.postings[term]
+            scores[docs] += self._idf[term] * frequencies * (BM25_K1 + 1) / (frequencies + self._length_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        top = matched[np.argsort(-scores[matched], kind='stable')[:k]]
+        return [(self.row_ids[doc], float(scores[doc])) for doc in top]
+
+
+class LexicalIndexRegistry:
+    """Per-process LRU of BM25 indexes, reloaded when an ingestion bumps the namespace generation."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._indexes: "OrderedDict[str, Tuple[int, BM25Index]]" = OrderedDict()
+        # namespace -> lock held while its index loads, other namespaces are served meanwhile
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def search(self, namespace: str, query: str, k: int) -> List[Tuple[Document, float]]:
+        index = self.get_index(namespace)
+        hits = index.search(tokenize(query), k)
+        if not hits:
+            return []
+
+        rows = LexicalChunk.objects.in_bulk([row_id for row_id, _ in hits])
+        return [
+            (Document(page_content=rows[row_id].content, metadata=rows[row_id].metadata), score)
+            for row_id, score in hits
+            if row_id in rows
+        ]
+
+    def get_index(self, namespace: str) -> BM25Index:
+        generation = _get_generation(namespace)
+        index = self._get_cached(namespace, generation)
+        if index is not None:
+            return index
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(namespace, threading.Lock())
+
+        # Concurrent requests for a cold namespace wait for one load
+        with load_lock:
+            index = self._get_cached(namespace, generation)
+            if index is not None:
+                return index
+
+            index = BM25Index.load(namespace)
+            with self._lock:
+                self._indexes[namespace] = (generation, index)
+                self._indexes.move_to_end(namespace)
+                while len(self._indexes) > self.max_size:
+                    self._indexes.popitem(last=False)
+                if self._load_locks.get(namespace) is load_lock:
+                    del self._load_locks[namespace]
+            logger.info("Loaded lexical index of %s with %s chunks", namespace, len(index))
+            return index
+
+    def _get_cached(self, namespace: str, generation: Optional[int]) -> Optional[BM25Index]:
+        with self._lock:
+            entry = self._indexes.get(namespace)
+            if entry is None or entry[0] != generation:
+                return None
+            self._indexes.move_to_end(namespace)
+            return entry[1]
+
+    def invalidate(self, namespace: str) -> None:
+        """Makes every process reload the index of the namespace on its next query."""
+        key = _generation_key(namespace)
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.warning("Could not bump lexical index generation for %s: %s", namespace, e)
+        with self._lock:
+            self._indexes.pop(namespace, None)
+
+
+def _get_generation(namespace: str) -> Optional[int]:
+    try:
+        return cache.get(_generation_key(namespace), 0)
+    except Exception as e:
+        logger.warning("Could not read lexical index generation for %s: %s", namespace, e)
+        return None
+
+
+def _generation_key(namespace: str) -> str:
+    return f"lexical_index:generation:{namespace}"
+
+
+lexical_index_registry = LexicalIndexRegistry(max_size=INDEX_CACHE_SIZE)
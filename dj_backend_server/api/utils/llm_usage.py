@@ -0,0 +1,94 @@
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+
+from api.utils.metrics import LLM_COST, LLM_TOKENS, RequestTrace, current_trace, record_stage
+from api.utils.token_counter import get_model_token_counter
+
+load_dotenv()
+
+# US dollars per 1000 prompt and completion tokens, LLM_PRICES (JSON, same shape) adds or overrides models
+DEFAULT_LLM_PRICES = {
+    'text-davinci-003': (0.02, 0.02),
+    'gpt-3.5-turbo-instruct': (0.0015, 0.002),
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-3.5-turbo-16k': (0.003, 0.004),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-32k': (0.06, 0.12),
+}
+LLM_PRICES = {**DEFAULT_LLM_PRICES, **{model: tuple(prices) for model, prices in json.loads(os.environ.get('LLM_PRICES', '{}')).items()}}
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Counts the tokens and cost of every LLM call of a chain run for the bot, and times the LLM and retrieval steps.
+
+    Created per request, so the stages land in that request's trace even when langchain runs
+    the callbacks on another thread. Streamed completions carry no usage from the API, their
+    tokens are counted locally.
+    """
+
+    def __init__(self, bot: str, trace: Optional[RequestTrace] = None):
+        self.bot = bot
+        self.trace = trace
+        self._started_at: Dict[UUID, float] = {}
+        self._prompts: Dict[UUID, List[str]] = {}
+        self._models: Dict[UUID, str] = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._started_at[run_id] = time.perf_counter()
+        self._prompts[run_id] = prompts
+        self._models[run_id] = (serialized or {}).get('kwargs', {}).get('model_name', 'unknown')
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_step('llm', run_id)
+        prompts = self._prompts.pop(run_id, [])
+        llm_output = response.llm_output or {}
+        model = llm_output.get('model_name') or self._models.get(run_id, 'unknown')
+        self._models.pop(run_id, None)
+        usage = llm_output.get('token_usage') or {}
+
+        prompt_tokens = usage.get('prompt_tokens')
+        completion_tokens = usage.get('completion_tokens')
+        if prompt_tokens is None or completion_tokens is None:
+            count_tokens = get_model_token_counter(model)
+            prompt_tokens = sum(count_tokens(prompt) for prompt in prompts)
+            completion_tokens = sum(count_tokens(generation.text) for generations in response.generations for generation in generations)
+        record_llm_usage(self.bot, model, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_step('llm', run_id)
+        self._prompts.pop(run_id, None)
+        self._models.pop(run_id, None)
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started_at[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_step('retrieval', run_id)
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_step('retrieval', run_id)
+
+    def _end_step(self, stage: str, run_id: UUID) -> None:
+        started_at = self._started_at.pop(run_id, None)
+        if started_at is not None:
+            record_stage(stage, time.perf_counter() - started_at, self.trace)
+
+
+def record_llm_usage(bot: str, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+    LLM_TOKENS.labels(bot=bot, model=model, type='prompt').inc(prompt_tokens)
+    LLM_TOKENS.labels(bot=bot, model=model, type='completion').inc(completion_tokens)
+    prices = LLM_PRICES.get(model)
+    if prices:
+        LLM_COST.labels(bot=bot, model=model).inc((prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000)
+
+
+def get_llm_metrics_handler(bot: str) -> LLMMetricsHandler:
+    """Handler for one chain call, bound to the trace of the request making it."""
+    return LLMMetricsHandler(bot, current_trace())
@@ -0,0 +1,391 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from api.utils.embedding_pipeline import EmbeddingBatch, VectorStoreWriter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Each namespace is a directory holding:
+#   manifest.json       committed state, replaced atomically by the writer
+#   vectors.<epoch>.f32 normalized float32 vectors, one row per added chunk, memory-mapped by readers
+#   log.<epoch>.jsonl   add/delete operations, the n-th add describes the n-th vector row
+#   ivf.<epoch>.<generation>.npz  optional approximate index over the live rows
+# Files are append-only within an epoch, readers only look at the rows and bytes the manifest
+# commits to. A compaction starts a new epoch with fresh files, so open memory maps stay valid.
+LOCAL_STORE_PATH = os.environ.get('LOCAL_VECTOR_STORE_PATH', 'local_vector_store')
+INDEX_TYPE = os.environ.get('LOCAL_VECTOR_INDEX', 'flat')
+IVF_LISTS = int(os.environ.get('LOCAL_VECTOR_IVF_LISTS', 0))
+IVF_PROBES = int(os.environ.get('LOCAL_VECTOR_IVF_PROBES', 8))
+# Below this many vectors a brute-force scan is as fast as the approximate index
+IVF_MIN_ROWS = 1000
+IVF_TRAIN_SAMPLE = 20000
+IVF_TRAIN_ITERATIONS = 10
+# Share of dead rows (deleted or overwritten) above which a commit rewrites the files
+COMPACT_RATIO = 0.5
+COPY_CHUNK_ROWS = 10000
+
+
+def namespace_path(namespace: str, root: Optional[str] = None) -> str:
+    if not namespace or namespace in ('.', '..') or os.path.basename(namespace) != namespace:
+        raise ValueError(f"Invalid namespace for the local vector store: {namespace!r}")
+    return os.path.join(root or LOCAL_STORE_PATH, namespace)
+
+
+class LocalVectorStoreWriter(VectorStoreWriter):
+    """Appends vectors to the local store of a namespace, visible to readers once committed.
+
+    An exclusive file lock is held from the first write to the commit, so two ingestions of the
+    same namespace are serialized. Rows written after the last commit (a crashed ingestion)
+    are truncated when the next writer opens the store.
+    """
+
+    def __init__(self, namespace: str, root: Optional[str] = None, index_type: Optional[str] = None):
+        self.path = namespace_path(namespace, root)
+        self.index_type = index_type or INDEX_TYPE
+        self._lock = threading.Lock()
+        self._manifest: Optional[dict] = None
+        self._lock_file = None
+        self._vectors = None
+        self._log = None
+
+    def upsert(self, batch: EmbeddingBatch, vectors: List[List[float]]) -> None:
+        array = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        lines = b''.join(
+            _log_line({'op': 'add', 'id': vector_id, 'text': text, 'metadata': metadata})
+            for vector_id, text, metadata in zip(batch.ids, batch.texts, batch.metadatas)
+        )
+        with self._lock:
+            self._open()
+            if self._manifest['dim'] is None:
+                self._manifest['dim'] = int(array.shape[1])
+            elif self._manifest['dim'] != array.shape[1]:
+                raise ValueError(f"Local vector store {self.path} stores {self._manifest['dim']}-dimensional vectors, the embeddings are {array.shape[1]}-dimensional")
+            self._vectors.write(array.tobytes())
+            self._log.write(lines)
+            self._manifest['rows'] += len(array)
+            self._manifest['log_bytes'] += len(lines)
+
+    def delete(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        line = _log_line({'op': 'delete', 'ids': list(ids)})
+        with self._lock:
+            self._open()
+            self._log.write(line)
+            self._manifest['log_bytes'] += len(line)
+
+    def commit(self) -> None:
+        with self._lock:
+            if self._manifest is None:
+                return
+            try:
+                for f in (self._vectors, self._log):
+                    f.flush()
+                    os.fsync(f.fileno())
+                    f.close()
+
+                manifest = self._manifest
+                manifest['generation'] += 1
+                row_ids, _, live = _replay(_log_path(self.path, manifest), manifest['log_bytes'])
+                if len(row_ids) and (len(row_ids) - len(live)) / len(row_ids) > COMPACT_RATIO:
+                    manifest = self._compact(manifest)
+                    live_rows = np.arange(manifest['rows'])
+                else:
+                    live_rows = np.fromiter(sorted(live.values()), dtype=np.int64, count=len(live))
+
+                manifest['ivf'] = None
+                if self.index_type == 'ivf' and len(live_rows) >= IVF_MIN_ROWS:
+                    manifest['ivf'] = self._build_ivf(manifest, live_rows)
+
+                _write_manifest(self.path, manifest)
+                _remove_stale_files(self.path, manifest)
+            finally:
+                self._manifest = None
+                self._vectors = self._log = None
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _open(self) -> None:
+        if self._manifest is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(os.path.join(self.path, 'write.lock'), 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+        manifest = _read_manifest(self.path) or _empty_manifest()
+        self._vectors = open(_vectors_path(self.path, manifest), 'ab')
+        self._vectors.truncate(manifest['rows'] * (manifest['dim'] or 0) * 4)
+        self._log = open(_log_path(self.path, manifest), 'ab')
+        self._log.truncate(manifest['log_bytes'])
+        self._manifest = manifest
+
+    def _compact(self, manifest: dict) -> dict:
+        row_ids, entries, live = _replay(_log_path(self.path, manifest), manifest['log_bytes'])
+        old_vectors = _open_vectors(self.path, manifest)
+        rows = np.fromiter(sorted(live.values()), dtype=np.int64, count=len(live))
+        compacted = {**manifest, 'epoch': manifest['epoch'] + 1, 'rows': len(rows), 'log_bytes': 0}
+
+        with open(_vectors_path(self.path, compacted), 'wb') as vectors_file, open(_log_path(self.path, compacted), 'wb') as log_file:
+            for start in range(0, len(rows), COPY_CHUNK_ROWS):
+                vectors_file.write(np.ascontiguousarray(old_vectors[rows[start:start + COPY_CHUNK_ROWS]]).tobytes())
+            for row in rows:
+                text, metadata = entries[row]
+                line = _log_line({'op': 'add', 'id': row_ids[row], 'text': text, 'metadata': metadata})
+                log_file.write(line)
+                compacted['log_bytes'] += len(line)
+            for f in (vectors_file, log_file):
+                f.flush()
+                os.fsync(f.fileno())
+
+        logger.info("Compacted local vector store %s from %s to %s rows", self.path, manifest['rows'], compacted['rows'])
+        return compacted
+
+    def _build_ivf(self, manifest: dict, live_rows: np.ndarray) -> str:
+        """Clusters the live rows with spherical k-means, every row is listed under its closest centroid."""
+        vectors = _open_vectors(self.path, manifest)
+        n_lists = IVF_LISTS or int(np.sqrt(len(live_rows)))
+        rng = np.random.default_rng(0)
+
+        sample = np.asarray(vectors[np.sort(rng.choice(live_rows, size=min(len(live_rows), IVF_TRAIN_SAMPLE), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=n_lists)
+            # Empty lists keep their centroid
+            centroids = np.where(counts[:, None] > 0, _normalize_rows(sums), centroids)
+
+        assignment = np.concatenate([
+            np.argmax(np.asarray(vectors[live_rows[start:start + COPY_CHUNK_ROWS]]) @ centroids.T, axis=1)
+            for start in range(0, len(live_rows), COPY_CHUNK_ROWS)
+        ])
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+
+        name = f"ivf.{manifest['epoch']}.{manifest['generation']}.npz"
+        tmp_path = os.path.join(self.path, name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, centroids=centroids, rows=live_rows[order], offsets=offsets)
+        os.replace(tmp_path, os.path.join(self.path, name))
+        return name
+
+
+@dataclass
+class _Snapshot:
+    manifest: dict
+    vectors: np.ndarray
+    valid: np.ndarray
+    documents: Dict[int, Tuple[str, dict]]
+    ivf: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store over the memory-mapped files of a namespace.
+
+    Search is a brute-force scan of the normalized vectors (cosine similarity), or, when the
+    writer built an IVF index, a scan of the `LOCAL_VECTOR_IVF_PROBES` closest clusters. The
+    snapshot is reloaded when the manifest changes, i.e. after every committed ingestion.
+    """
+
+    def __init__(self, namespace: str, embedding: Embeddings, root: Optional[str] = None):
+        self.namespace = namespace
+        self.root = root
+        self.path = namespace_path(namespace, root)
+        self.embedding = embedding
+        self._snapshot: Optional[_Snapshot] = None
+        self._manifest_stat = None
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid4()) for _ in texts]
+        writer = LocalVectorStoreWriter(self.namespace, self.root)
+        writer.upsert(EmbeddingBatch(texts=texts, metadatas=metadatas or [{} for _ in texts], ids=ids), self.embedding.embed_documents(texts))
+        writer.commit()
+        return ids
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        snapshot = self._get_snapshot()
+        if snapshot is None or not snapshot.documents:
+            return []
+
+        query = _normalize_rows(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+        if snapshot.ivf is not None:
+            rows, scores = self._search_ivf(snapshot, query)
+        else:
+            rows = np.arange(len(snapshot.valid))
+            scores = np.asarray(snapshot.vectors @ query)
+            scores[~snapshot.valid] = -np.inf
+
+        k = min(k, len(scores))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        results = []
+        for index in top:
+            if not np.isfinite(scores[index]):
+                break
+            text, metadata = snapshot.documents[int(rows[index])]
+            results.append((Document(page_content=text, metadata=metadata), float(scores[index])))
+        return results
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    def _search_ivf(self, snapshot: _Snapshot, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        centroids, list_rows, offsets = snapshot.ivf
+        probes = np.argsort(-(centroids @ query))[:IVF_PROBES]
+        rows = np.concatenate([list_rows[offsets[probe]:offsets[probe + 1]] for probe in probes])
+        return rows, np.asarray(snapshot.vectors[rows] @ query)
+
+    def _get_snapshot(self) -> Optional[_Snapshot]:
+        try:
+            stat = os.stat(os.path.join(self.path, 'manifest.json'))
+        except FileNotFoundError:
+            return None
+        stat_key = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+        with self._lock:
+            if self._snapshot is None or self._manifest_stat != stat_key:
+                try:
+                    self._snapshot = _load_snapshot(self.path)
+                except FileNotFoundError:
+                    # A commit replaced the files between reading the manifest and opening them
+                    self._snapshot = _load_snapshot(self.path)
+                self._manifest_stat = stat_key
+            return self._snapshot
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, namespace: Optional[str] = None, **kwargs: Any) -> "LocalVectorStore":
+        store = cls(namespace or str(uuid4()), embedding)
+        store.add_texts(texts, metadatas, **kwargs)
+        return store
+
+
+def _load_snapshot(path: str) -> Optional[_Snapshot]:
+    manifest = _read_manifest(path)
+    if manifest is None or not manifest['rows']:
+        return None
+
+    row_ids, entries, live = _replay(_log_path(path, manifest), manifest['log_bytes'])
+    valid = np.zeros(manifest['rows'], dtype=bool)
+    valid[list(live.values())] = True
+
+    ivf = None
+    if manifest.get('ivf'):
+        with np.load(os.path.join(path, manifest['ivf'])) as data:
+            ivf = (data['centroids'], data['rows'], data['offsets'])
+
+    return _Snapshot(
+        manifest=manifest,
+        vectors=_open_vectors(path, manifest),
+        valid=valid,
+        documents={row: entries[row] for row in live.values()},
+        ivf=ivf,
+    )
+
+
+def _replay(log_path: str, log_bytes: int) -> Tuple[List[str], List[Tuple[str, dict]], Dict[str, int]]:
+    """Returns the id and document of every row, and the row currently holding each live id."""
+    row_ids: List[str] = []
+    entries: List[Tuple[str, dict]] = []
+    live: Dict[str, int] = {}
+    if not log_bytes:
+        return row_ids, entries, live
+
+    with open(log_path, 'rb') as f:
+        data = f.read(log_bytes)
+    for line in data.splitlines():
+        op = json.loads(line)
+        if op['op'] == 'add':
+            # Re-adding an id (a retried ingestion) supersedes the earlier row
+            live[op['id']] = len(row_ids)
+            row_ids.append(op['id'])
+            entries.append((op['text'], op['metadata']))
+        else:
+            for vector_id in op['ids']:
+                live.pop(vector_id, None)
+    return row_ids, entries, live
+
+
+def _open_vectors(path: str, manifest: dict) -> np.ndarray:
+    if not manifest['rows']:
+        return np.zeros((0, manifest['dim'] or 0), dtype=np.float32)
+    return np.memmap(_vectors_path(path, manifest), dtype=np.float32, mode='r', shape=(manifest['rows'], manifest['dim']))
+
+
+def _normalize_rows(array: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(array, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (array / norms).astype(np.float32)
+
+
+def _log_line(op: dict) -> bytes:
+    return json.dumps(op, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def _empty_manifest() -> dict:
+    return {'epoch': 0, 'generation': 0, 'dim': None, 'rows': 0, 'log_bytes': 0, 'ivf': None}
+
+
+def _read_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(path: str, manifest: dict) -> None:
+    tmp_path = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, 'manifest.json'))
+
+
+def _remove_stale_files(path: str, manifest: dict) -> None:
+    keep = {os.path.basename(_vectors_path(path, manifest)), os.path.basename(_log_path(path, manifest)), manifest.get('ivf'), 'manifest.json', 'write.lock'}
+    for name in os.listdir(path):
+        if name not in keep:
+            # Readers that still map an old file keep it alive until they reload
+            os.remove(os.path.join(path, name))
+
+
+def _vectors_path(path: str, manifest: dict) -> str:
+    return os.path.join(path, f"vectors.{manifest['epoch']}.f32")
+
+
+def _log_path(path: str, manifest: dict) -> str:
+    return os.path.join(path, f"log.{manifest['epoch']}.jsonl")
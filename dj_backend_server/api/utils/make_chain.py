@@ -1,4 +1,4 @@
-from langchain.vectorstores.base import VectorStore
+from langchain.schema.retriever import BaseRetriever
 from dotenv import load_dotenv
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
@@ -7,38 +7,64 @@ from api.utils.get_openai_llm import get_llm
 from langchain import PromptTemplate, LLMChain
 from langchain.chains import RetrievalQAWithSourcesChain, ConversationalRetrievalChain
 from api.utils.get_prompts import get_qa_prompt_by_mode
+from api.utils.hybrid_retriever import get_retriever
+from api.utils.client_registry import client_registry
+from api.interfaces import StoreOptions
+import hashlib
 
 load_dotenv()
 
-def get_qa_chain(vector_store: VectorStore, mode, initial_prompt: str) -> RetrievalQA:
+def get_qa_chain(retriever: BaseRetriever, mode, initial_prompt: str) -> RetrievalQA:
     llm = get_llm()
     template = get_qa_prompt_by_mode(mode, initial_prompt=initial_prompt)
     prompt = PromptTemplate.from_template(template)
 
     qa_chain = RetrievalQA.from_chain_type(
         llm,
-        retriever=vector_store.as_retriever(),
+        retriever=retriever,
         chain_type_kwargs={"prompt": prompt},
         return_source_documents=True
     )
     
 
     return qa_chain
-def getRetrievalQAWithSourcesChain(vector_store: VectorStore, mode, initial_prompt: str):
-    llm = get_llm()
-    chain = RetrievalQAWithSourcesChain.from_chain_type(llm, chain_type="stuff", retriever=vector_store.as_retriever())
+def getRetrievalQAWithSourcesChain(retriever: BaseRetriever, mode, initial_prompt: str, streaming: bool = False):
+    llm = get_llm(streaming=streaming)
+    chain = RetrievalQAWithSourcesChain.from_chain_type(llm, chain_type="stuff", retriever=retriever)
     return chain
 
 
-def getConversationRetrievalChain(vector_store: VectorStore, mode, initial_prompt: str):
-    llm = get_llm()
+def getConversationRetrievalChain(retriever: BaseRetriever, mode, initial_prompt: str, streaming: bool = False):
+    llm = get_llm(streaming=streaming)
     template = get_qa_prompt_by_mode(mode, initial_prompt=initial_prompt)
     prompt = PromptTemplate.from_template(template)
+    # The condense step is never streamed, only the final answer should reach the client
     chain = ConversationalRetrievalChain.from_llm(
         llm, 
         chain_type="stuff", 
-        retriever=vector_store.as_retriever(), 
+        retriever=retriever, 
         verbose=True,
+        condense_question_llm=get_llm() if streaming else None,
         combine_docs_chain_kwargs={"prompt": prompt}
     )
-    return chain
\ No newline at end of file
+    return chain
+
+
+def get_chain(chain_type: str, options: StoreOptions, mode, initial_prompt: str, streaming: bool = False):
+    """Returns the chain for a namespace, built lazily and reused until evicted or invalidated.
+
+    The prompt is part of the key, so a bot whose prompt changed never gets a stale chain.
+    """
+    chain_builders = {
+        'retrieval_qa': getRetrievalQAWithSourcesChain,
+        'conversation_retrieval': getConversationRetrievalChain,
+    }
+    if chain_type not in chain_builders:
+        raise ValueError(f"Invalid CHAIN_TYPE: {chain_type}")
+
+    prompt_hash = hashlib.sha1((initial_prompt or '').encode('utf-8')).hexdigest()
+    return client_registry.get_or_create(
+        ('chain', chain_type, options.namespace, mode, prompt_hash, streaming),
+        lambda: chain_builders[chain_type](get_retriever(options), mode, initial_prompt, streaming=streaming),
+        namespace=options.namespace
+    )
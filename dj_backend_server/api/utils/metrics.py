@@ -0,0 +1,95 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Metrics are rendered in the Prometheus text format by api/metrics/. With PROMETHEUS_MULTIPROC_DIR
+# set, every web and celery process of the host writes its samples there and a scrape sums them,
+# whichever process answers it. Without it each process only reports its own samples.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram('openchat_http_request_duration_seconds', 'Time until the response (or the first byte of a stream) is returned.', ['view', 'method', 'status'], buckets=DEFAULT_BUCKETS)
+STAGE_SECONDS = Histogram('openchat_stage_duration_seconds', 'Time spent in a stage of the chat pipeline.', ['stage'], buckets=DEFAULT_BUCKETS)
+CACHE_REQUESTS = Counter('openchat_cache_requests_total', 'Cache lookups by cache and result.', ['cache', 'result'])
+LLM_TOKENS = Counter('openchat_llm_tokens_total', 'Tokens sent to and generated by the LLM, per bot.', ['bot', 'model', 'type'])
+LLM_COST = Counter('openchat_llm_cost_usd_total', 'Estimated LLM cost in US dollars, per bot.', ['bot', 'model'])
+# Summed over the processes that are still running
+ADMISSION_IN_FLIGHT = Gauge('openchat_admission_in_flight', 'Chat requests being answered.', multiprocess_mode='livesum')
+ADMISSION_QUEUE_DEPTH = Gauge('openchat_admission_queue_depth', 'Chat requests waiting for a free slot.', multiprocess_mode='livesum')
+ADMISSION_QUEUE_SECONDS = Histogram('openchat_admission_queue_seconds', 'Time admitted chat requests waited for a free slot.', buckets=DEFAULT_BUCKETS)
+ADMISSION_REJECTED = Counter('openchat_admission_rejected_total', 'Chat requests turned away, by reason.', ['reason'])
+
+
+def render_metrics() -> bytes:
+    """Returns the metrics in the Prometheus text exposition format, of every process when multiprocess mode is on."""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drops the live gauges of an exited process, e.g. from gunicorn's child_exit hook."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+@dataclass
+class RequestTrace:
+    """Time spent per stage while handling one request, reported in its Server-Timing header."""
+    started_at: float = field(default_factory=time.perf_counter)
+    stages: Dict[str, float] = field(default_factory=dict)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        timings.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ', '.join(timings)
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar('request_trace', default=None)
+
+
+def start_trace() -> Tuple[RequestTrace, contextvars.Token]:
+    trace = RequestTrace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token: contextvars.Token) -> None:
+    _current_trace.reset(token)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def record_stage(stage: str, seconds: float, trace: Optional[RequestTrace] = None) -> None:
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    trace = trace or current_trace()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Times the block as a stage of the current request, works in sync and async code alike."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started_at)
+
+
+def record_cache_lookup(cache_name: str, hits: int = 0, misses: int = 0) -> None:
+    if hits:
+        CACHE_REQUESTS.labels(cache=cache_name, result='hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache=cache_name, result='miss').inc(misses)
@@ -0,0 +1,110 @@
+import logging
+import os
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import pypdfium2 as pdfium
+from dotenv import load_dotenv
+from langchain.docstore.document import Document
+
+from api.utils.process_pool import iter_ordered
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PageRange:
+    path: str
+    start: int
+    stop: int
+    total_pages: int
+
+
+def count_pages(path: str) -> int:
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Returns the text of pages [start, stop) of the PDF, runs in the pool processes."""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        texts = []
+        for index in range(start, stop):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        pdf.close()
+
+
+class PdfExtractor:
+    """Extracts the pages of PDF files on a process pool and yields them as documents, in order.
+
+    Text extraction is CPU bound, so threads only took turns on the GIL. Pages are sent to
+    the workers in ranges of `pages_per_task`, at most two ranges per process are in flight,
+    so a large upload streams into the splitter instead of being held in memory. If the pool
+    cannot be started (or dies) the remaining pages are extracted in this process.
+    """
+
+    def __init__(self, processes: Optional[int] = None, pages_per_task: Optional[int] = None, on_progress: Optional[Callable[[int, int], None]] = None):
+        self.processes = processes or int(os.environ.get('PDF_EXTRACTION_PROCESSES', 0)) or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task or int(os.environ.get('PDF_PAGES_PER_TASK', 8))
+        self.on_progress = on_progress
+        self._pages_done = 0
+        self._total_pages = 0
+
+    def iter_documents(self, paths: Iterable[str]) -> Iterator[Document]:
+        return self.iter_page_ranges(self.plan(paths))
+
+    def iter_page_ranges(self, tasks: List[PageRange]) -> Iterator[Document]:
+        """Extracts the given page ranges, e.g. one shard of a larger upload."""
+        self._pages_done = 0
+        self._total_pages = sum(task.stop - task.start for task in tasks)
+
+        done = 0
+        if self.processes > 1 and len(tasks) > 1:
+            try:
+                for task, texts in self._iter_parallel(tasks):
+                    yield from self._complete(task, texts)
+                    done += 1
+            except (BrokenProcessPool, OSError) as e:
+                logger.warning("PDF extraction pool failed (%s), extracting the remaining pages in process", e)
+
+        # Extraction errors propagate: pages skipped here would lose their stored chunks once the
+        # ledger drops what the run did not see, the ingestion job retries instead
+        for task in tasks[done:]:
+            yield from self._complete(task, extract_page_range(task.path, task.start, task.stop))
+
+    def plan(self, paths: Iterable[str]) -> List[PageRange]:
+        """Splits the PDFs into ranges of `pages_per_task` pages, raises when a file cannot be opened."""
+        tasks = []
+        for path in paths:
+            total_pages = count_pages(path)
+            for start in range(0, total_pages, self.pages_per_task):
+                tasks.append(PageRange(path, start, min(start + self.pages_per_task, total_pages), total_pages))
+        return tasks
+
+    def _iter_parallel(self, tasks: List[PageRange]):
+        for task, future in iter_ordered(extract_page_range, tasks, lambda task: (task.path, task.start, task.stop), self.processes):
+            yield task, future.result()
+
+    def _complete(self, task: PageRange, texts: List[str]) -> Iterator[Document]:
+        for index, text in zip(range(task.start, task.stop), texts):
+            # Scanned pages without a text layer have nothing to index
+            if text.strip():
+                yield Document(page_content=text, metadata={'source': task.path, 'page': index, 'total_pages': task.total_pages})
+
+        self._pages_done += task.stop - task.start
+        if self.on_progress:
+            self.on_progress(self._pages_done, self._total_pages)
+
@@ -0,0 +1,56 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterator, Sequence, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+def get_mp_context():
+    # Forked workers do not re-import the Django project, spawned ones would
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def can_start_processes() -> bool:
+    # Celery's prefork workers are daemonic, and daemonic processes may not have children
+    return not multiprocessing.current_process().daemon
+
+
+def iter_ordered(fn: Callable, tasks: Sequence[T], arguments: Callable[[T], tuple], processes: int) -> Iterator[Tuple[T, Future]]:
+    """Runs fn(*arguments(task)) for every task on a process pool, yields (task, done future) in task order.
+
+    At most two tasks per process are in flight, so results are consumed as a stream
+    instead of piling up in memory. Callers decide what a failed future means. In a
+    process that can't start a pool the tasks run one by one in this process.
+    """
+    if not can_start_processes():
+        yield from _iter_in_process(fn, tasks, arguments)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=get_mp_context())
+    pending: "deque[Future]" = deque()
+    submitted = 0
+    try:
+        for task in tasks:
+            while submitted < len(tasks) and len(pending) < processes * 2:
+                pending.append(pool.submit(fn, *arguments(tasks[submitted])))
+                submitted += 1
+
+            future = pending.popleft()
+            # Waits without raising, the caller reads the result or the exception
+            future.exception()
+            yield task, future
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _iter_in_process(fn: Callable, tasks: Sequence[T], arguments: Callable[[T], tuple]) -> Iterator[Tuple[T, Future]]:
+    for task in tasks:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*arguments(task)))
+        except Exception as e:
+            future.set_exception(e)
+        yield task, future
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import os
+import re
+from typing import Optional
+
+from django.core.cache import cache
+from dotenv import load_dotenv
+from langchain import LLMChain, PromptTemplate
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+
+from api.utils.get_openai_llm import get_llm
+from api.utils.get_prompts import get_condense_prompt_by_mode
+from api.utils.metrics import record_cache_lookup, timed_stage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionRewriteMode:
+    NONE = 'none'  # questions are answered as asked, one LLM call per message
+    HEURISTIC = 'heuristic'  # only follow-ups that refer back to the conversation are rewritten
+    LLM = 'llm'  # every question with history is rewritten, as ConversationalRetrievalChain does
+
+
+REWRITE_MODE = os.environ.get('QUESTION_REWRITE_MODE', QuestionRewriteMode.HEURISTIC)
+REWRITE_CACHE_TTL = int(os.environ.get('QUESTION_REWRITE_CACHE_TTL', 3600))
+
+# Words that point back at earlier turns ("does it support...", "what about the other one")
+_REFERENCE_WORDS = {
+    'it', 'its', 'this', 'that', 'these', 'those', 'they', 'them', 'their', 'theirs',
+    'he', 'him', 'his', 'she', 'her', 'hers', 'there', 'here', 'such', 'same', 'other',
+    'above', 'previous', 'earlier', 'former', 'latter', 'again', 'also', 'else', 'more',
+    'one', 'ones',
+}
+_FOLLOW_UP_OPENERS = ('and ', 'but ', 'or ', 'so ', 'what about', 'how about', 'why not', 'then ', 'ok ', 'okay ')
+_WORD = re.compile(r"[a-z']+")
+# Questions this short ("why?", "how much?") only make sense in the conversation
+MIN_STANDALONE_WORDS = 4
+
+
+def needs_rewrite(question: str) -> bool:
+    """Cheap check whether a follow-up question depends on the conversation before it."""
+    text = question.strip().lower()
+    words = _WORD.findall(text)
+    if len(words) < MIN_STANDALONE_WORDS:
+        return True
+    if text.startswith(_FOLLOW_UP_OPENERS):
+        return True
+    return any(word in _REFERENCE_WORDS for word in words)
+
+
+def rewrite_question(question: str, chat_history: list, mode: str, callbacks: Optional[list] = None) -> str:
+    """Returns a question that can be answered without the chat history.
+
+    The chain is then called with an empty history, so it skips its own condense step and a
+    standalone follow-up costs a single LLM call. Rewrites are cached by conversation and question.
+    `callbacks` are passed to the rewrite LLM call.
+    """
+    if not _should_rewrite(question, chat_history):
+        return question
+
+    key = _cache_key(question, chat_history, mode)
+    rewritten = cache.get(key)
+    record_cache_lookup('question_rewrite', hits=int(rewritten is not None), misses=int(rewritten is None))
+    if rewritten is None:
+        with timed_stage('rewrite'):
+            rewritten = _get_rewrite_chain(mode).predict(question=question, chat_history=_get_chat_history(chat_history), callbacks=callbacks).strip() or question
+        cache.set(key, rewritten, REWRITE_CACHE_TTL)
+    return rewritten
+
+
+async def arewrite_question(question: str, chat_history: list, mode: str, callbacks: Optional[list] = None) -> str:
+    """Async variant of rewrite_question."""
+    if not _should_rewrite(question, chat_history):
+        return question
+
+    key = _cache_key(question, chat_history, mode)
+    rewritten = await cache.aget(key)
+    record_cache_lookup('question_rewrite', hits=int(rewritten is not None), misses=int(rewritten is None))
+    if rewritten is None:
+        with timed_stage('rewrite'):
+            rewritten = (await _get_rewrite_chain(mode).apredict(question=question, chat_history=_get_chat_history(chat_history), callbacks=callbacks)).strip() or question
+        await cache.aset(key, rewritten, REWRITE_CACHE_TTL)
+    return rewritten
+
+
+def _should_rewrite(question: str, chat_history: list) -> bool:
+    if not chat_history or REWRITE_MODE == QuestionRewriteMode.NONE:
+        return False
+    if REWRITE_MODE == QuestionRewriteMode.HEURISTIC:
+        return needs_rewrite(question)
+    return True
+
+
+def _get_rewrite_chain(mode: str) -> LLMChain:
+    return LLMChain(llm=get_llm(), prompt=PromptTemplate.from_template(get_condense_prompt_by_mode(mode)))
+
+
+def _cache_key(question: str, chat_history: list, mode: str) -> str:
+    digest = hashlib.sha1(f"{mode}\x00{_get_chat_history(chat_history)}\x00{question}".encode('utf-8')).hexdigest()
+    return f"question_rewrite:{digest}"
@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.core.cache import cache
+from dotenv import load_dotenv
+
+from api.utils.metrics import record_cache_lookup
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CachedAnswer:
+    vector: np.ndarray
+    answer: str
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """Per-namespace cache of answers, looked up by cosine similarity of the question embedding.
+
+    Entries live in process memory with TTL and LRU eviction. Invalidation goes through a
+    generation counter in the shared Django cache, so re-ingesting a namespace in a celery
+    worker also clears the answers cached by the web processes.
+    """
+
+    def __init__(self, threshold: float, ttl: int, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._buckets: Dict[Tuple[str, str], "OrderedDict[str, _CachedAnswer]"] = {}
+        self._generations: Dict[str, int] = {}
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def lookup(self, namespace: str, prompt_key: str, question: str, vector: List[float]) -> Optional[str]:
+        return self._search(namespace, prompt_key, vector, self._get_generation(namespace))
+
+    async def alookup(self, namespace: str, prompt_key: str, question: str, vector: List[float]) -> Optional[str]:
+        """Async variant of lookup, reads the generation without blocking the event loop."""
+        return self._search(namespace, prompt_key, vector, await self._aget_generation(namespace))
+
+    def _search(self, namespace: str, prompt_key: str, vector: List[float], generation: int) -> Optional[str]:
+        query = _normalize(vector)
+
+        with self._lock:
+            if self._generations.get(namespace) != generation:
+                self._drop_namespace(namespace)
+                self._generations[namespace] = generation
+
+            bucket = self._buckets.get((namespace, prompt_key))
+            best_question, best_score = None, -1.0
+            if bucket:
+                self._expire(bucket)
+                if bucket:
+                    questions = list(bucket.keys())
+                    scores = np.stack([bucket[q].vector for q in questions]) @ query
+                    best = int(np.argmax(scores))
+                    best_question, best_score = questions[best], float(scores[best])
+
+            if best_question is not None and best_score >= self.threshold:
+                bucket.move_to_end(best_question)
+                self._hits[namespace] += 1
+                record_cache_lookup('semantic_answer', hits=1)
+                logger.debug("Semantic cache hit for namespace %s (score %.3f)", namespace, best_score)
+                return bucket[best_question].answer
+
+            self._misses[namespace] += 1
+            record_cache_lookup('semantic_answer', misses=1)
+            return None
+
+    def store(self, namespace: str, prompt_key: str, question: str, vector: List[float], answer: str) -> None:
+        with self._lock:
+            bucket = self._buckets.setdefault((namespace, prompt_key), OrderedDict())
+            bucket[question] = _CachedAnswer(vector=_normalize(vector), answer=answer, created_at=time.monotonic())
+            bucket.move_to_end(question)
+            while len(bucket) > self.max_entries:
+                bucket.popitem(last=False)
+
+    def invalidate(self, namespace: str) -> None:
+        """Drops the cached answers of a namespace in every process."""
+        key = _generation_key(namespace)
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.warning("Could not bump semantic cache generation for %s: %s", namespace, e)
+        with self._lock:
+            self._drop_namespace(namespace)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            namespaces = set(self._hits) | set(self._misses)
+            return {ns: {'hits': self._hits[ns], 'misses': self._misses[ns]} for ns in namespaces}
+
+    def _get_generation(self, namespace: str) -> int:
+        try:
+            return cache.get(_generation_key(namespace), 0)
+        except Exception as e:
+            logger.warning("Could not read semantic cache generation for %s: %s", namespace, e)
+            return self._generations.get(namespace, 0)
+
+    async def _aget_generation(self, namespace: str) -> int:
+        try:
+            return await cache.aget(_generation_key(namespace), 0)
+        except Exception as e:
+            logger.warning("Could not read semantic cache generation for %s: %s", namespace, e)
+            return self._generations.get(namespace, 0)
+
+    def _expire(self, bucket: "OrderedDict[str, _CachedAnswer]") -> None:
+        deadline = time.monotonic() - self.ttl
+        for question in [q for q, entry in bucket.items() if entry.created_at < deadline]:
+            del bucket[question]
+
+    def _drop_namespace(self, namespace: str) -> None:
+        for key in [key for key in self._buckets if key[0] == namespace]:
+            del self._buckets[key]
+
+
+def _generation_key(namespace: str) -> str:
+    return f"semantic_cache:generation:{namespace}"
+
+
+def _normalize(vector: List[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+def is_semantic_cache_enabled() -> bool:
+    return os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+
+
+semantic_answer_cache = SemanticAnswerCache(
+    threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.95)),
+    ttl=int(os.environ.get('SEMANTIC_CACHE_TTL', 3600)),
+    max_entries=int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 500)),
+)
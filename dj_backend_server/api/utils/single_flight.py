@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from django.core.cache import cache
+from dotenv import load_dotenv
+
+from api.utils.metrics import record_cache_lookup
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LEADER = 'leader'  # computes the result and publishes it
+FOLLOWER = 'follower'  # waits for the leader of this process
+REMOTE = 'remote'  # waits for the leader of another process, on behalf of this process' followers
+
+
+class Flight:
+    """One caller's part in a coalesced computation.
+
+    A leader computes and ends the flight with `complete` or `fail`. Everybody else calls
+    `wait`, which returns the leader's result, or None when there is none to share (the
+    other process' leader failed or took too long) and the caller has to compute it itself.
+    On an event loop use `await_result`, `acomplete` and `afail`, which do not block it on
+    the shared cache.
+    """
+
+    def __init__(self, group: "SingleFlight", key: str, future: Future, role: str, owner: Optional[str] = None):
+        self.group = group
+        self.key = key
+        self.future = future
+        self.role = role
+        self.owner = owner
+
+    @property
+    def is_leader(self) -> bool:
+        return self.role == LEADER
+
+    def wait(self) -> Optional[str]:
+        if self.role == REMOTE:
+            result = None
+            deadline = time.monotonic() + self.group.wait_timeout
+            while time.monotonic() < deadline:
+                result, done = self.group._poll(self.key)
+                if done:
+                    break
+                time.sleep(self.group.poll_interval)
+            self.group._finish(self.key, self.future, result=result)
+            return self._coalesced(result)
+
+        try:
+            return self._coalesced(self.future.result(timeout=self.group.wait_timeout))
+        except FutureTimeoutError:
+            return None
+
+    async def await_result(self) -> Optional[str]:
+        if self.role == REMOTE:
+            result = None
+            deadline = time.monotonic() + self.group.wait_timeout
+            while time.monotonic() < deadline:
+                result, done = await self.group._apoll(self.key)
+                if done:
+                    break
+                await asyncio.sleep(self.group.poll_interval)
+            self.group._finish(self.key, self.future, result=result)
+            return self._coalesced(result)
+
+        try:
+            # Shielded, a timed out waiter must not cancel the leader's future for the others
+            return self._coalesced(await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.future)), self.group.wait_timeout))
+        except asyncio.TimeoutError:
+            return None
+
+    def complete(self, result: str) -> None:
+        self.group._publish(self.key, self.owner, result)
+        self.group._finish(self.key, self.future, result=result)
+
+    async def acomplete(self, result: str) -> None:
+        # The followers of this process first, publishing may be cut short by a cancellation
+        self.group._finish(self.key, self.future, result=result)
+        await self.group._apublish(self.key, self.owner, result)
+
+    def fail(self, error: BaseException) -> None:
+        self.group._release(self.key, self.owner)
+        self._fail_followers(error)
+
+    async def afail(self, error: BaseException) -> None:
+        self._fail_followers(error)
+        await self.group._arelease(self.key, self.owner)
+
+    def _fail_followers(self, error: BaseException) -> None:
+        if isinstance(error, Exception):
+            self.group._finish(self.key, self.future, error=error)
+        else:
+            # The leader was cancelled (its client went away), the followers compute it themselves
+            self.group._finish(self.key, self.future, result=None)
+
+    def _coalesced(self, result: Optional[str]) -> Optional[str]:
+        if result is not None:
+            record_cache_lookup('single_flight', hits=1)
+        return result
+
+
+class SingleFlight:
+    """Coalesces concurrent computations of the same key, within the process and across processes.
+
+    In a process the first caller of a key leads and the others wait on its future. Across
+    processes the leader holds a lock in the shared cache and publishes its result there for
+    `result_ttl` seconds; the first caller of another process polls for it, its own followers
+    wait on it.
+    """
+
+    def __init__(self, wait_timeout: float, result_ttl: int, poll_interval: float):
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: str) -> Flight:
+        follower, future = self._join(key)
+        if follower is not None:
+            return follower
+
+        owner = str(uuid.uuid4())
+        try:
+            # The lock outlives a crashed leader by at most the wait timeout
+            acquired = cache.add(_lock_key(key), owner, timeout=max(1, int(self.wait_timeout)))
+        except Exception as e:
+            logger.warning("Could not take the single-flight lock: %s", e)
+            acquired = True
+        if acquired:
+            return Flight(self, key, future, LEADER, owner)
+        return self._follow_remote(key, future, *self._poll(key))
+
+    async def abegin(self, key: str) -> Flight:
+        follower, future = self._join(key)
+        if follower is not None:
+            return follower
+
+        owner = str(uuid.uuid4())
+        try:
+            acquired = await cache.aadd(_lock_key(key), owner, timeout=max(1, int(self.wait_timeout)))
+        except Exception as e:
+            logger.warning("Could not take the single-flight lock: %s", e)
+            acquired = True
+        if acquired:
+            return Flight(self, key, future, LEADER, owner)
+        return self._follow_remote(key, future, *await self._apoll(key))
+
+    def _join(self, key: str) -> Tuple[Optional[Flight], Future]:
+        """Follows the flight of the key in this process, or registers a new one."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return Flight(self, key, future, FOLLOWER), future
+            future = Future()
+            self._flights[key] = future
+            return None, future
+
+    def _follow_remote(self, key: str, future: Future, result: Optional[str], done: bool) -> Flight:
+        # Another process is computing it, unless it already has
+        if done and result is not None:
+            self._finish(key, future, result=result)
+            return Flight(self, key, future, FOLLOWER)
+        return Flight(self, key, future, REMOTE)
+
+    def do(self, key: str, compute: Callable[[], str]) -> str:
+        flight = self.begin(key)
+        if not flight.is_leader:
+            result = flight.wait()
+            if result is not None:
+                return result
+            return compute()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        flight.complete(result)
+        return result
+
+    async def ado(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        flight = await self.abegin(key)
+        if not flight.is_leader:
+            result = await flight.await_result()
+            if result is not None:
+                return result
+            return await compute()
+
+        try:
+            result = await compute()
+        except BaseException as e:
+            await flight.afail(e)
+            raise
+        await flight.acomplete(result)
+        return result
+
+    def _poll(self, key: str):
+        """Returns (result, done), done once a result was published or the lock is gone."""
+        try:
+            values = cache.get_many([_result_key(key), _lock_key(key)])
+        except Exception as e:
+            logger.warning("Could not poll the single-flight result: %s", e)
+            return None, True
+        return values.get(_result_key(key)), _result_key(key) in values or _lock_key(key) not in values
+
+    async def _apoll(self, key: str):
+        try:
+            values = await cache.aget_many([_result_key(key), _lock_key(key)])
+        except Exception as e:
+            logger.warning("Could not poll the single-flight result: %s", e)
+            return None, True
+        return values.get(_result_key(key)), _result_key(key) in values or _lock_key(key) not in values
+
+    def _publish(self, key: str, owner: Optional[str], result: str) -> None:
+        try:
+            cache.set(_result_key(key), result, self.result_ttl)
+        except Exception as e:
+            logger.warning("Could not publish the single-flight result: %s", e)
+        self._release(key, owner)
+
+    async def _apublish(self, key: str, owner: Optional[str], result: str) -> None:
+        try:
+            await cache.aset(_result_key(key), result, self.result_ttl)
+        except Exception as e:
+            logger.warning("Could not publish the single-flight result: %s", e)
+        await self._arelease(key, owner)
+
+    def _release(self, key: str, owner: Optional[str]) -> None:
+        try:
+            # Not atomic, at worst another leader's lock is dropped and one extra computation runs
+            if cache.get(_lock_key(key)) == owner:
+                cache.delete(_lock_key(key))
+        except Exception as e:
+            logger.warning("Could not release the single-flight lock: %s", e)
+
+    async def _arelease(self, key: str, owner: Optional[str]) -> None:
+        try:
+            if await cache.aget(_lock_key(key)) == owner:
+                await cache.adelete(_lock_key(key))
+        except Exception as e:
+            logger.warning("Could not release the single-flight lock: %s", e)
+
+    def _finish(self, key: str, future: Future, result: Optional[str] = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+def _lock_key(key: str) -> str:
+    return f"single_flight:{key}:lock"
+
+
+def _result_key(key: str) -> str:
+    return f"single_flight:{key}:result"
+
+
+def is_single_flight_enabled() -> bool:
+    return os.environ.get('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+
+
+def flight_key(*parts: str) -> str:
+    return hashlib.sha1('\x00'.join(parts).encode('utf-8')).hexdigest()
+
+
+single_flight = SingleFlight(
+    wait_timeout=float(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT', 60)),
+    result_ttl=int(os.environ.get('SINGLE_FLIGHT_RESULT_TTL', 10)),
+    poll_interval=float(os.environ.get('SINGLE_FLIGHT_POLL_INTERVAL', 0.1)),
+)
@@ -0,0 +1,171 @@
+import asyncio
+import contextvars
+import json
+import logging
+import queue
+import threading
+import traceback
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from django.http import StreamingHttpResponse
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.chains.base import Chain
+
+logger = logging.getLogger(__name__)
+
+_STREAM_END = object()
+
+
+class StreamClosed(Exception):
+    """Raised inside a streaming chain once nobody is reading its tokens anymore."""
+
+
+class QueueCallbackHandler(BaseCallbackHandler):
+    """Pushes every token produced by a streaming LLM onto a queue.
+
+    Once `stopped` is set the next token aborts the run with StreamClosed.
+    """
+
+    # Let StreamClosed propagate out of the callback manager instead of being logged
+    raise_error = True
+
+    def __init__(self, token_queue: queue.Queue, stopped: Optional[threading.Event] = None):
+        self.token_queue = token_queue
+        self.stopped = stopped or threading.Event()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.stopped.is_set():
+            raise StreamClosed()
+        self.token_queue.put(token)
+
+
+def stream_chain(chain: Chain, inputs: Dict[str, Any], callbacks: Optional[List[BaseCallbackHandler]] = None) -> Iterator[str]:
+    """Runs the chain in a worker thread and yields the LLM tokens as they arrive.
+
+    Any exception raised by the chain is re-raised in the consuming thread once
+    the tokens produced so far have been yielded. `callbacks` are added to the run.
+    The chain is stopped at its next token if the consumer stops iterating, e.g.
+    when the client disconnects.
+    """
+    token_queue = queue.Queue()
+    stopped = threading.Event()
+    handler = QueueCallbackHandler(token_queue, stopped)
+    errors = []
+
+    def run():
+        try:
+            chain(inputs, callbacks=[handler] + (callbacks or []), return_only_outputs=True)
+        except StreamClosed:
+            pass
+        except Exception as e:
+            if not stopped.is_set():
+                errors.append(e)
+        finally:
+            token_queue.put(_STREAM_END)
+
+    # The worker sees the request's context, e.g. its trace for the stage timings
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            token = token_queue.get()
+            if token is _STREAM_END:
+                break
+            yield token
+    finally:
+        # A no-op when the chain already finished; otherwise it aborts at its next token
+        stopped.set()
+
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+class AsyncQueueCallbackHandler(AsyncCallbackHandler):
+    """Async counterpart of QueueCallbackHandler for chains run with `acall`."""
+
+    def __init__(self, token_queue: asyncio.Queue):
+        self.token_queue = token_queue
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        await self.token_queue.put(token)
+
+
+async def astream_chain(chain: Chain, inputs: Dict[str, Any], callbacks: Optional[List[BaseCallbackHandler]] = None) -> AsyncIterator[str]:
+    """Runs the chain as a task on the current event loop and yields the LLM tokens as they arrive.
+
+    The chain is cancelled if the consumer stops iterating, e.g. when the client disconnects.
+    """
+    token_queue = asyncio.Queue()
+    handler = AsyncQueueCallbackHandler(token_queue)
+
+    async def run():
+        try:
+            await chain.acall(inputs, callbacks=[handler] + (callbacks or []), return_only_outputs=True)
+        finally:
+            await token_queue.put(_STREAM_END)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            token = await token_queue.get()
+            if token is _STREAM_END:
+                break
+            yield token
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Formats a payload as a single Server-Sent Events message."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+def event_stream_response(token_stream: Iterator[str]) -> StreamingHttpResponse:
+    """Relays tokens as Server-Sent Events, ending with a "done" event that carries the full text."""
+    def event_stream():
+        tokens = []
+        try:
+            for token in token_stream:
+                tokens.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            logger.error(str(e))
+            logger.error(traceback.format_exc())
+            yield sse_event({'error': 'An error occurred'}, event='error')
+            return
+
+        yield sse_event({'text': ''.join(tokens)}, event='done')
+
+    return _event_stream_response(event_stream())
+
+
+def async_event_stream_response(token_stream: AsyncIterator[str]) -> StreamingHttpResponse:
+    """Async counterpart of event_stream_response."""
+    async def event_stream():
+        tokens = []
+        try:
+            async for token in token_stream:
+                tokens.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            logger.error(str(e))
+            logger.error(traceback.format_exc())
+            yield sse_event({'error': 'An error occurred'}, event='error')
+            return
+
+        yield sse_event({'text': ''.join(tokens)}, event='done')
+
+    return _event_stream_response(event_stream())
+
+
+def _event_stream_response(events) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Ask nginx and friends not to buffer the event stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
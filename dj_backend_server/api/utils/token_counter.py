@@ -0,0 +1,32 @@
+import logging
+from functools import lru_cache
+from typing import Callable
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+TokenCounter = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+@lru_cache(maxsize=None)
+def get_model_token_counter(model_name: str, cache_size: int = 0) -> TokenCounter:
+    """Returns a token counter for the model, `cache_size` keeps the counts of recently seen texts."""
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, estimate when that is not possible
+        logger.warning("Could not load the tiktoken encoding, estimating token counts: %s", e)
+        return estimate_tokens
+
+    def count_tokens(text: str) -> int:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    return lru_cache(maxsize=cache_size)(count_tokens) if cache_size else count_tokens
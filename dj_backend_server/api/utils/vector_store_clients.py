@@ -0,0 +1,42 @@
+import os
+import threading
+
+import pinecone
+import qdrant_client
+from dotenv import load_dotenv
+
+from api.configs import VECTOR_STORE_INDEX_NAME
+from api.utils.client_registry import client_registry
+
+load_dotenv()
+
+init_lock = threading.Lock()
+initialized = False
+
+
+def initialize_pinecone():
+    global initialized
+    # Only initialize Pinecone if the store type is Pinecone and the initialization lock is not acquired
+    with init_lock:
+        if not initialized:
+            # Initialize Pinecone
+            pinecone.init(
+                api_key=os.getenv("PINECONE_API_KEY"),  # find at app.pinecone.io
+                environment=os.getenv("PINECONE_ENV"),  # next to api key in console
+            )
+            initialized = True
+
+
+def get_qdrant_client() -> qdrant_client.QdrantClient:
+    """Returns the shared Qdrant client, its gRPC channel is reused across requests."""
+    url = os.environ['QDRANT_URL']
+    return client_registry.get_or_create(
+        ('qdrant_client', url),
+        lambda: qdrant_client.QdrantClient(url=url, prefer_grpc=True)
+    )
+
+
+def get_pinecone_index(index_name: str = VECTOR_STORE_INDEX_NAME) -> pinecone.Index:
+    """Returns the shared Pinecone index handle and its HTTP connection pool."""
+    initialize_pinecone()
+    return client_registry.get_or_create(('pinecone_index', index_name), lambda: pinecone.Index(index_name))
@@ -1,6 +1,9 @@
 from django.http import JsonResponse
-from django.views.decorators.http import require_POST
-from api.tasks import codebase_handler_task, pdf_handler_task, website_handler_task
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET, require_POST
+from web.models.jobs import Job
+from web.services.bot_profile_cache import get_bot_profile_or_404
+from web.services.ingestion_jobs import dispatch_ingestion
 import json
 from django.views.decorators.csrf import csrf_exempt
 
@@ -19,16 +22,35 @@ def ingest(request):
         if type_ not in ('pdf', 'website', 'codebase'):
             return JsonResponse({'error': 'Type not supported, use one of pdf, website or codebase'})
 
-        if type_ == 'pdf':
-            pdf_handler_task.delay(shared_folder, namespace)
-        elif type_ == 'website':
-            print("Calling website handler task")
-            website_handler_task.delay(shared_folder, namespace)
-        
-        elif type_ == 'codebase':
-            codebase_handler_task.delay(repo_path, namespace)
+        if type_ == 'codebase':
+            job = dispatch_ingestion(type_, namespace=namespace, repo=repo_path)
+        else:
+            job = dispatch_ingestion(type_, namespace=namespace, shared_folder=shared_folder)
 
-        return JsonResponse({'message': 'Task dispatched successfully'}, status=200)
+        return JsonResponse({'message': 'Task dispatched successfully', 'job_id': job.id}, status=200)
     
     except Exception as e:
         print(e)
+        return JsonResponse({'error': 'Could not dispatch the ingestion'}, status=500)
+
+
+@require_GET
+def ingest_status(request, job_id):
+    """Where an ingestion job is: status, stage reached, attempts made and the last error.
+
+    Only for the bot the job ingests into, authenticated by its X-Bot-Token header.
+    """
+    bot = get_bot_profile_or_404(request.headers.get('X-Bot-Token'))
+    job = get_object_or_404(Job, id=job_id, chatbot_id=bot.id)
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'stage': job.stage,
+        'attempts': job.attempts,
+        'shards_done': job.shards_done,
+        'shards_total': job.shards_total,
+        # The exception, the traceback stays in the jobs table
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    })
@@ -1,4 +1,6 @@
-from django.http import JsonResponse
+import logging
+
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseNotAllowed
 from django.shortcuts import get_object_or_404
 from django.views.decorators.http import require_POST, require_GET
 from web.models.chatbot import Chatbot
@@ -6,8 +8,16 @@ import requests
 from django.views.decorators.csrf import csrf_exempt
 import json
 from web.utils.common import get_session_id
+from api.utils.http_client import get_async_http_client
+from api.utils.streaming import event_stream_response, async_event_stream_response
+from api.services import chat_service
+from api.utils.admission import AdmissionRejected, BUSY_RETRY_AFTER, aadmit, admit, rejected_response, release_when_done
+from api.utils.metrics import timed_stage
+from web.services.bot_profile_cache import bot_profile_cache, get_bot_profile_or_404
+from api.configs import CHAT_SERVICE_MODE, CHAT_SERVICE_URL
+
+logger = logging.getLogger(__name__)
 
-from web.models.chat_histories import ChatHistory
 class ChatbotResponse:
     def __init__(self, response):
         self.response = response
@@ -18,6 +28,38 @@ class ChatbotResponse:
     def get_source_documents(self):
         return self.response.get('sourceDocuments', [])
 
+def relay_event_stream(upstream):
+    """Forwards an upstream Server-Sent Events response chunk by chunk, without buffering."""
+    def event_stream():
+        try:
+            for chunk in upstream.iter_content(chunk_size=None):
+                yield chunk
+        finally:
+            upstream.close()
+
+    response = StreamingHttpResponse(event_stream(), status=upstream.status_code, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    if 'Retry-After' in upstream.headers:
+        response['Retry-After'] = upstream.headers['Retry-After']
+    return response
+
+def arelay_event_stream(upstream):
+    """Async counterpart of relay_event_stream for an httpx streaming response."""
+    async def event_stream():
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    response = StreamingHttpResponse(event_stream(), status=upstream.status_code, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    if 'Retry-After' in upstream.headers:
+        response['Retry-After'] = upstream.headers['Retry-After']
+    return response
+
 @csrf_exempt
 @require_POST
 def send_search_request(request):
@@ -34,7 +76,7 @@ def send_search_request(request):
         # You can add additional validation for 'history' if needed.
 
         bot_token = request.headers.get('X-Bot-Token')
-        bot = get_object_or_404(Chatbot, token=bot_token)
+        bot = get_bot_profile_or_404(bot_token)
 
         # Implement the equivalent logic to send the HTTP request to the external API
         response = requests.post(
@@ -63,7 +105,7 @@ def send_search_request(request):
 @require_GET
 def init_chat(request):
     bot_token = request.headers.get('X-Bot-Token')
-    bot = get_object_or_404(Chatbot, token=bot_token)
+    bot = get_bot_profile_or_404(bot_token)
 
     return JsonResponse({
         "bot_name": bot.name,
@@ -79,18 +121,16 @@ def send_chat(request):
         # You can add additional validation for 'history' and 'content_type' if needed.
 
         bot_token = request.headers.get('X-Bot-Token')
-        bot = get_object_or_404(Chatbot, token=bot_token)
+        with timed_stage('bot_lookup'):
+            bot = get_bot_profile_or_404(bot_token)
 
         data = json.loads(request.body)
         # Validate the request data
         content = data.get('content')
-        history = data.get('history')
         content_type = data.get('type')
+        stream = data.get('stream', False)
 
         session_id = get_session_id(request=request, bot_id=bot.id)
-        history = ChatHistory.objects.filter(session_id=session_id)
-        history_entries = [{"message": entry.message, "from_user": entry.from_user} for entry in history]
-
 
         # Implement the equivalent logic for validation
         if not content:
@@ -101,45 +141,183 @@ def send_chat(request):
                 }
             }, status=400)
 
-        # Implement the equivalent logic to send the HTTP request to the external API
-        response = requests.post(
-            'http://localhost:8000/api/chat/',
-            json={
-                'question': content,
-                'namespace': str(bot.id),  # Assuming getId returns a UUID object
-                'mode': "assistant",
-                'initial_prompt': bot.prompt_message,
-                'history': history_entries,
-                'token': bot_token,
-                "session_id": session_id
-            },
-            timeout=200
-        )
+        if CHAT_SERVICE_MODE == 'remote':
+            return send_chat_to_remote_service(bot=bot, bot_token=bot_token, content=content, session_id=session_id, stream=stream)
 
-        if response.json() is None:
-            return JsonResponse({
-                "type": "text",
-                "response": {
-                    "text": "The request was received successfully, but the LLM server was unable to handle it, please make sure your env keys are set correctly. **code: llm5XX**"
-                }
-            })
+        # Answer in-process, the bot is already resolved so the chat service does not look it up again
+        slot = admit(str(bot.id), session_id)
+        try:
+            if stream:
+                response = event_stream_response(chat_service.stream_answer(bot=bot, question=content, session_id=session_id, namespace=str(bot.id), mode="assistant", initial_prompt=bot.prompt_message))
+            else:
+                response_text = chat_service.answer_question(bot=bot, question=content, session_id=session_id, namespace=str(bot.id), mode="assistant", initial_prompt=bot.prompt_message)
+                response = JsonResponse({
+                    "type": "text",
+                    "response": {
+                        "text": response_text
+                    }
+                })
+        except Exception:
+            slot.release()
+            raise
+        return release_when_done(response, slot)
 
-        bot_response = ChatbotResponse(response.json())
+    except AdmissionRejected as e:
+        return get_rejected_chat_response(e)
+    except Exception as e:
+        import traceback
+        print(e)
+        traceback.print_exc()
+        return JsonResponse({
+            "type": "text",
+            "response": {
+                "text": "I'm unable to help you at the moment, please try again later.  **code: b404**"
+            }
+        }, status=500)
 
+
+def get_remote_chat_payload(bot, bot_token, content, session_id, stream):
+    return {
+        'question': content,
+        'namespace': str(bot.id),  # Assuming getId returns a UUID object
+        'mode': "assistant",
+        'initial_prompt': bot.prompt_message,
+        'token': bot_token,
+        "session_id": session_id,
+        "stream": stream
+    }
+
+
+def get_rejected_chat_response(rejection):
+    if rejection.status == 429:
+        text = "You are sending messages too quickly, please wait a moment and try again."
+    else:
+        text = "The assistant is busy right now, please try again in a moment."
+    return rejected_response(rejection, {
+        "type": "text",
+        "response": {
+            "text": text
+        }
+    })
+
+
+def get_remote_rejection(response):
+    """The chat service turned the message away (429/503), passed on with its Retry-After."""
+    if response.status_code not in (429, 503):
+        return None
+    retry_after = response.headers.get('Retry-After', BUSY_RETRY_AFTER)
+    return get_rejected_chat_response(AdmissionRejected(response.status_code, retry_after, 'upstream'))
+
+
+def get_remote_chat_response(response_json):
+    if response_json is None:
         return JsonResponse({
             "type": "text",
             "response": {
-                "text": bot_response.get_bot_reply()
+                "text": "The request was received successfully, but the LLM server was unable to handle it, please make sure your env keys are set correctly. **code: llm5XX**"
             }
         })
 
-    except Exception as e:
-        import traceback
-        print(e)
-        traceback.print_exc()
+    bot_response = ChatbotResponse(response_json)
+
+    return JsonResponse({
+        "type": "text",
+        "response": {
+            "text": bot_response.get_bot_reply()
+        }
+    })
+
+
+def send_chat_to_remote_service(bot, bot_token, content, session_id, stream):
+    """Forwards the message to a chat service running in another deployment (CHAT_SERVICE_MODE=remote)."""
+    response = requests.post(
+        CHAT_SERVICE_URL,
+        json=get_remote_chat_payload(bot, bot_token, content, session_id, stream),
+        timeout=200,
+        stream=stream
+    )
+
+    if stream:
+        return relay_event_stream(response)
+
+    return get_remote_rejection(response) or get_remote_chat_response(response.json())
+
+
+async def asend_chat_to_remote_service(bot, bot_token, content, session_id, stream):
+    """Async variant of send_chat_to_remote_service using the pooled async HTTP client."""
+    client = get_async_http_client()
+    payload = get_remote_chat_payload(bot, bot_token, content, session_id, stream)
+
+    if stream:
+        upstream = await client.send(client.build_request('POST', CHAT_SERVICE_URL, json=payload), stream=True)
+        return arelay_event_stream(upstream)
+
+    response = await client.post(CHAT_SERVICE_URL, json=payload)
+    return get_remote_rejection(response) or get_remote_chat_response(response.json())
+
+
+# See views_chat.chat_async, the Django 4.2 view decorators are not async aware.
+async def send_chat_async(request):
+    """ASGI-native variant of `send_chat`."""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        bot_token = request.headers.get('X-Bot-Token')
+        with timed_stage('bot_lookup'):
+            bot = await bot_profile_cache.aget(bot_token)
+        if bot is None:
+            return JsonResponse({
+                "type": "text",
+                "response": {
+                    "text": "Chatbot not found."
+                }
+            }, status=404)
+
+        data = json.loads(request.body)
+        # Validate the request data
+        content = data.get('content')
+        stream = data.get('stream', False)
+
+        session_id = get_session_id(request=request, bot_id=bot.id)
+
+        if not content:
+            return JsonResponse({
+                "type": "text",
+                "response": {
+                    "text": "Content is required."
+                }
+            }, status=400)
+
+        if CHAT_SERVICE_MODE == 'remote':
+            return await asend_chat_to_remote_service(bot=bot, bot_token=bot_token, content=content, session_id=session_id, stream=stream)
+
+        slot = await aadmit(str(bot.id), session_id)
+        try:
+            if stream:
+                response = async_event_stream_response(chat_service.astream_answer(bot=bot, question=content, session_id=session_id, namespace=str(bot.id), mode="assistant", initial_prompt=bot.prompt_message))
+            else:
+                response_text = await chat_service.aanswer_question(bot=bot, question=content, session_id=session_id, namespace=str(bot.id), mode="assistant", initial_prompt=bot.prompt_message)
+                response = JsonResponse({
+                    "type": "text",
+                    "response": {
+                        "text": response_text
+                    }
+                })
+        except BaseException:
+            slot.release()
+            raise
+        return release_when_done(response, slot)
+
+    except AdmissionRejected as e:
+        return get_rejected_chat_response(e)
+    except Exception:
+        logger.exception("Could not answer the chat message")
         return JsonResponse({
             "type": "text",
             "response": {
                 "text": "I'm unable to help you at the moment, please try again later.  **code: b404**"
             }
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+send_chat_async.csrf_exempt = True
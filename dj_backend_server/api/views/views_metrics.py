@@ -0,0 +1,22 @@
+import hmac
+import os
+
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from api.utils.metrics import render_metrics
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+@require_GET
+def metrics(request):
+    """Prometheus scrape endpoint, protected by the METRICS_TOKEN bearer token and closed without one."""
+    token = os.environ.get('METRICS_TOKEN')
+    # The metrics include per-bot token counts and cost, they are never served unauthenticated
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return HttpResponseForbidden()
+
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
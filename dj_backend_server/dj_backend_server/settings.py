@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestTimingMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -158,6 +159,22 @@ LOCALE_PATHS = [
 
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+# With `celery beat` running, ingestion jobs lost by the broker or a dead worker are picked up again
+CELERY_BEAT_SCHEDULE = {
+    'requeue-stale-ingestion-jobs': {
+        'task': 'api.tasks.requeue_stale_ingestion_jobs_task',
+        'schedule': int(os.environ.get('INGESTION_REQUEUE_INTERVAL', 300)),
+    },
+}
+
+# Shared between the web and celery processes, e.g. to invalidate caches after an ingestion
+REDIS_URL = os.environ.get('REDIS_URL', CELERY_BROKER_URL)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+}
 
 DATABASES = {
     'default': {
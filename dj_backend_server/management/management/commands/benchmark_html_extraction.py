@@ -0,0 +1,65 @@
+import glob
+import os
+import re
+import statistics
+import time
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from web.workers.html_extractor import extract_page
+
+DEFAULT_CORPUS = os.path.join(settings.BASE_DIR, 'web', 'workers', 'fixtures', 'html')
+
+
+def legacy_extract(html, url):
+    """The previous crawler pipeline: three separate parses per page."""
+    soup = BeautifulSoup(html, features="lxml")
+    for element in soup.find_all(['script', 'style']):
+        element.replace_with(" ")
+    text = re.sub(r'\s+', ' ', soup.get_text()).strip()
+    title = BeautifulSoup(html, 'html.parser').find('title')
+    links = [tag.get('href') for tag in BeautifulSoup(html, 'html.parser').find_all('a')]
+    return text, title, links
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the crawler HTML extraction over a corpus of HTML files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='Directory of .html files')
+        parser.add_argument('--iterations', type=int, default=50, help='Passes over the corpus')
+        parser.add_argument('--compare', action='store_true', help='Also time the previous BeautifulSoup pipeline')
+
+    def handle(self, *args, **options):
+        documents = []
+        for path in sorted(glob.glob(os.path.join(options['corpus'], '*.html'))):
+            with open(path, encoding='utf-8') as f:
+                documents.append(f.read())
+
+        if not documents:
+            self.stdout.write(self.style.ERROR(f"No .html files found in {options['corpus']}"))
+            return
+
+        corpus_bytes = sum(len(document.encode('utf-8')) for document in documents)
+        self.stdout.write(f"{len(documents)} documents, {corpus_bytes / 1024:.1f} KiB, {options['iterations']} iterations")
+
+        runs = [('extract_page', lambda html: extract_page(html, 'https://example.com/'))]
+        if options['compare']:
+            runs.append(('legacy', lambda html: legacy_extract(html, 'https://example.com/')))
+
+        for name, extract in runs:
+            timings = []
+            for _ in range(options['iterations']):
+                for document in documents:
+                    started_at = time.perf_counter()
+                    extract(document)
+                    timings.append(time.perf_counter() - started_at)
+
+            total = sum(timings)
+            p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: {len(timings) / total:.0f} pages/s, mean {statistics.mean(timings) * 1000:.2f} ms, "
+                f"p95 {p95 * 1000:.2f} ms, {corpus_bytes * options['iterations'] / total / 1024 / 1024:.1f} MiB/s"
+            ))
@@ -0,0 +1,56 @@
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api.utils.embedding_pipeline import EmbeddingBatch
+from api.utils.local_vector_store import LocalVectorStore, LocalVectorStoreWriter
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the local vector store, brute-force against the IVF index, on synthetic vectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help='Number of stored vectors')
+        parser.add_argument('--dim', type=int, default=1536, help='Vector dimension')
+        parser.add_argument('--queries', type=int, default=200, help='Number of timed queries')
+        parser.add_argument('--k', type=int, default=4, help='Results per query')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        # Clustered vectors, embeddings of real chunks are far from uniformly spread
+        centers = rng.normal(size=(max(1, options['rows'] // 500), options['dim'])).astype(np.float32)
+        vectors = centers[rng.integers(len(centers), size=options['rows'])] + 0.5 * rng.normal(size=(options['rows'], options['dim'])).astype(np.float32)
+        queries = vectors[rng.integers(options['rows'], size=options['queries'])] + 0.1 * rng.normal(size=(options['queries'], options['dim'])).astype(np.float32)
+
+        root = tempfile.mkdtemp(prefix='local_vector_store_')
+        try:
+            results = {}
+            for index_type in ('flat', 'ivf'):
+                started_at = time.perf_counter()
+                writer = LocalVectorStoreWriter(index_type, root=root, index_type=index_type)
+                for start in range(0, options['rows'], 1000):
+                    ids = [str(row) for row in range(start, min(start + 1000, options['rows']))]
+                    writer.upsert(EmbeddingBatch(texts=ids, metadatas=[{} for _ in ids], ids=ids), vectors[start:start + 1000])
+                writer.commit()
+                self.stdout.write(f"{index_type}: wrote {options['rows']} x {options['dim']} vectors in {time.perf_counter() - started_at:.2f}s")
+
+                store = LocalVectorStore(index_type, embedding=None, root=root)
+                store.similarity_search_by_vector(queries[0], k=options['k'])
+                timings, results[index_type] = [], []
+                for query in queries:
+                    started_at = time.perf_counter()
+                    docs = store.similarity_search_by_vector(query, k=options['k'])
+                    timings.append(time.perf_counter() - started_at)
+                    results[index_type].append({doc.page_content for doc in docs})
+
+                p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+                self.stdout.write(self.style.SUCCESS(f"{index_type}: mean {statistics.mean(timings) * 1000:.3f} ms, p95 {p95 * 1000:.3f} ms per query"))
+
+            recall = statistics.mean(len(ivf & flat) / len(flat) for ivf, flat in zip(results['ivf'], results['flat']))
+            self.stdout.write(self.style.SUCCESS(f"ivf recall@{options['k']} against flat: {recall:.3f}"))
+        finally:
+            shutil.rmtree(root)
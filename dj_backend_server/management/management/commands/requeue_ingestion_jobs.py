@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from web.services.ingestion_jobs import requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Dispatches ingestion jobs whose message or worker was lost again, fails those out of attempts'
+
+    def handle(self, *args, **options):
+        counts = requeue_stale_jobs()
+        self.stdout.write(self.style.SUCCESS(f"{counts['requeued']} jobs requeued, {counts['failed']} failed"))
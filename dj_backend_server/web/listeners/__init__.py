@@ -1 +1 @@
-from . import create_website_data_source_if_needed, ingest_codebase_data_source,ingest_pdf_data_source, ingest_website_data_source, website_data_source_added
\ No newline at end of file
+from . import create_website_data_source_if_needed, ingest_codebase_data_source,ingest_pdf_data_source, ingest_website_data_source, website_data_source_added, invalidate_chatbot_clients, invalidate_bot_profile
\ No newline at end of file
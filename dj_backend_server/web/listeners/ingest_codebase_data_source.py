@@ -1,13 +1,9 @@
 # listeners.py
 
-import requests
-from requests.exceptions import RequestException
 from web.models.codebase_data_sources import CodebaseDataSource
-from web.enums.ingest_status_enum import IngestStatusType
 from web.signals.codebase_datasource_was_created import codebase_data_source_added
+from web.services.ingestion_jobs import dispatch_ingestion
 from django.core.exceptions import ObjectDoesNotExist
-from django.utils.timezone import now
-from web.signals.codebase_datasource_was_created import codebase_data_source_added
 
 @codebase_data_source_added.connect
 def ingest_codebase_data_source(sender, chatbot_id, data_source_id, **kwargs):
@@ -16,30 +12,5 @@ def ingest_codebase_data_source(sender, chatbot_id, data_source_id, **kwargs):
     except ObjectDoesNotExist:
         return
 
-    repo = datasource.repository
-
-    request_body = {
-        'type': 'codebase',
-        'repo': repo,
-        'namespace': str(chatbot_id),
-    }
-
-    try:
-        # Call to ingest service endpoint
-        url = "http://localhost:8000/api/ingest/"  # Replace with the actual URL
-        response = requests.post(url, json=request_body)
-
-        datasource.ingested_at = now()
-
-        if response.status_code != 200:
-            datasource.ingestion_status = IngestStatusType.FAILED
-        else:
-            datasource.ingestion_status = IngestStatusType.SUCCESS
-
-        datasource.save()
-
-    except RequestException as e:
-        datasource.ingested_at = now()
-        datasource.ingestion_status = IngestStatusType.FAILED
-        datasource.save()
-        return
\ No newline at end of file
+    # Enqueued once the data source is committed, the job sets the ingestion status when it is done
+    dispatch_ingestion('codebase', namespace=str(chatbot_id), data_source_id=str(datasource.id), repo=datasource.repository)
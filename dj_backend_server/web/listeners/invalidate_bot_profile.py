@@ -0,0 +1,25 @@
+# listeners.py
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from web.models.chatbot import Chatbot
+from web.models.chatbot_settings import ChatbotSetting
+from web.services.bot_profile_cache import bot_profile_cache
+
+# The settings views also send chatbot_was_updated, these cover writes from anywhere else (admin, shell, tasks).
+# They fire inside the transaction, the profile is dropped once it commits so readers can't cache the old row.
+
+
+@receiver([post_save, post_delete], sender=Chatbot)
+def invalidate_bot_profile(sender, instance, **kwargs):
+    chatbot_id, token = str(instance.id), instance.token
+    transaction.on_commit(lambda: bot_profile_cache.invalidate(chatbot_id, token))
+
+
+@receiver([post_save, post_delete], sender=ChatbotSetting)
+def invalidate_bot_profile_settings(sender, instance, **kwargs):
+    if instance.chatbot_id:
+        chatbot_id = str(instance.chatbot_id)
+        transaction.on_commit(lambda: bot_profile_cache.invalidate(chatbot_id))
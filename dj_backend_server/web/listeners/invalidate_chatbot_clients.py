@@ -0,0 +1,27 @@
+# listeners.py
+
+from web.signals.chatbot_was_updated import chatbot_was_updated
+from api.utils.client_registry import client_registry
+from api.utils.lexical_index import lexical_index_registry
+from api.utils.semantic_cache import semantic_answer_cache
+from web.models.ingested_chunks import IngestedChunk
+from web.models.lexical_chunks import LexicalChunk
+from web.services.bot_profile_cache import bot_profile_cache
+
+@chatbot_was_updated.connect
+def invalidate_chatbot_clients(sender, chatbot_id, **kwargs):
+    # Drop the cached vector store and chains built for this bot, they are rebuilt on the next message
+    client_registry.invalidate_namespace(str(chatbot_id))
+    semantic_answer_cache.invalidate(str(chatbot_id))
+    bot_profile_cache.invalidate(str(chatbot_id))
+
+
+@chatbot_was_updated.connect
+def delete_chatbot_chunks(sender, chatbot_id, **kwargs):
+    # The chunk ledger and lexical rows of a bot outlive its Chatbot row, nothing else reads them once it is gone
+    if sender != 'delete_bot':
+        return
+    namespace = str(chatbot_id)
+    IngestedChunk.objects.filter(namespace=namespace).delete()
+    LexicalChunk.objects.filter(namespace=namespace).delete()
+    lexical_index_registry.invalidate(namespace)
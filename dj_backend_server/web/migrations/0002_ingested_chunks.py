@@ -0,0 +1,36 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedChunk',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('namespace', models.CharField(max_length=36)),
+                ('data_source_id', models.CharField(max_length=64)),
+                ('source', models.TextField()),
+                ('source_hash', models.CharField(max_length=40)),
+                ('chunk_hash', models.CharField(max_length=64)),
+                ('vector_id', models.CharField(max_length=36)),
+                ('ingest_run', models.CharField(max_length=36)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'ingested_chunks',
+                'indexes': [models.Index(fields=['namespace', 'data_source_id', 'ingest_run'], name='ingested_chunks_run_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ingestedchunk',
+            constraint=models.UniqueConstraint(fields=('namespace', 'data_source_id', 'source_hash', 'chunk_hash'), name='ingested_chunks_unique_chunk'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0002_ingested_chunks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['session_id', 'created_at'], name='chat_histories_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['chatbot_id', 'created_at'], name='chat_histories_chatbot_idx'),
+        ),
+    ]
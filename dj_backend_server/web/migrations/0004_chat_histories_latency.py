@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0003_chat_histories_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chathistory',
+            name='latency_ms',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='chathistory',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
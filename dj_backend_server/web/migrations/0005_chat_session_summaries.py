@@ -0,0 +1,28 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0004_chat_histories_latency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSessionSummary',
+            fields=[
+                ('session_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('chatbot_id', models.CharField(max_length=36, null=True)),
+                ('summary', models.TextField()),
+                ('last_turn_hash', models.CharField(max_length=40)),
+                ('summarized_until', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'chat_session_summaries',
+            },
+        ),
+    ]
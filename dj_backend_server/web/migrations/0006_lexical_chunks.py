@@ -0,0 +1,33 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0005_chat_session_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LexicalChunk',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('namespace', models.CharField(max_length=36)),
+                ('vector_id', models.CharField(max_length=36)),
+                ('content', models.TextField()),
+                ('metadata', models.JSONField(default=dict)),
+                ('terms', models.JSONField(default=dict)),
+                ('length', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'lexical_chunks',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='lexicalchunk',
+            constraint=models.UniqueConstraint(fields=('namespace', 'vector_id'), name='lexical_chunks_unique_vector'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0006_lexical_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfdatasource',
+            name='ingest_progress',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0007_pdf_data_sources_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestedchunk',
+            name='file_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0008_ingested_chunks_file_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatbot',
+            name='token',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0009_chatbots_token_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='chatbot_id',
+            field=models.CharField(max_length=36, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='data_source_id',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='error',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='finished_at',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='stage',
+            field=models.CharField(max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='status',
+            field=models.CharField(db_index=True, default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='task_id',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='updated_at',
+            field=models.PositiveIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0010_jobs_ingestion_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codebasedatasource',
+            name='chunks_added',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='codebasedatasource',
+            name='chunks_deleted',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='codebasedatasource',
+            name='chunks_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='run_id',
+            field=models.CharField(max_length=36, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='shards_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='shards_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pdfdatasource',
+            name='chunks_added',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pdfdatasource',
+            name='chunks_deleted',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pdfdatasource',
+            name='chunks_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='websitedatasource',
+            name='chunks_added',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='websitedatasource',
+            name='chunks_deleted',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='websitedatasource',
+            name='chunks_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
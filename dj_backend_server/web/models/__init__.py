@@ -1 +1 @@
-from . import failed_jobs, password_reset_token, chatbot, personal_access_tokens, chat_histories, chatbot_settings, onboarding_steps, website_data_sources, jobs, crawled_pages,text_data_sources, pdf_data_sources, notion_data_sources, codebase_data_sources
+from . import failed_jobs, password_reset_token, chatbot, personal_access_tokens, chat_histories, chatbot_settings, onboarding_steps, website_data_sources, jobs, crawled_pages,text_data_sources, pdf_data_sources, notion_data_sources, codebase_data_sources, ingested_chunks, chat_session_summaries, lexical_chunks
\ No newline at end of file
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from web.models.chatbot import Chatbot
 
 class ChatHistory(models.Model):
@@ -7,7 +8,10 @@ class ChatHistory(models.Model):
     session_id = models.CharField(max_length=255, null=True)
     from_user = models.CharField(max_length=255, db_column="from")
     message = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Time to answer, set on bot messages
+    latency_ms = models.PositiveIntegerField(null=True)
+    # Set by the writer, messages can be inserted a moment after they were exchanged
+    created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
 
@@ -16,10 +20,10 @@ class ChatHistory(models.Model):
         self.id = _id
 
     def is_from_user(self):
-        return self.from_user
+        return is_user_message(self.from_user)
 
     def is_from_bot(self):
-        return not self.from_user
+        return not self.is_from_user()
 
     def set_from_user(self):
         self.from_user = True
@@ -43,4 +47,13 @@ class ChatHistory(models.Model):
         self.session_id = session_id
 
     class Meta:
-        db_table = 'chat_histories'  # Replace 'chat_history' with the actual table name in the database
\ No newline at end of file
+        db_table = 'chat_histories'  # Replace 'chat_history' with the actual table name in the database
+        indexes = [
+            models.Index(fields=['session_id', 'created_at'], name='chat_histories_session_idx'),
+            models.Index(fields=['chatbot_id', 'created_at'], name='chat_histories_chatbot_idx'),
+        ]
+
+
+def is_user_message(from_user) -> bool:
+    # The `from` column is a varchar, booleans come back as 'True'/'False' (or '1'/'0' from older rows)
+    return str(from_user).lower() in ('true', '1', 'user')
\ No newline at end of file
@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class ChatSessionSummary(models.Model):
+    """Rolling summary of the turns of a chat session that no longer fit in the prompt."""
+    session_id = models.CharField(max_length=255, primary_key=True)
+    chatbot_id = models.CharField(max_length=36, null=True)
+    summary = models.TextField()
+    # Fingerprint and time of the newest turn folded into the summary
+    last_turn_hash = models.CharField(max_length=40)
+    summarized_until = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def get_summary(self):
+        return self.summary
+
+    class Meta:
+        db_table = 'chat_session_summaries'
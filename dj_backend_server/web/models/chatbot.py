@@ -9,7 +9,7 @@ class Chatbot(models.Model):
     website = models.CharField(max_length=255, default="https://openchat.so")
     status = models.CharField(max_length=255)  # Assuming ChatbotStatusType is a string-based enum in Laravel
     prompt_message = models.TextField(blank=True, default=ChatBotInitialPromptEnum.AI_ASSISTANT_INITIAL_PROMPT.value)
-    token = models.CharField(max_length=255)  # Assuming token is a CharField
+    token = models.CharField(max_length=255, db_index=True)  # Assuming token is a CharField
     
     enhanced_privacy = models.BooleanField(default=False)
     smart_sync = models.BooleanField(default=False)
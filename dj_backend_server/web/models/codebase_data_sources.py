@@ -9,6 +9,10 @@ class CodebaseDataSource(models.Model):
     chatbot_id = models.CharField(max_length=36, null=True)
     ingested_at = models.DateTimeField()
     ingestion_status = models.CharField(max_length=50)
+    # Chunks stored for the data source after its last ingestion, and what that ingestion changed
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_added = models.PositiveIntegerField(default=0)
+    chunks_deleted = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'codebase_data_sources'  # Replace 'codebase_data_source' with the actual table name in the database
\ No newline at end of file
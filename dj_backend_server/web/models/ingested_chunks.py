@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class IngestedChunk(models.Model):
+    """Ledger of the chunks stored in a namespace, used to re-ingest a data source incrementally."""
+    id = models.BigAutoField(primary_key=True)
+    namespace = models.CharField(max_length=36)
+    data_source_id = models.CharField(max_length=64)
+    source = models.TextField()
+    source_hash = models.CharField(max_length=40)
+    # Hash of the whole source file when the loader knows it (git blob id), lets unchanged files skip loading
+    file_hash = models.CharField(max_length=64, blank=True, default='')
+    chunk_hash = models.CharField(max_length=64)
+    vector_id = models.CharField(max_length=36)
+    ingest_run = models.CharField(max_length=36)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def get_vector_id(self):
+        return self.vector_id
+
+    def get_source(self):
+        return self.source
+
+    class Meta:
+        db_table = 'ingested_chunks'
+        constraints = [
+            models.UniqueConstraint(fields=['namespace', 'data_source_id', 'source_hash', 'chunk_hash'], name='ingested_chunks_unique_chunk'),
+        ]
+        indexes = [
+            models.Index(fields=['namespace', 'data_source_id', 'ingest_run'], name='ingested_chunks_run_idx'),
+        ]
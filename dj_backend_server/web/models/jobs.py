@@ -1,5 +1,21 @@
 from django.db import models
 
+
+class JobStatus:
+    PENDING = 'pending'  # waiting for a worker
+    RUNNING = 'running'
+    RETRYING = 'retrying'  # failed, runs again at available_at
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'  # out of attempts, see failed_jobs
+
+
+class JobStage:
+    FETCH = 'fetch'
+    PARSE = 'parse'
+    EMBED = 'embed'
+    UPSERT = 'upsert'
+
+
 class Job(models.Model):
     id = models.BigAutoField(primary_key=True)
     queue = models.CharField(max_length=255)
@@ -8,6 +24,19 @@ class Job(models.Model):
     reserved_at = models.PositiveIntegerField(null=True)
     available_at = models.PositiveIntegerField()
     created_at = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, default=JobStatus.PENDING, db_index=True)
+    stage = models.CharField(max_length=20, null=True)
+    chatbot_id = models.CharField(max_length=36, null=True)
+    data_source_id = models.CharField(max_length=255, null=True, db_index=True)
+    task_id = models.CharField(max_length=255, null=True)
+    error = models.TextField(null=True)
+    # Heartbeat of the worker running the job, a running job that stops beating was lost
+    updated_at = models.PositiveIntegerField(null=True)
+    finished_at = models.PositiveIntegerField(null=True)
+    # A large data source is ingested as shards in parallel, all of them share the run_id
+    run_id = models.CharField(max_length=36, null=True)
+    shards_total = models.PositiveIntegerField(default=0)
+    shards_done = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'jobs'
@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class LexicalChunk(models.Model):
+    """Chunk text and term frequencies of a namespace, the source of its BM25 index."""
+    id = models.BigAutoField(primary_key=True)
+    namespace = models.CharField(max_length=36)
+    vector_id = models.CharField(max_length=36)
+    content = models.TextField()
+    metadata = models.JSONField(default=dict)
+    # Term frequencies and number of terms, computed once at ingestion
+    terms = models.JSONField(default=dict)
+    length = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def get_content(self):
+        return self.content
+
+    def get_metadata(self):
+        return self.metadata
+
+    class Meta:
+        db_table = 'lexical_chunks'
+        constraints = [
+            models.UniqueConstraint(fields=['namespace', 'vector_id'], name='lexical_chunks_unique_vector'),
+        ]
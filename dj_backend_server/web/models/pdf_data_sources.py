@@ -10,6 +10,12 @@ class PdfDataSource(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
     ingest_status = models.CharField(max_length=255, default='success')
+    # Share of the pages extracted so far, in percent
+    ingest_progress = models.FloatField(default=0.00)
+    # Chunks stored for the data source after its last ingestion, and what that ingestion changed
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_added = models.PositiveIntegerField(default=0)
+    chunks_deleted = models.PositiveIntegerField(default=0)
 
     def set_id(self, _id):
         self.id = _id
@@ -44,5 +50,11 @@ class PdfDataSource(models.Model):
     def get_status(self):
         return self.ingest_status
 
+    def set_progress(self, progress):
+        self.ingest_progress = progress
+
+    def get_progress(self):
+        return self.ingest_progress
+
     class Meta:
         db_table = 'pdf_data_sources'  # Replace 'pdf_data_source' with the actual table name in the database
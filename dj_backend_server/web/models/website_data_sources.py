@@ -10,6 +10,10 @@ class WebsiteDataSource(models.Model):
     crawling_progress = models.FloatField(default=0.00)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
+    # Chunks stored for the data source after its last ingestion, and what that ingestion changed
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_added = models.PositiveIntegerField(default=0)
+    chunks_deleted = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'website_data_sources'  # Replace 'website_data_source' with the actual table name in the database
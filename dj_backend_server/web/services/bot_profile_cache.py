@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import Http404
+
+from api.utils.metrics import record_cache_lookup
+from web.models.chatbot import Chatbot
+from web.models.chatbot_settings import ChatbotSetting
+
+logger = logging.getLogger(__name__)
+
+# Profiles are kept in the shared cache, and for BOT_PROFILE_LOCAL_TTL seconds in each process.
+# An update drops both in the process handling it, the other processes see it once their copy expires.
+# Shared entries are stamped with a per-token version that every invalidation bumps, so a reader that
+# loaded the row before an update can't put the old profile back once the update has been invalidated.
+PROFILE_CACHE_TTL = int(os.environ.get('BOT_PROFILE_CACHE_TTL', 3600))
+PROFILE_LOCAL_TTL = float(os.environ.get('BOT_PROFILE_LOCAL_TTL', 10))
+PROFILE_LOCAL_SIZE = int(os.environ.get('BOT_PROFILE_LOCAL_SIZE', 10000))
+
+
+@dataclass(frozen=True)
+class BotProfile:
+    """Immutable snapshot of the bot metadata the chat endpoints need, read in place of a Chatbot row."""
+    id: str
+    token: str
+    name: str
+    website: str
+    status: str
+    prompt_message: str
+    enhanced_privacy: bool
+    smart_sync: bool
+    settings: Tuple[Tuple[str, str], ...] = ()
+
+    @classmethod
+    def from_chatbot(cls, bot: Chatbot) -> "BotProfile":
+        # All settings in one query, Chatbot.get_setting runs one per name
+        settings = ChatbotSetting.objects.filter(chatbot_id=bot.id).order_by('name').values_list('name', 'value')
+        return cls(
+            id=str(bot.id),
+            token=bot.token,
+            name=bot.name,
+            website=bot.website,
+            status=bot.status,
+            prompt_message=bot.prompt_message,
+            enhanced_privacy=bot.enhanced_privacy,
+            smart_sync=bot.smart_sync,
+            settings=tuple(settings),
+        )
+
+    def get_setting(self, name: str) -> Optional[str]:
+        for setting_name, value in self.settings:
+            if setting_name == name:
+                return value
+        return None
+
+    def getName(self) -> str:
+        # Used by the chat.html template
+        return self.name
+
+
+class BotProfileCache:
+    """Resolves bot tokens to profiles from a per-process LRU, then the shared cache, then the database."""
+
+    def __init__(self, local_ttl: float, local_size: int, ttl: int):
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self.ttl = ttl
+        # token -> (expires at, profile or None for an unknown token)
+        self._local: "OrderedDict[str, Tuple[float, Optional[BotProfile]]]" = OrderedDict()
+        # Bumped by every invalidation, a lookup that raced one doesn't fill the local cache
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[BotProfile]:
+        if not token:
+            return None
+
+        found, profile = self._get_local(token)
+        if found:
+            record_cache_lookup('bot_profile', hits=1)
+            return profile
+
+        with self._lock:
+            generation = self._generation
+
+        # The version is read before the row, an invalidation in between leaves the entry stale
+        version, profile = self._get_shared(token)
+        record_cache_lookup('bot_profile', hits=int(profile is not None), misses=int(profile is None))
+
+        if profile is None:
+            bot = Chatbot.objects.filter(token=token).first()
+            profile = BotProfile.from_chatbot(bot) if bot is not None else None
+            if profile is not None and version is not None:
+                self._store_shared(profile, version)
+
+        self._set_local(token, profile, generation)
+        return profile
+
+    async def aget(self, token: str) -> Optional[BotProfile]:
+        found, profile = self._get_local(token)
+        if found:
+            record_cache_lookup('bot_profile', hits=1)
+            return profile
+        return await sync_to_async(self.get)(token)
+
+    def invalidate(self, chatbot_id: str, token: Optional[str] = None) -> None:
+        """Drops the profile of the bot from this process and the shared cache.
+
+        Call it once the change is committed, a reader could otherwise cache the old row again.
+        `token` saves a query when the caller has it, and is needed once the bot is deleted.
+        """
+        chatbot_id = str(chatbot_id)
+        with self._lock:
+            self._generation += 1
+            for local_token in [t for t, (_, profile) in self._local.items() if profile is not None and profile.id == chatbot_id]:
+                del self._local[local_token]
+
+        try:
+            tokens = {cache.get(_id_key(chatbot_id))}
+            if token is None:
+                token = Chatbot.objects.filter(id=chatbot_id).values_list('token', flat=True).first()
+            tokens.add(token)
+            tokens.discard(None)
+
+            for stale_token in tokens:
+                key = _version_key(stale_token)
+                cache.add(key, 0, timeout=None)
+                cache.incr(key)
+            cache.delete_many([_token_key(t) for t in tokens] + [_id_key(chatbot_id)])
+        except Exception as e:
+            logger.warning("Could not invalidate the bot profile of %s: %s", chatbot_id, e)
+
+    def _get_local(self, token: str) -> Tuple[bool, Optional[BotProfile]]:
+        with self._lock:
+            entry = self._local.get(token)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._local[token]
+                return False, None
+            self._local.move_to_end(token)
+            return True, entry[1]
+
+    def _set_local(self, token: str, profile: Optional[BotProfile], generation: int) -> None:
+        # Unknown tokens are remembered too, a misconfigured widget would otherwise query on every message
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._local[token] = (time.monotonic() + self.local_ttl, profile)
+            self._local.move_to_end(token)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _get_shared(self, token: str) -> Tuple[Optional[int], Optional[BotProfile]]:
+        """Returns the current version of the token and its cached profile if it was stored at that version.
+
+        The version is None when the shared cache can't be read, the profile is then not stored either.
+        """
+        try:
+            entries = cache.get_many([_token_key(token), _version_key(token)])
+        except Exception as e:
+            logger.warning("Could not read the bot profile cache: %s", e)
+            return None, None
+
+        version = entries.get(_version_key(token), 0)
+        entry = entries.get(_token_key(token))
+        if not isinstance(entry, tuple) or entry[0] != version:
+            return version, None
+        return version, entry[1]
+
+    def _store_shared(self, profile: BotProfile, version: int) -> None:
+        try:
+            # The id -> token entry lets an update of the bot find the profile to drop
+            cache.set_many({_token_key(profile.token): (version, profile), _id_key(profile.id): profile.token}, self.ttl)
+        except Exception as e:
+            logger.warning("Could not write the bot profile cache: %s", e)
+
+
+def _token_key(token: str) -> str:
+    # Tokens come from request headers, hashing keeps the key short and free of odd characters
+    return f"bot_profile:token:{hashlib.sha1(token.encode('utf-8')).hexdigest()}"
+
+
+def _id_key(chatbot_id: str) -> str:
+    return f"bot_profile:id:{chatbot_id}"
+
+
+def _version_key(token: str) -> str:
+    return f"bot_profile:version:{hashlib.sha1(token.encode('utf-8')).hexdigest()}"
+
+
+bot_profile_cache = BotProfileCache(local_ttl=PROFILE_LOCAL_TTL, local_size=PROFILE_LOCAL_SIZE, ttl=PROFILE_CACHE_TTL)
+
+
+def get_bot_profile_or_404(token: str) -> BotProfile:
+    profile = bot_profile_cache.get(token)
+    if profile is None:
+        raise Http404("No Chatbot matches the given query.")
+    return profile
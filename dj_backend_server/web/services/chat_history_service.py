@@ -1,31 +1,141 @@
-from typing import List, Optional, Tuple
-from web.models.chat_histories import ChatHistory
+import os
+from typing import Iterable, List, Optional, Tuple
+from django.core.cache import cache
+from api.utils.metrics import record_cache_lookup
+from web.models.chat_histories import ChatHistory, is_user_message
+from web.services.chat_history_sink import chat_history_sink, pending_marker_key
+
+# Recent messages of active sessions are kept in the shared cache, so a widget conversation
+# does not query chat_histories on every message. Longer windows bypass the cache.
+HISTORY_CACHE_SIZE = int(os.environ.get('CHAT_HISTORY_CACHE_SIZE', 40))
+HISTORY_CACHE_TTL = int(os.environ.get('CHAT_HISTORY_CACHE_TTL', 1800))
+
 
 def get_chat_history_for_retrieval_chain(session_id: str, limit: Optional[int] = None) -> List[Tuple[str, str]]:
-    """Fetches limited ChatHistory entries by session ID and converts to chat_history format.
+    """Fetches the latest ChatHistory entries by session ID and converts to chat_history format.
 
     Args:
-        session_id (str): The session ID to fetch chat history for 
-        limit (int, optional): Maximum number of entries to retrieve
+        session_id (str): The session ID to fetch chat history for
+        limit (int, optional): Maximum number of entries to retrieve, the most recent ones are kept
 
     Returns:
-        list[tuple[str, str]]: List of tuples of (user_query, bot_response) 
+        list[tuple[str, str]]: List of tuples of (user_query, bot_response), oldest first
     """
-    
-    # Query and limit results if a limit is provided
-    query = ChatHistory.objects.filter(session_id=session_id).order_by('created_at')
+    # Messages stored without a session are not a conversation
+    if not session_id:
+        return []
+
+    if limit and limit <= HISTORY_CACHE_SIZE:
+        values = cache.get_many([_cache_key(session_id), pending_marker_key(session_id)])
+        messages = values.get(_cache_key(session_id))
+        record_cache_lookup('chat_history', hits=int(messages is not None), misses=int(messages is None))
+        if messages is None:
+            messages = _with_pending(session_id, _get_recent_rows(session_id, HISTORY_CACHE_SIZE), HISTORY_CACHE_SIZE)
+            # While writes of the session are queued, here or in another process, the rows read
+            # may miss them and the cached window would stay behind until it expires
+            if pending_marker_key(session_id) not in values:
+                cache.set(_cache_key(session_id), messages, HISTORY_CACHE_TTL)
+        return _to_chat_history(messages[-limit:])
+
+    return _to_chat_history(_with_pending(session_id, _get_recent_rows(session_id, limit), limit))
+
+
+async def aget_chat_history_for_retrieval_chain(session_id: str, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+    """Async variant of get_chat_history_for_retrieval_chain for ASGI views."""
+    # Messages stored without a session are not a conversation
+    if not session_id:
+        return []
+
+    if limit and limit <= HISTORY_CACHE_SIZE:
+        values = await cache.aget_many([_cache_key(session_id), pending_marker_key(session_id)])
+        messages = values.get(_cache_key(session_id))
+        record_cache_lookup('chat_history', hits=int(messages is not None), misses=int(messages is None))
+        if messages is None:
+            messages = _with_pending(session_id, await _aget_recent_rows(session_id, HISTORY_CACHE_SIZE), HISTORY_CACHE_SIZE)
+            if pending_marker_key(session_id) not in values:
+                await cache.aset(_cache_key(session_id), messages, HISTORY_CACHE_TTL)
+        return _to_chat_history(messages[-limit:])
+
+    return _to_chat_history(_with_pending(session_id, await _aget_recent_rows(session_id, limit), limit))
+
+
+def get_recent_messages(session_id: str, limit: Optional[int] = None) -> List[Tuple[bool, str]]:
+    """Returns the last `limit` messages of the session as (from_user, message), oldest first."""
+    return [(from_user, message) for _, from_user, message in _get_recent_rows(session_id, limit)]
+
+
+async def aget_recent_messages(session_id: str, limit: Optional[int] = None) -> List[Tuple[bool, str]]:
+    return [(from_user, message) for _, from_user, message in await _aget_recent_rows(session_id, limit)]
+
+
+def _recent_rows_query(session_id: str, limit: Optional[int]):
+    # Walk the (session_id, created_at) index backwards and only read the newest rows. Rows written
+    # in the same instant keep the question before the answer ('False' sorts before 'True'), then by id.
+    query = ChatHistory.objects.filter(session_id=session_id).order_by('-created_at', 'from_user', 'id').values_list('id', 'from_user', 'message')
     if limit:
         query = query[:limit]
-        
+    return query
+
+
+def _get_recent_rows(session_id: str, limit: Optional[int]) -> List[Tuple[str, bool, str]]:
+    return [(str(row_id), is_user_message(from_user), message) for row_id, from_user, message in reversed(list(_recent_rows_query(session_id, limit)))]
+
+
+async def _aget_recent_rows(session_id: str, limit: Optional[int]) -> List[Tuple[str, bool, str]]:
+    rows = [row async for row in _recent_rows_query(session_id, limit)]
+    return [(str(row_id), is_user_message(from_user), message) for row_id, from_user, message in reversed(rows)]
+
+
+def _with_pending(session_id: str, rows: List[Tuple[str, bool, str]], limit: Optional[int]) -> List[Tuple[bool, str]]:
+    """The stored messages followed by the ones this process still has queued for the session."""
+    stored_ids = {row_id for row_id, _, _ in rows}
+    messages = [(from_user, message) for _, from_user, message in rows]
+    for record in chat_history_sink.pending_records(session_id):
+        if record.question_id not in stored_ids:
+            messages.append((True, record.question))
+        if record.answer_id not in stored_ids:
+            messages.append((False, record.answer))
+    return messages[-limit:] if limit else messages
+
+
+def update_cached_chat_history(session_id: str, entries: Iterable[ChatHistory]) -> None:
+    """Appends freshly stored messages to the cached window of the session, if it is cached."""
+    if not session_id:
+        return
+    key = _cache_key(session_id)
+    messages = cache.get(key)
+    if messages is not None:
+        cache.set(key, _append(messages, entries), HISTORY_CACHE_TTL)
+
+
+async def aupdate_cached_chat_history(session_id: str, entries: Iterable[ChatHistory]) -> None:
+    if not session_id:
+        return
+    key = _cache_key(session_id)
+    messages = await cache.aget(key)
+    if messages is not None:
+        await cache.aset(key, _append(messages, entries), HISTORY_CACHE_TTL)
+
+
+def _append(messages, entries) -> List[Tuple[bool, str]]:
+    messages = messages + [(entry.is_from_user(), entry.message) for entry in entries]
+    return messages[-HISTORY_CACHE_SIZE:]
+
+
+def _cache_key(session_id: str) -> str:
+    return f"chat_history:{session_id}"
+
+
+def _to_chat_history(messages) -> List[Tuple[str, str]]:
     chat_history = []
 
     user_query = None
-    for entry in query:
-        if entry.from_user:
-            user_query = entry.message
+    for from_user, message in messages:
+        if from_user:
+            user_query = message
         else:
             if user_query is not None:
-                chat_history.append((user_query, entry.message))
+                chat_history.append((user_query, message))
                 user_query = None
 
-    return chat_history
\ No newline at end of file
+    return chat_history
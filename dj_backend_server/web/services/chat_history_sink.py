@@ -0,0 +1,274 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from dotenv import load_dotenv
+
+from web.models.chat_histories import ChatHistory
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds a queued write of a session is announced to the other processes, and a record handed
+# to celery is still merged into this process' history reads, see pending_records
+PENDING_TTL = 30
+
+
+class ChatHistoryWriteMode:
+    SYNC = 'sync'  # insert on the request path, as before
+    ASYNC = 'async'  # bounded in-process queue, flushed by a background thread
+    CELERY = 'celery'  # batched into celery tasks, survives a web process restart once dispatched
+
+
+@dataclass
+class ChatHistoryRecord:
+    """One question/answer exchange, written as two chat_histories rows."""
+    chatbot_id: str
+    session_id: Optional[str]
+    question: str
+    answer: str
+    latency_ms: Optional[int] = None
+    asked_at: datetime = field(default_factory=timezone.now)
+    # Fixed when the record is made, a retried write inserts the same rows instead of duplicates
+    question_id: str = field(default_factory=lambda: str(uuid4()))
+    answer_id: str = field(default_factory=lambda: str(uuid4()))
+
+    def to_entries(self) -> List[ChatHistory]:
+        # Strictly after the question, a cache hit answers within the millisecond the latency is floored to
+        answered_at = self.asked_at + timedelta(milliseconds=max(self.latency_ms or 0, 1))
+        return [
+            ChatHistory(id=self.question_id, chatbot_id=self.chatbot_id, session_id=self.session_id, from_user=True, message=self.question, created_at=self.asked_at),
+            ChatHistory(id=self.answer_id, chatbot_id=self.chatbot_id, session_id=self.session_id, from_user=False, message=self.answer, latency_ms=self.latency_ms, created_at=answered_at),
+        ]
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['asked_at'] = self.asked_at.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChatHistoryRecord":
+        return cls(**{**data, 'asked_at': parse_datetime(data['asked_at'])})
+
+
+def write_chat_history_records(records: List[ChatHistoryRecord]) -> None:
+    entries = [entry for record in records for entry in record.to_entries()]
+    ChatHistory.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class ChatHistorySink:
+    """Takes chat history writes off the response path.
+
+    In async and celery mode records go to a bounded queue drained by a daemon thread, which
+    stores them one batch at a time: async mode inserts a batch with one bulk_create, celery
+    mode hands it to one save_chat_history_task. A failed insert is retried with backoff and
+    then handed to celery, a failed dispatch is inserted instead. When the queue is full the
+    record is written synchronously instead of being dropped, so a slow database turns into
+    backpressure. Records still queued when the process exits are flushed by an atexit hook,
+    a killed process loses them.
+    """
+
+    def __init__(self, mode: str, queue_size: int, batch_size: int, flush_interval: float, write_retries: int = 3, retry_delay: float = 0.5):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_retries = write_retries
+        self.retry_delay = retry_delay
+        self._queue: "queue.Queue[Optional[ChatHistoryRecord]]" = queue.Queue(maxsize=queue_size)
+        self._flusher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Records of each session not known to be in chat_histories yet, with their expiry
+        self._pending: Dict[str, List[Tuple[float, ChatHistoryRecord]]] = {}
+        self._pending_lock = threading.Lock()
+
+    @property
+    def is_queued(self) -> bool:
+        return self.mode in (ChatHistoryWriteMode.ASYNC, ChatHistoryWriteMode.CELERY)
+
+    def record(self, record: ChatHistoryRecord) -> None:
+        if self.is_queued:
+            self._ensure_flusher()
+            if self._enqueue(record):
+                if record.session_id:
+                    try:
+                        cache.set(pending_marker_key(record.session_id), True, PENDING_TTL)
+                    except Exception as e:
+                        logger.warning("Could not mark the chat history of the session as pending: %s", e)
+                return
+            logger.warning("Chat history queue is full, writing synchronously")
+
+        write_chat_history_records([record])
+
+    async def arecord(self, record: ChatHistoryRecord) -> None:
+        if self.is_queued:
+            self._ensure_flusher()
+            if self._enqueue(record):
+                if record.session_id:
+                    try:
+                        await cache.aset(pending_marker_key(record.session_id), True, PENDING_TTL)
+                    except Exception as e:
+                        logger.warning("Could not mark the chat history of the session as pending: %s", e)
+                return
+            logger.warning("Chat history queue is full, writing synchronously")
+            await sync_to_async(write_chat_history_records)([record])
+            return
+
+        await sync_to_async(self.record)(record)
+
+    def pending_records(self, session_id: Optional[str]) -> List[ChatHistoryRecord]:
+        """Records of the session this process has not inserted yet, oldest first.
+
+        A record handed to celery stays listed for PENDING_TTL seconds, readers skip the ones
+        whose rows they already found.
+        """
+        if not session_id:
+            return []
+        now = time.monotonic()
+        with self._pending_lock:
+            entries = [(expires_at, record) for expires_at, record in self._pending.get(session_id, []) if expires_at > now]
+            if entries:
+                self._pending[session_id] = entries
+            else:
+                self._pending.pop(session_id, None)
+        return [record for _, record in entries]
+
+    def _enqueue(self, record: ChatHistoryRecord) -> bool:
+        # Tracked first, the flusher may write the record before put_nowait returns
+        self._track([record], float('inf'))
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self._untrack([record])
+            return False
+
+    def _track(self, records: List[ChatHistoryRecord], expires_at: float) -> None:
+        with self._pending_lock:
+            for record in records:
+                if not record.session_id:
+                    continue
+                entries = [(expiry, pending) for expiry, pending in self._pending.get(record.session_id, []) if pending is not record]
+                entries.append((expires_at, record))
+                self._pending[record.session_id] = entries
+
+    def _untrack(self, records: List[ChatHistoryRecord]) -> None:
+        now = time.monotonic()
+        with self._pending_lock:
+            for record in records:
+                entries = [(expiry, pending) for expiry, pending in self._pending.get(record.session_id, []) if pending is not record and expiry > now]
+                if entries:
+                    self._pending[record.session_id] = entries
+                else:
+                    self._pending.pop(record.session_id, None)
+
+    def flush(self) -> None:
+        """Writes every queued record now, on the calling thread."""
+        records = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                records.append(record)
+        if records:
+            self._write(records)
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run, name='chat-history-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            records = [record]
+            # Collect what arrives within the flush interval, up to one batch
+            try:
+                while len(records) < self.batch_size:
+                    record = self._queue.get(timeout=self.flush_interval)
+                    if record is None:
+                        self._write(records)
+                        return
+                    records.append(record)
+            except queue.Empty:
+                pass
+            self._write(records)
+
+    def _write(self, records: List[ChatHistoryRecord]) -> None:
+        inserted = dispatched = False
+        if self.mode == ChatHistoryWriteMode.CELERY:
+            dispatched = self._dispatch(records)
+            inserted = not dispatched and self._insert(records)
+        else:
+            inserted = self._insert(records)
+            dispatched = not inserted and self._dispatch(records)
+
+        if dispatched:
+            # The celery worker inserts them in a moment, until then readers still merge them
+            self._track(records, time.monotonic() + PENDING_TTL)
+        else:
+            if not inserted:
+                logger.error("Could not store %s chat history records, they are lost", len(records))
+            self._untrack(records)
+
+    def _insert(self, records: List[ChatHistoryRecord]) -> bool:
+        for attempt in range(self.write_retries + 1):
+            # Drops a connection a failed attempt left unusable
+            close_old_connections()
+            try:
+                write_chat_history_records(records)
+                return True
+            except Exception as e:
+                logger.warning("Could not write %s chat history records (attempt %s): %s", len(records), attempt + 1, e)
+            if attempt < self.write_retries:
+                time.sleep(self.retry_delay * 2 ** attempt)
+        return False
+
+    def _dispatch(self, records: List[ChatHistoryRecord]) -> bool:
+        from api.tasks import save_chat_history_task
+
+        try:
+            save_chat_history_task.delay([record.to_dict() for record in records])
+            return True
+        except Exception as e:
+            logger.warning("Could not hand %s chat history records to celery: %s", len(records), e)
+            return False
+
+    def stop(self) -> None:
+        if self._flusher is not None and self._flusher.is_alive():
+            self._queue.put(None)
+            self._flusher.join(timeout=10)
+        self.flush()
+
+
+def pending_marker_key(session_id: str) -> str:
+    return f"chat_history:{session_id}:pending"
+
+
+chat_history_sink = ChatHistorySink(
+    mode=os.environ.get('CHAT_HISTORY_WRITE_MODE', ChatHistoryWriteMode.ASYNC),
+    queue_size=int(os.environ.get('CHAT_HISTORY_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('CHAT_HISTORY_BATCH_SIZE', 200)),
+    flush_interval=float(os.environ.get('CHAT_HISTORY_FLUSH_INTERVAL', 1.0)),
+    write_retries=int(os.environ.get('CHAT_HISTORY_WRITE_RETRIES', 3)),
+)
+atexit.register(chat_history_sink.stop)
@@ -0,0 +1,488 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Optional
+from uuid import uuid4
+
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+from dotenv import load_dotenv
+
+from api.interfaces import StoreOptions
+from web.enums.ingest_status_enum import IngestStatusType
+from web.enums.website_data_source_status_enum import WebsiteDataSourceStatusType
+from web.models.codebase_data_sources import CodebaseDataSource
+from web.models.failed_jobs import FailedJob
+from web.models.jobs import Job, JobStage, JobStatus
+from web.models.pdf_data_sources import PdfDataSource
+from web.models.website_data_sources import WebsiteDataSource
+
+if TYPE_CHECKING:
+    from api.utils.chunk_ledger import LedgerStats
+    from api.utils.ingestion_shards import IngestionPlan
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INGESTION_QUEUE = 'ingestion'
+INGESTION_TYPES = ('pdf', 'website', 'codebase')
+
+# Retries of a failed ingestion, after RETRY_BASE_DELAY * 2^n seconds (capped at RETRY_MAX_DELAY)
+MAX_RETRIES = int(os.environ.get('INGESTION_MAX_RETRIES', 3))
+RETRY_BASE_DELAY = int(os.environ.get('INGESTION_RETRY_BASE_DELAY', 30))
+RETRY_MAX_DELAY = int(os.environ.get('INGESTION_RETRY_MAX_DELAY', 900))
+# A running job beats every HEARTBEAT_INTERVAL seconds, it counts as lost after HEARTBEAT_TIMEOUT
+HEARTBEAT_INTERVAL = int(os.environ.get('INGESTION_HEARTBEAT_INTERVAL', 30))
+HEARTBEAT_TIMEOUT = int(os.environ.get('INGESTION_HEARTBEAT_TIMEOUT', 300))
+# A pending job no worker picked up within this many seconds is dispatched again
+DISPATCH_TIMEOUT = int(os.environ.get('INGESTION_DISPATCH_TIMEOUT', 600))
+# A sharded job beats whenever a shard does, shards may wait in the queue for up to this many seconds
+SHARD_TIMEOUT = int(os.environ.get('INGESTION_SHARD_TIMEOUT', 3600))
+
+
+
+class JobSuperseded(Exception):
+    """The job was dispatched again and claimed by another worker, this one must leave it alone."""
+
+
+@dataclass(frozen=True)
+class _Claim:
+    """A worker's hold on a running job: the attempt it claimed, or the run its shards belong to."""
+    job_id: int
+    task_id: Optional[str] = None
+    attempts: Optional[int] = None
+    run_id: Optional[str] = None
+
+    def jobs(self):
+        """The job, as long as it still belongs to this claim."""
+        filters = {'id': self.job_id, 'status': JobStatus.RUNNING}
+        if self.task_id is not None:
+            filters['task_id'] = self.task_id
+        if self.attempts is not None:
+            filters['attempts'] = self.attempts
+        if self.run_id is not None:
+            filters['run_id'] = self.run_id
+        return Job.objects.filter(**filters)
+
+
+_current_job: contextvars.ContextVar[Optional[_Claim]] = contextvars.ContextVar('ingestion_job', default=None)
+
+
+def _timestamp() -> int:
+    return int(time.time())
+
+
+def dispatch_ingestion(type_: str, namespace: str, data_source_id: Optional[str] = None, **arguments) -> Job:
+    """Records an ingestion job and enqueues it once the current transaction commits.
+
+    Arguments are the handler's: `shared_folder` for pdf and website, `repo` for codebase.
+    Called outside of a transaction the job is enqueued right away.
+    """
+    if type_ not in INGESTION_TYPES:
+        raise ValueError(f"Unknown ingestion type {type_}")
+
+    timestamp = _timestamp()
+    job = Job.objects.create(
+        queue=INGESTION_QUEUE,
+        payload=json.dumps({'type': type_, 'namespace': namespace, **arguments}),
+        attempts=0,
+        available_at=timestamp,
+        created_at=timestamp,
+        status=JobStatus.PENDING,
+        chatbot_id=namespace,
+        data_source_id=data_source_id,
+        task_id=str(uuid4()),
+    )
+    _set_data_source_status(job, None)
+    # The worker must not look for a job row the request has not committed yet
+    transaction.on_commit(lambda: enqueue_job(job))
+    return job
+
+
+def enqueue_job(job: Job, countdown: Optional[int] = None) -> None:
+    from api.tasks import ingestion_job_task
+
+    try:
+        ingestion_job_task.apply_async((job.id,), task_id=job.task_id, countdown=countdown)
+    except Exception as e:
+        # The job stays pending, requeue_stale_jobs dispatches it again
+        logger.error("Could not enqueue ingestion job %s: %s", job.id, e)
+
+
+def run_ingestion_job(job_id: int) -> Optional[str]:
+    """Runs the job's ingestion, unless the job is done or another worker is running it.
+
+    A data source with more than one shard is fanned out to ingestion_shard_task and the job
+    stays running until complete_sharded_job. Ingestion is idempotent: the chunk ledger only
+    embeds what is not stored yet, so a retried or redelivered job resumes rather than duplicates.
+    """
+    timestamp = _timestamp()
+    claimed = Job.objects.filter(id=job_id).filter(Q(status__in=[JobStatus.PENDING, JobStatus.RETRYING]) | _lost(timestamp)).update(
+        status=JobStatus.RUNNING, stage=None, attempts=F('attempts') + 1, reserved_at=timestamp, updated_at=timestamp,
+        run_id=None, shards_total=0, shards_done=0,
+    )
+    if not claimed:
+        logger.info("Ingestion job %s is done or running elsewhere, skipped", job_id)
+        return None
+
+    from api.utils.ingestion_shards import is_sharding_enabled
+
+    job = Job.objects.get(id=job_id)
+    payload = json.loads(job.payload)
+    claim = _Claim(job_id, task_id=job.task_id, attempts=job.attempts)
+    token = _current_job.set(claim)
+    heartbeat = _Heartbeat(claim)
+    heartbeat.start()
+    try:
+        if is_sharding_enabled():
+            run_id = str(uuid4())
+            plan = _plan_shards(payload, run_id)
+            if len(plan.shards) > 1:
+                _fan_out(claim, plan, run_id)
+                return JobStatus.RUNNING
+            stats = _ingest_shards(payload, plan, run_id)
+        else:
+            stats = _run_handler(payload)
+        _complete_job(claim, job, stats)
+    except JobSuperseded as e:
+        logger.warning("%s, this attempt stopped", e)
+        return None
+    except Exception:
+        # A failure of an attempt that was taken over is the new attempt's business
+        if not claim.jobs().exists():
+            logger.warning("Ingestion job %s failed after another worker claimed it, not recorded", job_id, exc_info=True)
+            return None
+        raise
+    finally:
+        heartbeat.stop()
+        _current_job.reset(token)
+    return JobStatus.SUCCEEDED
+
+
+def run_ingestion_shard(job_id: int, run_id: str, data_source_id: str, shard: dict) -> Optional[dict]:
+    """Ingests one shard of a fanned out job, skipped once the job was retried or finished without it."""
+    job = Job.objects.filter(id=job_id, run_id=run_id, status=JobStatus.RUNNING).first()
+    if job is None:
+        logger.info("Shard of ingestion job %s belongs to a stale run, skipped", job_id)
+        return None
+
+    from api.utils import get_embeddings
+    from api.utils.init_vector_store import ingest_shard
+
+    payload = json.loads(job.payload)
+    claim = _Claim(job_id, run_id=run_id)
+    token = _current_job.set(claim)
+    heartbeat = _Heartbeat(claim)
+    heartbeat.start()
+    try:
+        stats = ingest_shard(_load_shard(payload, shard), get_embeddings(), StoreOptions(payload['namespace']), data_source_id, run_id)
+    finally:
+        heartbeat.stop()
+        _current_job.reset(token)
+
+    Job.objects.filter(id=job_id, run_id=run_id).update(shards_done=F('shards_done') + 1, updated_at=_timestamp())
+    if payload['type'] == 'pdf':
+        job.refresh_from_db(fields=['shards_done', 'shards_total'])
+        progress = round(min(job.shards_done / job.shards_total * 100, 100), 2) if job.shards_total else 100.0
+        PdfDataSource.objects.filter(folder_name=payload['shared_folder']).update(ingest_progress=progress)
+    return {'added': stats.added, 'unchanged': stats.unchanged}
+
+
+def complete_sharded_job(job_id: int, run_id: str, data_source_id: str, results: List[Optional[dict]]) -> Optional[str]:
+    """Deletes the chunks no shard saw and completes the job, or retries it when a shard failed.
+
+    A retry runs the whole job again, its shards that were stored already only cost a ledger lookup.
+    """
+    job = Job.objects.filter(id=job_id, run_id=run_id, status=JobStatus.RUNNING).first()
+    if job is None:
+        logger.info("Ingestion job %s was retried or finished in the meantime, skipped", job_id)
+        return None
+
+    errors = [result['error'] for result in results if result and 'error' in result]
+    if errors:
+        return retry_job(job_id, f"{len(errors)} of {len(results)} shards failed:\n" + '\n'.join(errors))
+
+    from api.utils.init_vector_store import finalize_ingestion
+
+    payload = json.loads(job.payload)
+    claim = _Claim(job_id, run_id=run_id)
+    token = _current_job.set(claim)
+    try:
+        report_stage(JobStage.UPSERT)
+        ensure_job_owned()
+        added = sum(result['added'] for result in results if result)
+        stats = finalize_ingestion(StoreOptions(payload['namespace']), data_source_id, run_id, changed=added > 0)
+        stats.added = added
+        stats.unchanged = sum(result['unchanged'] for result in results if result)
+        _finish_ingestion(payload)
+        _complete_job(claim, job, stats)
+    except JobSuperseded as e:
+        logger.warning("%s, its shards' run is dropped", e)
+        return None
+    finally:
+        _current_job.reset(token)
+    return JobStatus.SUCCEEDED
+
+
+def retry_job(job_id: int, message: str) -> str:
+    """Records a failed attempt of a fanned out job and enqueues the job again, or fails it."""
+    countdown = _record_failure(job_id, message)
+    if countdown is None:
+        return JobStatus.FAILED
+
+    job = Job.objects.get(id=job_id)
+    job.task_id = str(uuid4())
+    Job.objects.filter(id=job_id).update(task_id=job.task_id)
+    enqueue_job(job, countdown=countdown)
+    return JobStatus.RETRYING
+
+
+def record_job_failure(job_id: int, error: BaseException) -> Optional[int]:
+    """Records a failed attempt, returns the seconds until the retry or None when out of retries.
+
+    Counted on the job rather than the celery message, a job dispatched again by
+    requeue_stale_jobs keeps the attempts it already made.
+    """
+    return _record_failure(job_id, format_error(error))
+
+
+def format_error(error: BaseException) -> str:
+    return ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+
+def get_retry_delay(retries: int) -> int:
+    """Seconds before the retry that follows `retries` earlier retries."""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(retries, 0))
+
+
+def _record_failure(job_id: int, message: str) -> Optional[int]:
+    job = Job.objects.filter(id=job_id).first()
+    if job is None:
+        return None
+
+    if job.attempts <= MAX_RETRIES:
+        countdown = get_retry_delay(job.attempts - 1)
+        Job.objects.filter(id=job_id).update(status=JobStatus.RETRYING, error=message, available_at=_timestamp() + countdown, updated_at=_timestamp())
+        return countdown
+
+    fail_job(job, message)
+    return None
+
+
+def fail_job(job: Job, message: str) -> None:
+    Job.objects.filter(id=job.id).update(status=JobStatus.FAILED, error=message, finished_at=_timestamp(), updated_at=_timestamp())
+    FailedJob.objects.create(uuid=job.task_id or str(uuid4()), connection='celery', queue=job.queue, payload=job.payload, exception=message)
+    _set_data_source_status(job, False)
+
+
+def report_stage(stage: str) -> None:
+    """Records the stage the running ingestion job reached, a no-op outside of a job.
+
+    Loading, embedding and upserting are streamed, so `embed` also covers the parsing of
+    the later documents and the stage only says how far the job got.
+    """
+    claim = _current_job.get()
+    if claim is not None:
+        claim.jobs().update(stage=stage, updated_at=_timestamp())
+
+
+def ensure_job_owned() -> None:
+    """Raises JobSuperseded when the running job was claimed again meanwhile, a no-op outside of a job.
+
+    Called before the stale chunks are deleted: the ledger run of a superseded attempt would
+    delete the chunks the newer attempt stored.
+    """
+    claim = _current_job.get()
+    if claim is not None and not claim.jobs().exists():
+        raise JobSuperseded(f"Ingestion job {claim.job_id} was claimed by another worker")
+
+
+def requeue_stale_jobs() -> dict:
+    """Dispatches jobs whose message or worker was lost again, or fails them when out of attempts."""
+    timestamp = _timestamp()
+    counts = {'requeued': 0, 'failed': 0}
+
+    # The broker lost the message, or the enqueue after the commit failed
+    waiting = Job.objects.filter(queue=INGESTION_QUEUE, status__in=[JobStatus.PENDING, JobStatus.RETRYING], available_at__lt=timestamp - DISPATCH_TIMEOUT)
+    # The worker died without marking the job failed
+    lost = Job.objects.filter(queue=INGESTION_QUEUE).filter(_lost(timestamp))
+
+    for job in list(waiting) + list(lost):
+        if job.attempts > MAX_RETRIES:
+            fail_job(job, job.error or 'The job was lost by its worker')
+            counts['failed'] += 1
+            continue
+        # A running job goes back to retrying, otherwise the new message could not claim it
+        status = JobStatus.RETRYING if job.status == JobStatus.RUNNING else job.status
+        task_id = str(uuid4())
+        updated = Job.objects.filter(id=job.id, status=job.status, updated_at=job.updated_at).update(status=status, available_at=timestamp, task_id=task_id, updated_at=timestamp)
+        if updated:
+            job.task_id = task_id
+            enqueue_job(job)
+            counts['requeued'] += 1
+    return counts
+
+
+def _lost(timestamp: int) -> Q:
+    """Running jobs whose worker stopped beating, or whose shards all stopped."""
+    return Q(status=JobStatus.RUNNING) & (
+        Q(shards_total=0, updated_at__lt=timestamp - HEARTBEAT_TIMEOUT) | Q(shards_total__gt=0, updated_at__lt=timestamp - SHARD_TIMEOUT)
+    )
+
+
+def _complete_job(claim: _Claim, job: Job, stats: Optional['LedgerStats']) -> None:
+    if not claim.jobs().update(status=JobStatus.SUCCEEDED, error=None, finished_at=_timestamp(), updated_at=_timestamp()):
+        raise JobSuperseded(f"Ingestion job {job.id} was claimed by another worker")
+    _set_data_source_status(job, True, stats)
+
+
+def _fan_out(claim: _Claim, plan: 'IngestionPlan', run_id: str) -> None:
+    """Runs the shards in parallel on the ingestion workers, the last one to finish completes the job."""
+    from celery import chord
+    from api.tasks import ingestion_shard_task, ingestion_shards_done_task
+
+    # Recorded first, the shards only run for the job's current run
+    if not claim.jobs().update(run_id=run_id, shards_total=len(plan.shards), stage=JobStage.EMBED, updated_at=_timestamp()):
+        raise JobSuperseded(f"Ingestion job {claim.job_id} was claimed by another worker")
+    header = [ingestion_shard_task.s(claim.job_id, run_id, plan.data_source_id, shard) for shard in plan.shards]
+    chord(header)(ingestion_shards_done_task.s(claim.job_id, run_id, plan.data_source_id))
+    logger.info("Ingestion job %s fanned out to %s shards", claim.job_id, len(plan.shards))
+
+
+def _ingest_shards(payload: dict, plan: 'IngestionPlan', run_id: str) -> 'LedgerStats':
+    """Ingests a plan of at most one shard in the job's own worker."""
+    from api.utils import get_embeddings
+    from api.utils.init_vector_store import finalize_ingestion, ingest_shard
+
+    options = StoreOptions(payload['namespace'])
+    embeddings = get_embeddings()
+    added = unchanged = 0
+    report_stage(JobStage.EMBED)
+    for shard in plan.shards:
+        shard_stats = ingest_shard(_load_shard(payload, shard, single=True), embeddings, options, plan.data_source_id, run_id)
+        added += shard_stats.added
+        unchanged += shard_stats.unchanged
+
+    report_stage(JobStage.UPSERT)
+    ensure_job_owned()
+    stats = finalize_ingestion(options, plan.data_source_id, run_id, changed=added > 0)
+    stats.added, stats.unchanged = added, unchanged
+    _finish_ingestion(payload)
+    return stats
+
+
+def _plan_shards(payload: dict, run_id: str) -> 'IngestionPlan':
+    # Imported here, the handlers pull in the vector store and LLM clients
+    from api.data_sources.codebase_handler import plan_codebase_shards
+    from api.data_sources.pdf_handler import plan_pdf_shards
+    from api.data_sources.website_handler import plan_website_shards
+
+    type_ = payload['type']
+    if type_ == 'pdf':
+        report_stage(JobStage.PARSE)
+        return plan_pdf_shards(payload['shared_folder'])
+    elif type_ == 'website':
+        report_stage(JobStage.PARSE)
+        return plan_website_shards(payload['shared_folder'])
+    elif type_ == 'codebase':
+        return plan_codebase_shards(repo_path=payload['repo'], namespace=payload['namespace'], run_id=run_id)
+    raise ValueError(f"Unknown ingestion type {type_}")
+
+
+def _load_shard(payload: dict, shard: dict, single: bool = False):
+    """Streams the split documents of a shard, `single` when the shard is the whole data source."""
+    from api.data_sources.codebase_handler import load_codebase_shard
+    from api.data_sources.pdf_handler import load_pdf_shard, progress_reporter
+    from api.data_sources.website_handler import load_website_shard
+
+    type_ = payload['type']
+    if type_ == 'pdf':
+        # The pages of a single shard are the upload's, shards of a larger one report as they finish
+        on_progress = progress_reporter(payload['shared_folder']) if single else None
+        return load_pdf_shard(shard, on_progress=on_progress)
+    elif type_ == 'website':
+        return load_website_shard(shard)
+    elif type_ == 'codebase':
+        return load_codebase_shard(payload['namespace'], shard)
+    raise ValueError(f"Unknown ingestion type {type_}")
+
+
+def _finish_ingestion(payload: dict) -> None:
+    if payload['type'] == 'pdf':
+        from api.data_sources.pdf_handler import finish_pdf_ingestion
+
+        finish_pdf_ingestion(payload['shared_folder'])
+
+
+def _run_handler(payload: dict) -> Optional['LedgerStats']:
+    # Imported here, the handlers pull in the vector store and LLM clients
+    from api.data_sources.codebase_handler import codebase_handler
+    from api.data_sources.pdf_handler import pdf_handler
+    from api.data_sources.website_handler import website_handler
+
+    type_ = payload['type']
+    if type_ == 'pdf':
+        return pdf_handler(shared_folder=payload['shared_folder'], namespace=payload['namespace'])
+    elif type_ == 'website':
+        return website_handler(shared_folder=payload['shared_folder'], namespace=payload['namespace'])
+    elif type_ == 'codebase':
+        return codebase_handler(repo_path=payload['repo'], namespace=payload['namespace'])
+    raise ValueError(f"Unknown ingestion type {type_}")
+
+
+def _set_data_source_status(job: Job, succeeded: Optional[bool], stats: Optional['LedgerStats'] = None) -> None:
+    """Mirrors the job on its data source row: pending (None), success or failure, and the chunk counts."""
+    payload = json.loads(job.payload)
+    type_ = payload['type']
+    counts = {}
+    if stats is not None:
+        counts = {'chunks_total': stats.total, 'chunks_added': stats.added, 'chunks_deleted': stats.deleted}
+
+    if type_ == 'pdf':
+        status = IngestStatusType.PENDING if succeeded is None else IngestStatusType.SUCCESS if succeeded else IngestStatusType.FAILED
+        PdfDataSource.objects.filter(folder_name=payload['shared_folder']).update(ingest_status=status.value, **counts)
+    elif type_ == 'codebase':
+        status = IngestStatusType.PENDING if succeeded is None else IngestStatusType.SUCCESS if succeeded else IngestStatusType.FAILED
+        fields = {'ingestion_status': status.value, **counts}
+        if succeeded is not None:
+            fields['ingested_at'] = now()
+        CodebaseDataSource.objects.filter(chatbot_id=payload['namespace'], repository=payload['repo']).update(**fields)
+    elif type_ == 'website' and succeeded is not None:
+        # Pending is the crawler's to set, the website is being crawled until then
+        if succeeded:
+            WebsiteDataSource.objects.filter(id=payload['shared_folder']).update(crawling_status=WebsiteDataSourceStatusType.COMPLETED.value, vector_databased_last_ingested_at=now(), **counts)
+        else:
+            WebsiteDataSource.objects.filter(id=payload['shared_folder']).update(crawling_status=WebsiteDataSourceStatusType.FAILED.value)
+
+
+class _Heartbeat:
+    def __init__(self, claim: _Claim):
+        self.claim = claim
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            while not self._stopped.wait(HEARTBEAT_INTERVAL):
+                # A missed beat must not end the heartbeat, the job would be dispatched again while it runs
+                try:
+                    self.claim.jobs().update(updated_at=_timestamp())
+                except Exception as e:
+                    logger.warning("Ingestion job %s missed a heartbeat: %s", self.claim.job_id, e)
+                    close_old_connections()
+        finally:
+            connections.close_all()
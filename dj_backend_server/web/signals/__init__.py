@@ -1 +1 @@
-from . import chatbot_was_created, codebase_datasource_was_created, pdf_datasource_was_added, website_data_source_crawling_was_completed, website_data_source_was_added
\ No newline at end of file
+from . import chatbot_was_created, codebase_datasource_was_created, pdf_datasource_was_added, website_data_source_crawling_was_completed, website_data_source_was_added, chatbot_was_updated
\ No newline at end of file
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# sender, chatbot_id
+chatbot_was_updated = Signal()
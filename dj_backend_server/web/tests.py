@@ -1,3 +1,158 @@
-from django.test import TestCase
+import json
+import time
+from unittest import mock
+from uuid import uuid4
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from web.models.chat_histories import ChatHistory
+from web.models.failed_jobs import FailedJob
+from web.models.jobs import Job, JobStatus
+from web.services import ingestion_jobs
+from web.services.chat_history_service import get_recent_messages
+from web.services.chat_history_sink import ChatHistoryRecord, write_chat_history_records
+from web.services.ingestion_jobs import complete_sharded_job, get_retry_delay, requeue_stale_jobs, run_ingestion_job
+
+
+def create_job(**fields) -> Job:
+    timestamp = int(time.time())
+    values = dict(
+        queue=ingestion_jobs.INGESTION_QUEUE,
+        payload=json.dumps({'type': 'website', 'namespace': str(uuid4()), 'shared_folder': str(uuid4())}),
+        attempts=0,
+        available_at=timestamp,
+        created_at=timestamp,
+        status=JobStatus.PENDING,
+        task_id=str(uuid4()),
+    )
+    values.update(fields)
+    return Job.objects.create(**values)
+
+
+@mock.patch.dict('os.environ', {'INGESTION_SHARDING_ENABLED': 'false'})
+@mock.patch.object(ingestion_jobs, 'enqueue_job')
+class IngestionJobTests(TestCase):
+    def test_a_job_runs_on_one_worker_only(self, enqueue_job):
+        job = create_job()
+        runs = []
+
+        def handler(payload):
+            runs.append(payload)
+            # The message is delivered to a second worker while the first one runs the job
+            self.assertIsNone(run_ingestion_job(job.id))
+            return None
+
+        with mock.patch.object(ingestion_jobs, '_run_handler', handler):
+            self.assertEqual(run_ingestion_job(job.id), JobStatus.SUCCEEDED)
+            # And once more after it is done
+            self.assertIsNone(run_ingestion_job(job.id))
+
+        job.refresh_from_db()
+        self.assertEqual(len(runs), 1)
+        self.assertEqual((job.status, job.attempts), (JobStatus.SUCCEEDED, 1))
+
+    def test_superseded_attempt_leaves_the_job_alone(self, enqueue_job):
+        job = create_job()
+
+        def handler(payload):
+            # The sweep took the job for lost and another worker claimed it meanwhile
+            Job.objects.filter(id=job.id).update(status=JobStatus.RETRYING, task_id=str(uuid4()))
+            Job.objects.filter(id=job.id).update(status=JobStatus.RUNNING, attempts=2)
+            return None
+
+        with mock.patch.object(ingestion_jobs, '_run_handler', handler):
+            self.assertIsNone(run_ingestion_job(job.id))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JobStatus.RUNNING, 2))
+
+    def test_stale_running_job_is_requeued(self, enqueue_job):
+        stale_at = int(time.time()) - ingestion_jobs.HEARTBEAT_TIMEOUT - 1
+        stale = create_job(status=JobStatus.RUNNING, attempts=1, updated_at=stale_at)
+        beating = create_job(status=JobStatus.RUNNING, attempts=1, updated_at=int(time.time()))
+
+        self.assertEqual(requeue_stale_jobs(), {'requeued': 1, 'failed': 0})
+
+        requeued = Job.objects.get(id=stale.id)
+        self.assertEqual(requeued.status, JobStatus.RETRYING)
+        self.assertNotEqual(requeued.task_id, stale.task_id)
+        self.assertEqual(enqueue_job.call_args.args[0].id, stale.id)
+        self.assertEqual(Job.objects.get(id=beating.id).status, JobStatus.RUNNING)
+
+        # The new message claims the job, the lost worker's claim is void
+        with mock.patch.object(ingestion_jobs, '_run_handler', return_value=None):
+            self.assertEqual(run_ingestion_job(stale.id), JobStatus.SUCCEEDED)
+        self.assertFalse(ingestion_jobs._Claim(stale.id, task_id=stale.task_id, attempts=1).jobs().exists())
+
+    def test_stale_job_out_of_attempts_fails(self, enqueue_job):
+        stale_at = int(time.time()) - ingestion_jobs.HEARTBEAT_TIMEOUT - 1
+        job = create_job(status=JobStatus.RUNNING, attempts=ingestion_jobs.MAX_RETRIES + 1, updated_at=stale_at)
+
+        self.assertEqual(requeue_stale_jobs(), {'requeued': 0, 'failed': 1})
+
+        self.assertEqual(Job.objects.get(id=job.id).status, JobStatus.FAILED)
+        self.assertTrue(FailedJob.objects.filter(uuid=job.task_id).exists())
+        enqueue_job.assert_not_called()
+
+    def test_failed_shard_retries_the_job(self, enqueue_job):
+        run_id = str(uuid4())
+        job = create_job(status=JobStatus.RUNNING, attempts=2, run_id=run_id, shards_total=2)
+
+        results = [{'added': 3, 'unchanged': 0}, {'error': 'Traceback: boom'}]
+        self.assertEqual(complete_sharded_job(job.id, run_id, 'source', results), JobStatus.RETRYING)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.RETRYING)
+        self.assertIn('1 of 2 shards failed', job.error)
+        self.assertIn('boom', job.error)
+        self.assertEqual(enqueue_job.call_args.kwargs['countdown'], get_retry_delay(1))
+        self.assertEqual(enqueue_job.call_args.args[0].task_id, job.task_id)
+
+    def test_failed_shard_out_of_attempts_fails_the_job(self, enqueue_job):
+        run_id = str(uuid4())
+        job = create_job(status=JobStatus.RUNNING, attempts=ingestion_jobs.MAX_RETRIES + 1, run_id=run_id, shards_total=1)
+
+        self.assertEqual(complete_sharded_job(job.id, run_id, 'source', [{'error': 'boom'}]), JobStatus.FAILED)
+        self.assertEqual(Job.objects.get(id=job.id).status, JobStatus.FAILED)
+        enqueue_job.assert_not_called()
+
+    def test_results_of_a_stale_run_are_ignored(self, enqueue_job):
+        job = create_job(status=JobStatus.RUNNING, attempts=1, run_id=str(uuid4()), shards_total=1)
+
+        self.assertIsNone(complete_sharded_job(job.id, str(uuid4()), 'source', [{'error': 'boom'}]))
+        self.assertEqual(Job.objects.get(id=job.id).status, JobStatus.RUNNING)
+
+    def test_retry_delay_backs_off_up_to_the_cap(self, enqueue_job):
+        delays = [get_retry_delay(retries) for retries in range(10)]
+        self.assertEqual(delays[:3], [ingestion_jobs.RETRY_BASE_DELAY * factor for factor in (1, 2, 4)])
+        self.assertEqual(delays[-1], ingestion_jobs.RETRY_MAX_DELAY)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'web-tests'}})
+class ChatHistoryTests(TestCase):
+    def test_instant_answer_is_stored_after_its_question(self):
+        question, answer = ChatHistoryRecord(chatbot_id='bot', session_id='session', question='hi', answer='hello', latency_ms=0).to_entries()
+
+        self.assertGreater(answer.created_at, question.created_at)
+        self.assertEqual(answer.latency_ms, 0)
+
+    def test_messages_of_the_same_instant_keep_their_order(self):
+        asked_at = timezone.now()
+        for number in range(5):
+            ChatHistory.objects.bulk_create([
+                ChatHistory(id=str(uuid4()), session_id='session', from_user=False, message=f'answer {number}', created_at=asked_at),
+                ChatHistory(id=str(uuid4()), session_id='session', from_user=True, message=f'question {number}', created_at=asked_at),
+            ])
+            asked_at += timezone.timedelta(seconds=1)
+
+        self.assertEqual(get_recent_messages('session', limit=4), [(True, 'question 3'), (False, 'answer 3'), (True, 'question 4'), (False, 'answer 4')])
+
+    def test_stored_records_come_back_in_order(self):
+        asked_at = timezone.now()
+        write_chat_history_records([
+            ChatHistoryRecord(chatbot_id='bot', session_id='session', question=f'question {number}', answer=f'answer {number}', latency_ms=0, asked_at=asked_at + timezone.timedelta(seconds=number))
+            for number in range(3)
+        ])
+
+        self.assertEqual(get_recent_messages('session'), [message for number in range(3) for message in ((True, f'question {number}'), (False, f'answer {number}'))])
@@ -7,6 +7,9 @@ from django.urls import reverse
 from web.models.chatbot import Chatbot
 from web.models.chatbot_settings import ChatbotSetting
 from web.models.chat_histories import ChatHistory
+from web.services.chat_history_service import get_chat_history_for_retrieval_chain
+from web.services.chat_history_sink import ChatHistoryRecord, chat_history_sink
+from web.services.bot_profile_cache import get_bot_profile_or_404
 from web.models.codebase_data_sources import CodebaseDataSource
 from web.signals.codebase_datasource_was_created import codebase_data_source_added
 from web.signals.pdf_datasource_was_added import pdf_data_source_added
@@ -15,6 +18,7 @@ from django.views.decorators.http import require_POST
 from django.http import JsonResponse, HttpResponseServerError
 from web.signals.codebase_datasource_was_created import codebase_data_source_added
 from web.signals.chatbot_was_created import chatbot_was_created
+from web.signals.chatbot_was_updated import chatbot_was_updated
 from web.enums.chatbot_initial_prompt_enum import ChatBotInitialPromptEnum
 from web.enums.common_enums import ChatBotDefaults
 from uuid import uuid4
@@ -90,25 +94,25 @@ def update_character_settings(request, id):
     chatbot = Chatbot.objects.get(id=chatbot_id)
     # chatbot.create_or_update_setting('character_name', character_name)
     ChatbotSetting.objects.update_or_create(chatbot_id=chatbot.id, defaults={'name': character_name})
+    chatbot_was_updated.send(sender='update_character_settings', chatbot_id=chatbot.id)
     return HttpResponseRedirect(reverse('onboarding.done', args=[str(chatbot.id)]))
 
 @require_POST
 def send_message(request, token):
     # Find the chatbot by token
-    bot = get_object_or_404(Chatbot, token=token)
+    bot = get_bot_profile_or_404(token)
+
+    asked_at = timezone.now()
 
     # Get the question and history from the request
     question = request.POST.get('question')
     session_id = get_session_id(request=request, bot_id=bot.id)
-    history = ChatHistory.objects.filter(session_id=session_id)
+    # Only the latest turns are sent along, as (question, answer) pairs
+    history = get_chat_history_for_retrieval_chain(session_id, limit=40)
 
-    print(history)
     mode = request.POST.get('mode')
     initial_prompt = bot.prompt_message
 
-    # Remove null and empty values and empty arrays or objects from the history
-    history = [value for value in history if value is not None and value != '' and value != [] and value != {}]
-
     # Call the API to send the message to the chatbot with a timeout of 5 seconds
     try:
         response = requests.post("http://localhost:3000/api/chat", json={
@@ -128,21 +132,15 @@ def send_message(request, token):
     session_id = get_session_id(request, bot.id)
 
     if session_id is not None:
-        # Save chat history
-        ChatHistory.objects.create(
-            id=uuid4(),
-            chatbot=bot,
-            from_user=True,
-            message=question,
-            session_id=session_id
-        )
-        ChatHistory.objects.create(
-            id=uuid4(),
-            chatbot=bot,
-            from_user=False,
-            message=bot_response['botReply'],
-            session_id=session_id
-        )
+        # Save chat history, both messages are inserted in one batch off the response path
+        chat_history_sink.record(ChatHistoryRecord(
+            chatbot_id=bot.id,
+            session_id=session_id,
+            question=question,
+            answer=bot_response['botReply'],
+            latency_ms=int((timezone.now() - asked_at).total_seconds() * 1000),
+            asked_at=asked_at,
+        ))
 
     # Return the response from the chatbot
     return JsonResponse({
@@ -153,7 +151,7 @@ def send_message(request, token):
 
 def get_chat_view(request, token):
     # Find the chatbot by token
-    bot = get_object_or_404(Chatbot, token=token)
+    bot = get_bot_profile_or_404(token)
 
     # Initiate a cookie if it doesn't exist
     cookie_name = 'chatbot_' + str(bot.id)
@@ -11,6 +11,7 @@ from web.models.codebase_data_sources import CodebaseDataSource
 from web.enums.chatbot_initial_prompt_enum import ChatBotInitialPromptEnum
 from django.db.models import Count, Min
 from web.models.crawled_pages import CrawledPages
+from web.signals.chatbot_was_updated import chatbot_was_updated
 import os
 from django.http import HttpResponseNotFound, FileResponse
 
@@ -29,6 +30,7 @@ def general_settings(request, id):
 def delete_bot(request, id):
     bot = get_object_or_404(Chatbot, id=id)
     bot.delete()
+    chatbot_was_updated.send(sender='delete_bot', chatbot_id=id)
     return redirect('index')
 
 
@@ -43,6 +45,7 @@ def general_settings_update(request, id):
         bot.name = name
         bot.prompt_message = request.POST.get('prompt_message', ChatBotInitialPromptEnum.AI_ASSISTANT_INITIAL_PROMPT.value)
         bot.save()
+        chatbot_was_updated.send(sender='general_settings_update', chatbot_id=bot.id)
         return redirect('chatbot.settings', id=id)
 
     return HttpResponse("Method not allowed.", status=405)
@@ -56,7 +59,7 @@ def history_settings(request, id):
 
 def get_history_by_session_id(request, id, session_id):
     bot = get_object_or_404(Chatbot, id=id)
-    chat_history = ChatHistory.objects.filter(chatbot_id=bot.id, session_id=session_id).order_by('created_at')
+    chat_history = ChatHistory.objects.filter(chatbot_id=bot.id, session_id=session_id).order_by('created_at', '-from_user', '-id')
     return render(request, 'widgets/chat-history.html', {'chatHistory': chat_history})
 
 
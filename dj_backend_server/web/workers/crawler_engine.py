@@ -0,0 +1,276 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Optional
+from urllib.parse import urlparse, urlunparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CrawlerSettings:
+    max_pages: int = 15
+    concurrency: int = 8
+    per_host_concurrency: int = 4
+    delay: float = 0.25
+    timeout: float = 15.0
+    user_agent: str = 'OpenChatBot'
+    respect_robots: bool = True
+
+    @classmethod
+    def from_env(cls, max_pages: Optional[int] = None) -> "CrawlerSettings":
+        return cls(
+            max_pages=max_pages if max_pages is not None else int(os.environ.get('MAX_PAGES_CRAWL', 15)),
+            concurrency=int(os.environ.get('CRAWLER_CONCURRENCY', 8)),
+            per_host_concurrency=int(os.environ.get('CRAWLER_PER_HOST_CONCURRENCY', 4)),
+            delay=float(os.environ.get('CRAWLER_DELAY', 0.25)),
+            timeout=float(os.environ.get('CRAWLER_TIMEOUT', 15)),
+            user_agent=os.environ.get('CRAWLER_USER_AGENT', 'OpenChatBot'),
+            respect_robots=os.environ.get('CRAWLER_RESPECT_ROBOTS', 'true').lower() == 'true',
+        )
+
+
+@dataclass
+class FetchedPage:
+    url: str
+    status_code: int
+    html: str
+
+
+@dataclass
+class CrawlStats:
+    fetched: int = 0
+    processed: int = 0
+    failed: int = 0
+    disallowed: int = 0
+    elapsed: float = 0.0
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+def normalize_url(url: str) -> str:
+    """Drops the query string and fragment, so every page is visited once."""
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
+
+
+class HostThrottle:
+    """Caps the concurrent requests per host and spaces them at least `delay` seconds apart."""
+
+    def __init__(self, per_host_concurrency: int, delay: float):
+        self.per_host_concurrency = per_host_concurrency
+        self.delay = delay
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._next_slot: Dict[str, float] = {}
+        self._delays: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def set_delay(self, host: str, delay: float) -> None:
+        with self._lock:
+            self._delays[host] = max(self.delay, delay)
+
+    def acquire(self, host: str) -> None:
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.per_host_concurrency))
+        semaphore.acquire()
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self._delays.get(host, self.delay)
+        if slot > now:
+            time.sleep(slot - now)
+
+    def release(self, host: str) -> None:
+        self._semaphores[host].release()
+
+
+class RobotsCache:
+    """Fetches and caches robots.txt once per host."""
+
+    def __init__(self, session: requests.Session, user_agent: str, timeout: float):
+        self.session = session
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self._parsers: Dict[str, RobotFileParser] = {}
+        self._host_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> RobotFileParser:
+        parsed = urlparse(url)
+        host = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            host_lock = self._host_locks.setdefault(host, threading.Lock())
+
+        with host_lock:
+            parser = self._parsers.get(host)
+            if parser is None:
+                parser = self._fetch(host)
+                self._parsers[host] = parser
+        return parser
+
+    def _fetch(self, host: str) -> RobotFileParser:
+        parser = RobotFileParser(f"{host}/robots.txt")
+        try:
+            response = self.session.get(parser.url, timeout=self.timeout)
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(response.text.splitlines())
+        except requests.exceptions.RequestException:
+            # Same as RobotFileParser.read, an unreachable robots.txt does not block the crawl
+            parser.allow_all = True
+        return parser
+
+
+class CrawlerEngine:
+    """Breadth-first crawler: a pool of fetch workers feeding a separate page processing stage.
+
+    Fetching is I/O bound and runs on `concurrency` threads sharing one pooled session.
+    Fetched pages go through a queue to a single processing thread, which parses and
+    stores them and returns the links found on the page. The coordinator (the calling
+    thread) owns the frontier and the visited set, so neither needs a lock.
+    """
+
+    def __init__(self, settings: CrawlerSettings):
+        self.settings = settings
+        self.session = self._build_session()
+        self.throttle = HostThrottle(settings.per_host_concurrency, settings.delay)
+        self.robots = RobotsCache(self.session, settings.user_agent, settings.timeout)
+
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.settings.concurrency, pool_maxsize=self.settings.concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['User-Agent'] = self.settings.user_agent
+        return session
+
+    def crawl(
+        self,
+        root_url: str,
+        process_page: Callable[[FetchedPage], Iterable[str]],
+        on_progress: Optional[Callable[[int], None]] = None,
+        on_processing_done: Optional[Callable[[], None]] = None,
+    ) -> CrawlStats:
+        """Crawls from `root_url` until the frontier is empty or `max_pages` pages were fetched.
+
+        `process_page` runs on the processing thread and returns the links to follow.
+        `on_processing_done` runs on that thread once it has drained, e.g. to close its DB connection.
+        """
+        stats = CrawlStats()
+        started_at = time.monotonic()
+        events = queue.Queue()
+        pages = queue.Queue()
+
+        processor = threading.Thread(target=self._process_pages, args=(pages, events, process_page, on_processing_done), daemon=True)
+        processor.start()
+
+        root_url = normalize_url(root_url)
+        frontier = deque([root_url])
+        visited = {root_url}
+        scheduled = in_flight = pending_pages = 0
+
+        with ThreadPoolExecutor(max_workers=self.settings.concurrency, thread_name_prefix='crawler') as pool:
+            try:
+                while True:
+                    while frontier and in_flight < self.settings.concurrency and scheduled < self.settings.max_pages:
+                        pool.submit(self._fetch, frontier.popleft(), events)
+                        scheduled += 1
+                        in_flight += 1
+
+                    if in_flight == 0 and pending_pages == 0:
+                        break
+
+                    kind, url, payload = events.get()
+                    if kind == 'fetched':
+                        in_flight -= 1
+                        stats.fetched += 1
+                        pages.put(payload)
+                        pending_pages += 1
+                    elif kind == 'disallowed':
+                        # Pages blocked by robots.txt do not count against the page budget
+                        in_flight -= 1
+                        scheduled -= 1
+                        stats.disallowed += 1
+                    elif kind == 'failed':
+                        in_flight -= 1
+                        stats.failed += 1
+                        stats.errors[url] = payload
+                    elif kind == 'processed':
+                        pending_pages -= 1
+                        stats.processed += 1
+                        for link in payload:
+                            link = normalize_url(link)
+                            if link not in visited:
+                                visited.add(link)
+                                frontier.append(link)
+                        if on_progress:
+                            on_progress(stats.fetched + stats.failed)
+            finally:
+                pages.put(None)
+
+        processor.join()
+        stats.elapsed = time.monotonic() - started_at
+        logger.info("Crawled %s: %s fetched, %s failed, %s disallowed in %.1fs", root_url, stats.fetched, stats.failed, stats.disallowed, stats.elapsed)
+        return stats
+
+    def _fetch(self, url: str, events: queue.Queue) -> None:
+        try:
+            if self.settings.respect_robots:
+                robots = self.robots.get(url)
+                if not robots.can_fetch(self.settings.user_agent, url):
+                    events.put(('disallowed', url, None))
+                    return
+                crawl_delay = robots.crawl_delay(self.settings.user_agent)
+                if crawl_delay:
+                    self.throttle.set_delay(urlparse(url).netloc, float(crawl_delay))
+
+            host = urlparse(url).netloc
+            self.throttle.acquire(host)
+            try:
+                response = self.session.get(url, timeout=self.settings.timeout)
+            finally:
+                self.throttle.release(host)
+            response.raise_for_status()
+
+            content_type = response.headers.get('Content-Type', 'text/html')
+            if 'html' not in content_type:
+                events.put(('failed', url, f"Unsupported content type {content_type}"))
+                return
+
+            events.put(('fetched', url, FetchedPage(url=url, status_code=response.status_code, html=response.text)))
+        except Exception as e:
+            events.put(('failed', url, str(e)))
+
+    def _process_pages(self, pages: queue.Queue, events: queue.Queue, process_page, on_processing_done) -> None:
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    break
+                links = []
+                try:
+                    links = list(process_page(page))
+                except Exception:
+                    logger.exception(f"An unexpected error occurred while processing URL: {page.url}")
+                events.put(('processed', page.url, links))
+        finally:
+            if on_processing_done:
+                on_processing_done()
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,128 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+from urllib.parse import urljoin, urlparse, urlunparse
+
+import lxml.html
+from lxml import etree
+
+# Elements that never carry page content
+EXCLUDED_TAGS = ['script', 'style', 'noscript', 'template', 'svg', 'iframe', 'head']
+# Page chrome repeated on every page of a site
+BOILERPLATE_TAGS = ['nav', 'footer', 'aside']
+BOILERPLATE_ROLES = {'navigation', 'contentinfo', 'banner', 'search'}
+BOILERPLATE_CLASSES = {'skip', 'menu', 'dropdown', 'navbar', 'sidebar', 'breadcrumb', 'breadcrumbs', 'cookie-banner'}
+BLOCK_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'pre', 'blockquote', 'td', 'th', 'dt', 'dd', 'figcaption'}
+# Elements that separate words even when the markup has no whitespace between them
+SEPARATOR_TAGS = BLOCK_TAGS | {'div', 'section', 'article', 'header', 'main', 'ul', 'ol', 'dl', 'table', 'tr', 'br'}
+# Blocks whose text is mostly link text (e.g. "related articles" lists) are treated as boilerplate
+MAX_LINK_DENSITY = 0.6
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+@dataclass
+class ExtractedPage:
+    text: str = ''
+    title: Optional[str] = None
+    links: List[str] = field(default_factory=list)
+    blocks: List[str] = field(default_factory=list)
+
+
+def extract_page(html: str, url: str, root_url: Optional[str] = None) -> ExtractedPage:
+    """Parses the document once and returns its cleaned text, title, same-site links and main content blocks.
+
+    Links are collected before boilerplate is removed, navigation menus are how a crawler
+    discovers most of a site.
+    """
+    tree = _parse(html)
+    if tree is None:
+        return ExtractedPage()
+
+    title = _normalize(tree.findtext('.//title') or '') or None
+    links = _extract_links(tree, url, root_url or url)
+
+    etree.strip_elements(tree, *EXCLUDED_TAGS, etree.Comment, with_tail=False)
+    _drop_boilerplate(tree)
+
+    for element in tree.iter(*SEPARATOR_TAGS):
+        element.tail = ' ' + element.tail if element.tail else ' '
+
+    content_root = _find_content_root(tree)
+    blocks = _extract_blocks(content_root)
+    text = _normalize(content_root.text_content())
+
+    if title is None:
+        heading = content_root.find('.//h1')
+        if heading is not None:
+            title = _normalize(heading.text_content()) or None
+
+    return ExtractedPage(text=text, title=title, links=links, blocks=blocks)
+
+
+def _parse(html: str) -> Optional[lxml.html.HtmlElement]:
+    if not html or not html.strip():
+        return None
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        return lxml.html.document_fromstring(html.encode('utf-8'))
+    except etree.ParserError:
+        return None
+
+
+def _extract_links(tree, url: str, root_url: str) -> List[str]:
+    root = urlparse(root_url)
+    links, seen = [], set()
+    for anchor in tree.iter('a'):
+        href = (anchor.get('href') or '').strip()
+        if not href or href.startswith(('#', 'mailto:', 'tel:', 'javascript:')):
+            continue
+        parsed = urlparse(urljoin(url, href))
+        # Remove query parameters and fragments, and any URL that leaves the root host
+        if parsed.scheme != root.scheme or parsed.netloc != root.netloc:
+            continue
+        link = urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
+        if link not in seen:
+            seen.add(link)
+            links.append(link)
+    return links
+
+
+def _drop_boilerplate(tree) -> None:
+    for element in list(tree.iter(*BOILERPLATE_TAGS, 'div', 'section', 'ul', 'header')):
+        if element.getparent() is None:
+            continue
+        classes = set((element.get('class') or '').split()) | {element.get('id') or ''}
+        if element.tag in BOILERPLATE_TAGS or element.get('role') in BOILERPLATE_ROLES or classes & BOILERPLATE_CLASSES:
+            element.drop_tree()
+
+
+def _find_content_root(tree):
+    for path in ('//main', '//*[@role="main"]', '//article'):
+        found = tree.xpath(path)
+        if found:
+            return found[0]
+    body = tree.find('body')
+    return body if body is not None else tree
+
+
+def _extract_blocks(content_root) -> List[str]:
+    blocks = []
+    for element in content_root.iter(*BLOCK_TAGS):
+        # Nested blocks (a <p> inside an <li>) are part of their outermost block
+        if any(ancestor.tag in BLOCK_TAGS for ancestor in element.iterancestors()):
+            continue
+        text = _normalize(element.text_content())
+        if not text:
+            continue
+        link_text = sum(len(_normalize(a.text_content())) for a in element.iter('a'))
+        if link_text / len(text) > MAX_LINK_DENSITY:
+            continue
+        blocks.append(text)
+    return blocks
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(' ', text).strip()